@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The notebook helpers share the app's modules (streamlit/) instead of keeping copies:
+# the recommender, the compact catalog dtypes and the quantile sketch exist once
+STREAMLIT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'streamlit')
+if STREAMLIT_DIR not in sys.path:
+    sys.path.append(STREAMLIT_DIR)
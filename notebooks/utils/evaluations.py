@@ -13,6 +13,25 @@ class RecommenderEvaluator:
         self.data = data
         self.all_recommendations = set()
     
+    def get_recommendations(self, product_ids):
+        """
+        Fetches recommendations for several products, using the batch API when available
+        """
+        if hasattr(self.recommender, 'get_similar_products_batch'):
+            batch = self.recommender.get_similar_products_batch(product_ids)
+            return {
+                product_id: group.reset_index(drop=True).set_index('product_id')
+                for product_id, group in batch.groupby(level='source_id', sort=False)
+            }
+        
+        recommendations = {}
+        for product_id in product_ids:
+            try:
+                recommendations[product_id] = self.recommender.get_similar_products(product_id)
+            except Exception:
+                continue
+        return recommendations
+    
     def evaluate_diversity(self, original_product, recommendations):
         """
         Calculates diversity metrics for a set of recommendations
@@ -67,10 +86,11 @@ class RecommenderEvaluator:
             covered_categories = set()
             price_ranges = []
             successful_recs = 0
+            all_recs = self.get_recommendations(sample_products)
             
             for product_id in sample_products:
                 try:
-                    recs = self.recommender.get_similar_products(product_id)
+                    recs = all_recs.get(product_id, pd.DataFrame())
                     if not recs.empty:
                         self.all_recommendations.update(recs.index)
                         covered_categories.update(recs['categoryName'].unique())
@@ -109,11 +129,12 @@ class RecommenderEvaluator:
                 'diversity': [],
                 'relevance': [],
             }
+            all_recs = self.get_recommendations(sample_products)
             
             for product_id in sample_products:
                 try:
                     original = self.data.loc[product_id]
-                    recs = self.recommender.get_similar_products(product_id)
+                    recs = all_recs.get(product_id, pd.DataFrame())
                     
                     if not recs.empty:
                         diversity_metrics = self.evaluate_diversity(original, recs)
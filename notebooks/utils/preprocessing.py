@@ -4,13 +4,47 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from sklearn.preprocessing import MinMaxScaler
 
+from catalog_dtypes import compact_catalog, memory_usage_mb
+from quantile_sketch import KLLSketch
+
 class AmazonDataPreprocessor:
     """
     Class for preprocessing Amazon UK data.
     Contains all the necessary functions to clean and prepare the data.
     """
-    def __init__(self):
+    def __init__(self, sketch_k=None):
+        """
+        Parameters:
+            sketch_k (int, optional): if set, quantiles and quantile cuts come from
+                KLL sketches of this size instead of an exact sort of the column
+        """
         self.mms = MinMaxScaler()
+        self.sketch_k = sketch_k
+        # Sketches supplied by the caller (e.g. merged from chunks processed
+        # elsewhere), keyed by column: 'price', 'price_log', 'reviews_log'
+        self.sketches = {}
+    
+    def _sketch(self, column, values):
+        """
+        Sketch of a column: the one supplied in self.sketches, or one built from values
+        """
+        if column in self.sketches:
+            return self.sketches[column]
+        return KLLSketch.from_values(values, k=self.sketch_k, seed=0)
+    
+    def _quantile(self, column, values, q):
+        if self.sketch_k is None and column not in self.sketches:
+            return values.quantile(q)
+        return self._sketch(column, values).quantile(q)
+    
+    def _qcut(self, column, values, q, labels=None):
+        """
+        pd.qcut, or pd.cut on the sketch's bin edges when sketches are enabled
+        """
+        if self.sketch_k is None and column not in self.sketches:
+            return pd.qcut(values, q=q, labels=labels)
+        edges = self._sketch(column, values).qcut_edges(q)
+        return pd.cut(values, bins=edges, labels=labels, include_lowest=True)
         
     def clean_dataset(self, df):
         """
@@ -20,9 +54,9 @@ class AmazonDataPreprocessor:
             df (pd.DataFrame): Raw DataFrame
             
         Returns:
-            pd.DataFrame: Cleaned DataFrame
+            pd.DataFrame: Cleaned DataFrame (compact dtypes, see compact_catalog)
         """
-        df_clean = df.copy()
+        df_clean = compact_catalog(df, copy=True)
         
         # Filtering valid data
         mask = (
@@ -30,7 +64,7 @@ class AmazonDataPreprocessor:
             (df_clean['price'] > 0) & 
             (df_clean['stars'] > 0) &
             (df_clean['stars'] <= 5) &
-            (df_clean['price'] <= df_clean['price'].quantile(0.99))
+            (df_clean['price'] <= self._quantile('price', df_clean['price'], 0.99))
         )
         df_clean = df_clean[mask]
         
@@ -60,14 +94,15 @@ class AmazonDataPreprocessor:
         df_featured['popularity_score'] = 0.7 * reviews_norm.ravel() + 0.3 * stars_norm
         
         # Price categories
-        df_featured['price_category'] = pd.qcut(
+        df_featured['price_category'] = self._qcut(
+            'price_log',
             df_featured['price_log'],
             q=5,
             labels=['very_cheap', 'cheap', 'medium', 'expensive', 'very_expensive']
         )
         
         # Price features by category
-        df_featured['price_cat_mean'] = df_featured.groupby('categoryName')['price'].transform('mean')
+        df_featured['price_cat_mean'] = df_featured.groupby('categoryName', observed=True)['price'].transform('mean')
         df_featured['price_ratio_to_category'] = df_featured['price'] / df_featured['price_cat_mean']
         
         # Enhanced value for money
@@ -81,9 +116,10 @@ class AmazonDataPreprocessor:
         )
         
         # Additional features
-        df_featured['price_segment'] = pd.qcut(df_featured['price_log'], q=10, labels=False)
+        df_featured['price_segment'] = self._qcut('price_log', df_featured['price_log'], q=10, labels=False)
         df_featured['is_high_rated'] = (df_featured['stars'] >= 4).astype(int)
-        df_featured['review_segment'] = pd.qcut(
+        df_featured['review_segment'] = self._qcut(
+            'reviews_log',
             df_featured['reviews_log'],
             q=5,
             labels=['very_low', 'low', 'medium', 'high', 'very_high']
@@ -104,12 +140,12 @@ class AmazonDataPreprocessor:
         """
         if verbose:
             print("Starting processing...")
-            print(f"Initial number of entries: {len(df_raw)}")
+            print(f"Initial number of entries: {len(df_raw)} ({memory_usage_mb(df_raw):.1f} MB)")
         
         # Cleaning
         df_cleaned = self.clean_dataset(df_raw)
         if verbose:
-            print(f"After cleaning: {len(df_cleaned)} entries")
+            print(f"After cleaning: {len(df_cleaned)} entries ({memory_usage_mb(df_cleaned):.1f} MB)")
         
         # Feature creation
         df_final = self.create_features(df_cleaned)
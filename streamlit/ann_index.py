@@ -0,0 +1,340 @@
+import time
+
+import numpy as np
+from scipy import sparse
+from sklearn.neighbors import NearestNeighbors
+
+from sorted_index import patch_sorted_order
+
+
+def _dense_rows(X, rows):
+    """
+    Returns the requested rows of X (dense or scipy.sparse) as a float32 array
+    """
+    block = X[rows]
+    if sparse.issparse(block):
+        block = block.toarray()
+    return np.asarray(block, dtype=np.float32)
+
+
+def _inverse_norms(X, chunk_size=100_000):
+    """
+    Computes 1 / ||x|| for every row of X (0 for all-zero rows)
+    """
+    norms = np.empty(X.shape[0], dtype=np.float32)
+    for start in range(0, X.shape[0], chunk_size):
+        block = _dense_rows(X, slice(start, start + chunk_size))
+        norms[start:start + len(block)] = np.sqrt(np.einsum('ij,ij->i', block, block))
+    with np.errstate(divide='ignore'):
+        return np.where(norms > 0, 1.0 / norms, 0.0).astype(np.float32)
+
+
+def normalize_rows(X):
+    """
+    Returns X (dense or CSR) as float32 with unit-norm rows, for cosine by dot product
+    """
+    inv_norms = _inverse_norms(X)
+    if sparse.issparse(X):
+        return sparse.diags(inv_norms) @ X.astype(np.float32).tocsr()
+    return np.asarray(X, dtype=np.float32) * inv_norms[:, None]
+
+
+def cosine_similarity_rows(X_normalized, rows):
+    """
+    Cosine similarity of the given rows against every row of X_normalized, shape (N, len(rows))
+    """
+    block = _dense_rows(X_normalized, rows)
+    return np.asarray(X_normalized @ block.T, dtype=np.float32)
+
+
+def cosine_top_k_block(X_normalized, start, stop, k, exclude_self=True):
+    """
+    Exact cosine top-k for rows [start, stop) against every row of X_normalized
+
+    One (stop - start) x N similarity block is materialised, then reduced with
+    argpartition. Returns (indices int32, similarities float32), both of
+    shape (stop - start, k), best first, ties broken by row position.
+    """
+    similarity = cosine_similarity_rows(X_normalized, slice(start, stop)).T
+    if exclude_self:
+        rows = np.arange(stop - start)
+        similarity[rows, start + rows] = -np.inf
+    return top_k_rows(similarity, k)
+
+
+def top_k_rows(similarity, k):
+    """
+    Best-first top-k of every row of a similarity matrix, ties broken by column position
+    """
+    k = min(k, similarity.shape[1])
+    top = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(similarity, top, axis=1)
+    order = np.lexsort((top, -top_scores), axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    return top.astype(np.int32), np.take_along_axis(top_scores, order, axis=1)
+
+
+class _CosineRerankIndex:
+    """
+    Shared part of the approximate indexes: exact cosine re-ranking of a candidate pool
+
+    Subclasses implement fit() and _candidates(query). kneighbors() mirrors
+    sklearn's NearestNeighbors API and returns cosine distances; rows with
+    fewer than n_neighbors candidates are padded with index -1 and distance inf.
+    """
+    def __init__(self, n_neighbors=50):
+        self.n_neighbors = n_neighbors
+        self._X = None
+        self._inv_norms = None
+
+    def _fit_rerank(self, X):
+        self._X = X if sparse.issparse(X) else np.asarray(X)
+        self._inv_norms = _inverse_norms(self._X)
+
+    def kneighbors(self, X=None, n_neighbors=None, return_distance=True):
+        if X is None:
+            X = self._X
+        n_neighbors = n_neighbors or self.n_neighbors
+        queries = _dense_rows(X, slice(None))
+        query_norms = np.sqrt(np.einsum('ij,ij->i', queries, queries))
+        queries = queries / np.where(query_norms > 0, query_norms, 1.0)[:, None]
+
+        indices = np.full((len(queries), n_neighbors), -1, dtype=np.int64)
+        distances = np.full((len(queries), n_neighbors), np.inf, dtype=np.float64)
+        for i, query in enumerate(queries):
+            candidates = self._candidates(query)
+            if len(candidates) == 0:
+                continue
+            similarity = (_dense_rows(self._X, candidates) @ query) * self._inv_norms[candidates]
+            k = min(n_neighbors, len(candidates))
+            top = np.argpartition(-similarity, k - 1)[:k] if k < len(candidates) else np.arange(len(candidates))
+            top = top[np.argsort(-similarity[top], kind='stable')]
+            indices[i, :k] = candidates[top]
+            distances[i, :k] = 1.0 - similarity[top]
+
+        if return_distance:
+            return distances, indices
+        return indices
+
+
+class RandomProjectionLSH(_CosineRerankIndex):
+    """
+    Random-projection (SimHash) LSH index for cosine similarity, pure NumPy
+
+    Knobs:
+        n_tables: number of hash tables (more tables -> higher recall, more work)
+        n_bits: hyperplanes per table (more bits -> smaller buckets, lower latency)
+        n_probes: extra buckets probed per table by flipping the least certain bits
+    """
+    def __init__(self, n_tables=8, n_bits=16, n_probes=2, n_neighbors=50, random_state=0):
+        super().__init__(n_neighbors)
+        if not 0 < n_bits < 63:
+            raise ValueError("n_bits must be between 1 and 62")
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.n_probes = n_probes
+        self.random_state = random_state
+        self.planes = None
+        self.table_codes = None
+        self.table_order = None
+
+    def _hash(self, X_block, table):
+        projections = X_block @ self.planes[table]
+        codes = (projections > 0).astype(np.int64) @ (np.int64(1) << np.arange(self.n_bits, dtype=np.int64))
+        return codes, projections
+
+    def fit(self, X, chunk_size=100_000):
+        rng = np.random.default_rng(self.random_state)
+        self.planes = rng.standard_normal((self.n_tables, X.shape[1], self.n_bits)).astype(np.float32)
+        self._fit_rerank(X)
+
+        codes = np.empty((self.n_tables, X.shape[0]), dtype=np.int64)
+        for start in range(0, X.shape[0], chunk_size):
+            block = _dense_rows(X, slice(start, start + chunk_size))
+            for table in range(self.n_tables):
+                codes[table, start:start + len(block)] = self._hash(block, table)[0]
+
+        self.table_order = np.argsort(codes, axis=1, kind='stable').astype(np.int32)
+        self.table_codes = np.take_along_axis(codes, self.table_order.astype(np.int64), axis=1)
+        return self
+
+    def _candidates(self, query):
+        pools = []
+        for table in range(self.n_tables):
+            code, projections = self._hash(query[None, :], table)
+            probes = [code[0]]
+            # Multi-probe: flip the bits whose hyperplane is closest to the query
+            for bit in np.argsort(np.abs(projections[0]))[:self.n_probes]:
+                probes.append(code[0] ^ (np.int64(1) << np.int64(bit)))
+            codes = self.table_codes[table]
+            for probe in probes:
+                start = np.searchsorted(codes, probe, side='left')
+                stop = np.searchsorted(codes, probe, side='right')
+                if stop > start:
+                    pools.append(self.table_order[table, start:stop])
+        if not pools:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(pools)).astype(np.int64)
+
+    def update(self, X, row_map, dirty):
+        """
+        Patches the hash tables after rows of X were removed, replaced or appended
+
+        row_map maps old to new row positions (-1 when removed, None when no
+        row moved); dirty lists the new positions to (re)hash.
+        """
+        self._fit_rerank(X)
+        block = _dense_rows(X, dirty)
+        orders, codes = [], []
+        for table in range(self.n_tables):
+            order, (table_codes,) = patch_sorted_order(
+                self.table_order[table], [self.table_codes[table]],
+                row_map, dirty, [self._hash(block, table)[0]], X.shape[0]
+            )
+            orders.append(order)
+            codes.append(table_codes)
+        self.table_order = np.stack(orders)
+        self.table_codes = np.stack(codes)
+        return self
+
+    def state_arrays(self):
+        return {'planes': self.planes, 'table_codes': self.table_codes, 'table_order': self.table_order}
+
+    def load_state(self, X, arrays):
+        self._fit_rerank(X)
+        self.planes = arrays['planes']
+        self.table_codes = arrays['table_codes']
+        self.table_order = arrays['table_order']
+        return self
+
+
+class IVFIndex(_CosineRerankIndex):
+    """
+    Inverted-file index: spherical k-means centroids with one posting list each, pure NumPy
+
+    Knobs:
+        n_lists: number of k-means centroids (more lists -> shorter lists, faster queries)
+        n_probe: lists scanned per query (more probes -> higher recall, more work)
+        n_iter / sample_size: k-means training effort
+    """
+    def __init__(self, n_lists=256, n_probe=8, n_iter=10, sample_size=100_000, n_neighbors=50, random_state=0):
+        super().__init__(n_neighbors)
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_iter = n_iter
+        self.sample_size = sample_size
+        self.random_state = random_state
+        self.centroids = None
+        self.list_order = None
+        self.list_offsets = None
+
+    def _normalized_rows(self, rows):
+        block = _dense_rows(self._X, rows)
+        return block * self._inv_norms[rows][:, None]
+
+    def _assign(self, block):
+        return np.argmax(block @ self.centroids.T, axis=1)
+
+    def fit(self, X, chunk_size=100_000):
+        rng = np.random.default_rng(self.random_state)
+        self._fit_rerank(X)
+        n_samples = X.shape[0]
+        n_lists = min(self.n_lists, n_samples)
+
+        sample = np.sort(rng.choice(n_samples, size=min(self.sample_size, n_samples), replace=False))
+        training = self._normalized_rows(sample)
+        self.centroids = training[rng.choice(len(training), size=n_lists, replace=False)].copy()
+
+        for _ in range(self.n_iter):
+            labels = self._assign(training)
+            membership = sparse.csr_matrix(
+                (np.ones(len(labels), dtype=np.float32), (labels, np.arange(len(labels)))),
+                shape=(n_lists, len(labels))
+            )
+            sums = np.asarray(membership @ training)
+            counts = np.bincount(labels, minlength=n_lists)
+            # Empty lists are re-seeded on random training points
+            empty = np.flatnonzero(counts == 0)
+            sums[empty] = training[rng.choice(len(training), size=len(empty))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            self.centroids = sums / np.where(norms > 0, norms, 1.0)
+
+        labels = np.empty(n_samples, dtype=np.int32)
+        for start in range(0, n_samples, chunk_size):
+            rows = np.arange(start, min(start + chunk_size, n_samples))
+            labels[rows] = self._assign(self._normalized_rows(rows))
+
+        self.list_order = np.argsort(labels, kind='stable').astype(np.int32)
+        self.list_offsets = np.searchsorted(labels[self.list_order], np.arange(n_lists + 1)).astype(np.int64)
+        return self
+
+    def _candidates(self, query):
+        scores = self.centroids @ query
+        n_probe = min(self.n_probe, len(scores))
+        lists = np.argpartition(-scores, n_probe - 1)[:n_probe]
+        pools = [self.list_order[self.list_offsets[l]:self.list_offsets[l + 1]] for l in lists]
+        return np.concatenate(pools).astype(np.int64)
+
+    def update(self, X, row_map, dirty):
+        """
+        Assigns removed/replaced/appended rows to their lists without re-training the centroids
+        """
+        self._fit_rerank(X)
+        n_lists = len(self.list_offsets) - 1
+        labels = np.repeat(np.arange(n_lists), np.diff(self.list_offsets))
+        new_labels = self._assign(self._normalized_rows(np.asarray(dirty))) if len(dirty) else np.empty(0, dtype=np.int64)
+        self.list_order, (labels,) = patch_sorted_order(
+            self.list_order, [labels], row_map, dirty, [new_labels], X.shape[0]
+        )
+        self.list_offsets = np.searchsorted(labels, np.arange(n_lists + 1)).astype(np.int64)
+        return self
+
+    def state_arrays(self):
+        return {'centroids': self.centroids, 'list_order': self.list_order, 'list_offsets': self.list_offsets}
+
+    def load_state(self, X, arrays):
+        self._fit_rerank(X)
+        self.centroids = arrays['centroids']
+        self.list_order = arrays['list_order']
+        self.list_offsets = arrays['list_offsets']
+        return self
+
+
+ANN_BACKENDS = {
+    'lsh': RandomProjectionLSH,
+    'ivf': IVFIndex,
+}
+
+
+def measure_recall(index, X, k=10, n_queries=200, random_state=0):
+    """
+    Measures recall@k and per-query latency of an index against exact brute force
+
+    Recall counts an approximate neighbor as correct when its cosine distance
+    is within the exact k-th distance, so ties between identical feature
+    vectors are not penalised.
+    """
+    if not sparse.issparse(X):
+        X = np.asarray(X)
+    rng = np.random.default_rng(random_state)
+    queries = np.sort(rng.choice(X.shape[0], size=min(n_queries, X.shape[0]), replace=False))
+    query_rows = X[queries]
+
+    exact = NearestNeighbors(n_neighbors=k, metric='cosine', algorithm='brute').fit(X)
+    start = time.perf_counter()
+    exact_distances, _ = exact.kneighbors(query_rows, n_neighbors=k)
+    exact_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    approx_distances, approx_indices = index.kneighbors(query_rows, n_neighbors=k)
+    approx_time = time.perf_counter() - start
+
+    threshold = exact_distances[:, -1:] + 1e-6
+    hits = (approx_indices >= 0) & (approx_distances <= threshold)
+    return {
+        'recall': float(hits.sum() / (len(queries) * k)),
+        'latency_ms': 1000 * approx_time / len(queries),
+        'brute_force_latency_ms': 1000 * exact_time / len(queries),
+        'n_queries': int(len(queries)),
+        'k': k,
+    }
@@ -1,8 +1,37 @@
+import functools
+import os
+
 import streamlit as st
 import pandas as pd
 import numpy as np
 
+from autocomplete import Autocomplete, normalize
+from catalog_dtypes import compact_catalog
+from catalog_store import CORE_COLUMNS, CatalogStore, HEAVY_COLUMNS
+from facets import FacetIndex
+from image_cache import ImageCache
 from recommender_sys import AmazonRecommender
+from search_index import SearchIndex
+from shared_state import SharedServingState
+
+DATA_FILE = "../data/clean/amazon_uk_final.csv"
+MODEL_DIR = "../data/models/amazon_recommender"
+SIMILAR_CACHE_SIZE = 2048
+AUTOCOMPLETE_SUGGESTIONS = 6
+# Products shown in the main grid
+GRID_SIZE = 30
+# Sort keys (smallest first) over the catalog columns, presorted once by the facet index
+SORT_OPTIONS = {
+    "Most relevant": lambda rows: -rows['stars'] * np.log1p(rows['reviews']),
+    "By ascending price": lambda rows: rows['price'],
+    "By descending price": lambda rows: -rows['price'],
+    "Top ratings": lambda rows: -rows['stars'],
+    "More reviews": lambda rows: -rows['reviews']
+}
+THUMBNAIL_DIR = "../data/cache/thumbnails"
+THUMBNAIL_CACHE_BYTES = 256 * 2**20
+# Longest wait for the thumbnails of the cards being rendered (the rest fall back to remote URLs)
+THUMBNAIL_WAIT = 2.0
 
 # Page config
 st.set_page_config(
@@ -16,44 +45,34 @@ if 'current_page' not in st.session_state:
     st.session_state.current_page = 'main'
 if 'selected_product' not in st.session_state:
     st.session_state.selected_product = None
+if 'recommendation_seed' not in st.session_state:
+    # Similar products are drawn once per session: they stay put across reruns
+    # (and come from the shared recommender's cache) but differ between sessions
+    st.session_state.recommendation_seed = int(np.random.default_rng().integers(2**31))
 
 
-def calculate_search_relevance(row, search_terms, exact_phrase=False):
+@st.cache_resource
+def catalog_store():
     """
-    Calculates a relevance score based on search terms and product characteristics.
+    Columnar catalog cache shared by every session of this process (it keeps the stored index)
     """
-    title = str(row['title']).lower()
-    category = str(row['categoryName']).lower()
-    score = 0
-
-    # Diviser les termes de recherche en mots-clés
-    search_terms = [term.lower() for term in search_terms.split()]
-    
-    # Boost if all the keywords appear in the title
-    if all(term in title for term in search_terms):
-        score += 100
-        if exact_phrase and search_terms[0] in title:
-            score += 50
-
-    # Penalty for compatible accessories or products
-    accessory_keywords = [
-        'cable', 'case', 'cover', 'accessory', 'accessories', 'stand', 
-        'mount', 'holder', 'protector', 'aux', 'adapter', 'compatible', 'for'
-    ]
-    if any(word in title for word in accessory_keywords):
-        score -= 100
+    return CatalogStore(DATA_FILE)
 
-    # Bonus for exact category match
-    if any(term in category for term in search_terms):
-        score += 50
+@st.cache_resource
+def image_cache():
+    """
+    Thumbnail cache and download pool shared by every session of this process
+    """
+    return ImageCache(THUMBNAIL_DIR, max_bytes=THUMBNAIL_CACHE_BYTES)
 
-    # Taking notes and opinions into account
-    score += min(row['stars'], 5)
-    score += min(np.log1p(row['reviews']) / 20, 2.5)
-    
-    return max(score, 0)
+def with_media(products):
+    """
+    Adds the image and product URLs of the products about to be rendered
+    """
+    media = catalog_store().fetch(products.index, HEAVY_COLUMNS)
+    return products.drop(columns=HEAVY_COLUMNS, errors='ignore').join(media)
 
-def show_product_detail(product, df):
+def show_product_detail(product, recommender):
     """
     render product page details
     """
@@ -68,7 +87,8 @@ def show_product_detail(product, df):
     with col1:
         if pd.notna(product.get('imgUrl')):
             try:
-                st.image(product['imgUrl'], width=300)
+                thumbnails = image_cache().get_many([product['imgUrl']], timeout=THUMBNAIL_WAIT)
+                st.image(thumbnails[product['imgUrl']] or product['imgUrl'], width=300)
             except:
                 st.write("🖼️ Image not available")
             
@@ -112,12 +132,14 @@ def show_product_detail(product, df):
     st.markdown(product_container_style, unsafe_allow_html=True)
     
     try:
-        recommender = AmazonRecommender()
-        recommender.fit(df)
-        
-        recommendations = recommender.get_similar_products(product.name)
+        recommendations = recommender.get_similar_products(
+            product.name, random_state=st.session_state.recommendation_seed
+        )
         
         if not recommendations.empty:
+            recommendations = with_media(recommendations)
+            # All the recommendation thumbnails are downloaded at once
+            thumbnails = image_cache().get_many(recommendations['imgUrl'], timeout=THUMBNAIL_WAIT)
             cols = st.columns(3)
             for idx, rec in recommendations.iterrows():
                 with cols[idx % 3]:
@@ -128,7 +150,7 @@ def show_product_detail(product, df):
                                 <img src="{}" alt="product image">
                             </div>
                         </div>
-                    """.format(rec['imgUrl'] if pd.notna(rec.get('imgUrl')) else ""), unsafe_allow_html=True)
+                    """.format(image_cache().src(rec.get('imgUrl'), thumbnails.get(rec.get('imgUrl')))), unsafe_allow_html=True)
                     
                     # Product info
                     st.markdown(f"**{rec['title'][:100]}...**")
@@ -152,27 +174,87 @@ def show_product_detail(product, df):
         st.error(f"Error when loading recommendations: {str(e)}")
 
 
-@st.cache_data
-def load_data():
+def get_recommender(df):
+    """
+    Loads the fitted recommender snapshot, refitting only when the data is newer
+    """
+    manifest = os.path.join(MODEL_DIR, "manifest.json")
+    if os.path.exists(manifest) and os.path.getmtime(manifest) >= os.path.getmtime(DATA_FILE):
+        try:
+            return AmazonRecommender.load(MODEL_DIR, product_data=df, similar_cache_size=SIMILAR_CACHE_SIZE)
+        except ValueError:
+            pass
+
+    recommender = AmazonRecommender(feature_format='sparse', similar_cache_size=SIMILAR_CACHE_SIZE)
+    recommender.fit(df, verbose=False)
+    recommender.save(MODEL_DIR)
+    return recommender
+
+
+def load_catalog(store):
     """
     Loads and prepares data for the application
+
+    Reads the light columns from the columnar catalog cache, rebuilt from
+    DATA_FILE when it changes. Image and product URLs are fetched per
+    rendered card by with_media(). Columns use the compact dtypes of
+    compact_catalog (a no-op on caches written with them).
     """
-    try:
-        df = pd.read_csv("../data/clean/amazon_uk_final.csv")
-        required_columns = ['title', 'price', 'stars', 'reviews', 'categoryName', 'imgUrl', 'productURL']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        if missing_columns:
-            raise ValueError(f"Colonnes manquantes: {missing_columns}")
-        
-        df = df.dropna(subset=['title', 'price', 'stars', 'reviews', 'categoryName'])
-        df = df[df['price'] > 0]
-        return df
-    except Exception as e:
-        st.error(f"Error when loading data: {str(e)}")
-        return None
+    return compact_catalog(store.load(CORE_COLUMNS))
 
-# Loading data
-df = load_data()
+def build_serving_bundle(store, source_fingerprint):
+    """
+    Catalog, fitted recommender and indexes for one version of DATA_FILE (built off the page)
+    """
+    catalog = load_catalog(store)
+    return {
+        'catalog': catalog,
+        'recommender': get_recommender(catalog),
+        'search_index': SearchIndex(catalog),
+        'autocomplete': Autocomplete(catalog),
+        'facets': FacetIndex(catalog, sort_keys=SORT_OPTIONS),
+    }
+
+@st.cache_resource
+def shared_state():
+    """
+    Serving state shared read-only by every session of this server process
+
+    Created by the first session, which starts the warm-up; later sessions
+    get the same object, so the catalog and model exist once per process.
+    """
+    store = catalog_store()
+    return SharedServingState(functools.partial(build_serving_bundle, store), store.source_fingerprint).start()
+
+def show_readiness(status):
+    """
+    Readiness of the shared catalog and model, in the sidebar
+    """
+    labels = {
+        'warming': "🟠 Warming up", 'ready': "🟢 Ready", 'refreshing': "🟡 Refreshing data", 'failed': "🔴 Loading failed"
+    }
+    details = f" · data version {status['generation']}" if status['generation'] else ""
+    if status['build_seconds'] is not None:
+        details += f" · built in {status['build_seconds']:.1f}s"
+    st.sidebar.caption(labels[status['state']] + details)
+    if status['error']:
+        st.sidebar.caption(f"Last load failed: {status['error']}")
+
+def use_suggestion(suggestion):
+    """
+    Puts a clicked suggestion in the search bar (runs before the next rerun)
+    """
+    st.session_state.search_query = suggestion
+
+# Loading data: the shared bundle, rebuilt in the background when DATA_FILE changes
+state = shared_state()
+state.refresh()
+with st.spinner("Warming up: loading the catalog, model and search indexes..."):
+    bundle = state.current()
+show_readiness(state.status())
+df = bundle.catalog if bundle is not None else None
+if df is None:
+    st.error(f"Error when loading data: {state.status()['error']}")
 
 if df is not None:
     try:
@@ -181,50 +263,57 @@ if df is not None:
         if st.session_state.current_page == 'main':
             st.title("🛍️ Recommendation system with Amazon products")
             
-            recommender = AmazonRecommender()
-            recommender.fit(df)
             st.success("Data successfully loaded!")
             
             st.sidebar.write(f"Total products: {len(df):,}")
             
             # Search bar
-            search_query = st.text_input("🔍 Product search", "")
+            search_query = st.text_input("🔍 Product search", key="search_query")
+            autocomplete = bundle.autocomplete
+            st.sidebar.caption(f"Autocomplete index: {autocomplete.nbytes / 2**20:.1f} MB")
+            if search_query:
+                suggestions = [
+                    (text, kind) for text, kind in autocomplete.suggest(search_query, AUTOCOMPLETE_SUGGESTIONS)
+                    if text != normalize(search_query)
+                ]
+                if suggestions:
+                    for col, (text, kind) in zip(st.columns(len(suggestions)), suggestions):
+                        col.button(
+                            f"📁 {text}" if kind == 'category' else text,
+                            key=f"suggest_{kind}_{text}",
+                            on_click=use_suggestion,
+                            args=(text,)
+                        )
+            
+            facets = bundle.facets
+            relevance = None
             
             # Initialisation with the most popular products
             if not search_query:  # If no search is carried out
-                filtered_df = df[
-                    (df['stars'] >= 4.0) & 
-                    (df['stars'] <= 5.0)
-                ].copy()
-                
-                # Calculating the popularity score
-                filtered_df['popularity_score'] = filtered_df['stars'] * np.log1p(filtered_df['reviews'])
-                filtered_df = filtered_df.sort_values('popularity_score', ascending=False)
+                selection = facets.range('stars', 4.0, 5.0)
                 
             else:
-             
-                filtered_df = df.copy()
-                mask = filtered_df['title'].str.contains(search_query, case=False, na=False)
-                filtered_df = filtered_df[mask]
-                st.write(f"Results for '{search_query}': {len(filtered_df)} products")
-                
-                mask = filtered_df['title'].str.contains(search_query, case=False, na=False)
-                filtered_df = filtered_df[mask]
-                st.write(f"Results for '{search_query}': {len(filtered_df)} products")
+                # Every match goes through the filters; the best ones are taken by the sort below
+                results = bundle.search_index.search(search_query)
+                selection = facets.from_positions(results.positions)
+                relevance = np.zeros(len(df))
+                relevance[results.positions] = results.scores
+                st.write(f"Results for '{search_query}': {results.n_matches} products")
             
-            categories = ["All categories"] + sorted(df['categoryName'].unique().tolist())
+            categories = ["All categories"] + df['categoryName'].cat.categories.tolist()
             selected_category = st.sidebar.selectbox(
                 "Select category",
                 categories
             )
             if selected_category != "All categories":
-                filtered_df = filtered_df[filtered_df['categoryName'] == selected_category]
+                selection = facets.combine(selection, facets.category(selected_category))
 
             
-            price_min = float(filtered_df['price'].min())
-            price_max = float(filtered_df['price'].max())
-            price_avg = float(filtered_df['price'].mean())
-            price_median = float(filtered_df['price'].median())
+            price_stats = facets.describe(selection, 'price')
+            price_min = float(price_stats['min'])
+            price_max = float(price_stats['max'])
+            price_avg = float(price_stats['mean'])
+            price_median = float(price_stats['median'])
             price_range = st.sidebar.slider(
                 "Price range (£)",
                 min_value=price_min,
@@ -232,49 +321,48 @@ if df is not None:
                 value=(price_min, min(price_max, 300.0))
             )
             
-            filtered_df = filtered_df[
-                (filtered_df['price'] >= price_range[0]) &
-                (filtered_df['price'] <= price_range[1])
-            ]
+            selection = facets.combine(selection, facets.range('price', *price_range))
             
             min_rating = st.sidebar.slider(
                 "Minimum rating",
                 1.0, 5.0, 4.0, 0.5
             )
             
-            avg_reviews = int(filtered_df["reviews"].mean())
+            review_stats = facets.describe(selection, 'reviews')
+            avg_reviews = int(review_stats['mean'])
             min_reviews = st.sidebar.number_input(
                 "Minimum number of reviews",
                 0,
-                int(filtered_df['reviews'].max()),
+                int(review_stats['max']),
                 100
             )
             
-            filtered_df = filtered_df[
-                (filtered_df['stars'] >= min_rating) &
-                (filtered_df['reviews'] >= avg_reviews)
-            ]
+            selection = facets.combine(
+                selection,
+                facets.range('stars', min_rating, None),
+                facets.range('reviews', avg_reviews, None)
+            )
             
             st.sidebar.write("Filtering statistics:")
-            st.sidebar.write(f"Products displayed: {len(filtered_df):,}")
+            st.sidebar.write(f"Products displayed: {facets.count(selection):,}")
             
-            sort_options = {
-                "Most relevant": lambda df: df['stars'] * np.log1p(df['reviews']),
-                "By ascending price": lambda df: df['price'],
-                "By descending price": lambda df: -df['price'],
-                "Top ratings": lambda df: -df['stars'],
-                "More reviews": lambda df: -df['reviews']
-            }
-
-            sort_by = st.selectbox("Sort by", list(sort_options.keys()))
-            filtered_df['sort_key'] = sort_options[sort_by](filtered_df)
-            filtered_df = filtered_df.sort_values('sort_key', ascending=True)
-            filtered_df = filtered_df.drop('sort_key', axis=1)
+            sort_by = st.selectbox("Sort by", list(SORT_OPTIONS.keys()))
+            if relevance is not None and sort_by == "Most relevant":
+                # Search relevance depends on the query: rank the filtered matches directly
+                positions = facets.positions(selection)
+                page_positions = positions[facets.top_k(-relevance[positions], 2 * GRID_SIZE)]
+            else:
+                page_positions = facets.first(selection, sort_by, 2 * GRID_SIZE)
+            filtered_df = df.iloc[page_positions[:GRID_SIZE]]
+            # Thumbnails of the next page download in the background
+            next_page = df.index[page_positions[GRID_SIZE:]]
+            image_cache().prefetch(catalog_store().fetch(next_page, ['imgUrl'])['imgUrl'])
             
             st.write("Most popular products:")
 
             if len(filtered_df) > 0:
-                filtered_df = filtered_df.head(30)
+                filtered_df = with_media(filtered_df)
+                thumbnails = image_cache().get_many(filtered_df['imgUrl'], timeout=THUMBNAIL_WAIT)
                 
                 # CSS style for the product container
                 product_container_style = """
@@ -311,7 +399,7 @@ if df is not None:
                                     <img src="{}" alt="product image">
                                 </div>
                             </div>
-                        """.format(product['imgUrl'] if pd.notna(product['imgUrl']) else ""), unsafe_allow_html=True)
+                        """.format(image_cache().src(product['imgUrl'], thumbnails.get(product['imgUrl']))), unsafe_allow_html=True)
                         
                         # Product info
                         st.markdown(f"**{product['title'][:100]}...**")
@@ -332,7 +420,7 @@ if df is not None:
                 st.warning("No products match the selected criteria.")
         
         elif st.session_state.current_page == 'detail' and st.session_state.selected_product is not None:
-            show_product_detail(st.session_state.selected_product, df)
+            show_product_detail(st.session_state.selected_product, bundle.recommender)
             
     except Exception as e:
         st.error(f"An error has occurred: {str(e)}")
@@ -0,0 +1,166 @@
+import re
+import sys
+from bisect import bisect_left
+
+import numpy as np
+import pandas as pd
+
+# Prefixes matching more keys than this keep precomputed suggestions; smaller ranges are ranked on the fly
+SCAN_LIMIT = 64
+MIN_TOKEN_LENGTH = 2
+# Leading and trailing punctuation stripped from title tokens ("speaker," -> "speaker")
+_EDGE_PUNCTUATION = re.compile(r"^[\W_]+|[\W_]+$")
+
+
+def normalize(text):
+    """
+    Lower-cased text with single spaces, as matched by the prefix indexes
+    """
+    return ' '.join(str(text).lower().split())
+
+
+class PrefixIndex:
+    """
+    Sorted keys with weights, answering "best keys starting with a prefix"
+
+    The keys matching a prefix form one contiguous range of the sorted list
+    (two bisections). Every prefix whose range holds more than scan_limit
+    keys stores its top_k key indices, computed once at build time; smaller
+    ranges are ranked when queried, which costs a few microseconds.
+    """
+    def __init__(self, keys, weights, labels=None, top_k=10, scan_limit=SCAN_LIMIT):
+        order = np.argsort(np.asarray(keys, dtype=object), kind='stable')
+        self.keys = [keys[i] for i in order]
+        self.weights = np.asarray(weights, dtype=np.float64)[order]
+        self.labels = [labels[i] for i in order] if labels is not None else self.keys
+        self.top_k = top_k
+        self.scan_limit = scan_limit
+        self.top = self._precompute()
+
+    def _best(self, lo, hi, n):
+        segment = self.weights[lo:hi]
+        if n < len(segment):
+            kth = np.partition(-segment, n - 1)[n - 1]
+            candidates = np.flatnonzero(-segment <= kth)
+        else:
+            candidates = np.arange(len(segment))
+        # Heaviest first, ties in key order
+        candidates = candidates[np.lexsort((candidates, -segment[candidates]))][:n]
+        return (lo + candidates).astype(np.int32)
+
+    def _precompute(self):
+        """
+        Top keys of every prefix whose range is larger than scan_limit, level by level
+        """
+        top = {}
+        keys = pd.Series(self.keys, dtype=object)
+        key_lengths = keys.str.len().to_numpy()
+        positions = np.arange(len(keys))
+        length = 1
+        while len(positions) > self.scan_limit:
+            prefixes = keys.iloc[positions].str[:length].to_numpy()
+            # Keys are sorted, so equal prefixes are contiguous (and contiguous in self.keys)
+            starts = np.flatnonzero(np.r_[True, prefixes[1:] != prefixes[:-1]])
+            sizes = np.diff(np.r_[starts, len(positions)])
+            large = sizes > self.scan_limit
+            for start, size in zip(starts[large], sizes[large]):
+                top[prefixes[start]] = self._best(positions[start], positions[start + size - 1] + 1, self.top_k)
+            # Next level: keys of the large ranges that extend past this length
+            in_large = np.repeat(large, sizes)
+            positions = positions[in_large & (key_lengths[positions] > length)]
+            length += 1
+        return top
+
+    def _range(self, prefix):
+        return bisect_left(self.keys, prefix), bisect_left(self.keys, prefix + '\U0010ffff')
+
+    def complete(self, prefix, n=None):
+        """
+        Indices (in key order) of the n heaviest keys starting with prefix
+        """
+        n = self.top_k if n is None else n
+        lo, hi = self._range(prefix)
+        if hi - lo > self.scan_limit and n <= self.top_k and prefix in self.top:
+            return self.top[prefix][:n]
+        return self._best(lo, hi, n)
+
+    @property
+    def nbytes(self):
+        """
+        Approximate memory of the index (keys, labels, weights, precomputed suggestions)
+        """
+        strings = sum(sys.getsizeof(key) for key in self.keys)
+        if self.labels is not self.keys:
+            strings += sum(sys.getsizeof(label) for label in self.labels)
+        precomputed = sum(sys.getsizeof(prefix) + suggestions.nbytes for prefix, suggestions in self.top.items())
+        containers = sys.getsizeof(self.keys) * (1 if self.labels is self.keys else 2) + sys.getsizeof(self.top)
+        return strings + self.weights.nbytes + precomputed + containers
+
+
+class Autocomplete:
+    """
+    Search-as-you-type suggestions over title tokens and category names
+
+    Built once from the catalogue: every normalized title token (at least
+    MIN_TOKEN_LENGTH characters) and every category name is weighted by
+    the summed stars * log1p(reviews) of its products, the key of the
+    "Most relevant" sort. suggest() completes the last word being typed
+    from the title tokens and the whole text from the category names.
+    """
+    def __init__(self, df, top_k=10, scan_limit=SCAN_LIMIT):
+        popularity = (
+            df['stars'].to_numpy(dtype=np.float64) * np.log1p(df['reviews'].to_numpy(dtype=np.float64))
+        )
+        popularity = np.nan_to_num(popularity)
+
+        tokens = (
+            pd.Series(df['title'].to_numpy(), dtype=object).fillna('').astype(str).str.lower()
+            .str.split().explode().dropna()
+        )
+        # Punctuation is stripped once per distinct raw token, then tokens are re-coded
+        raw_codes, raw_tokens = pd.factorize(tokens.to_numpy())
+        stripped = pd.Series(raw_tokens, dtype=object).str.replace(_EDGE_PUNCTUATION, '', regex=True)
+        stripped_codes, vocabulary = pd.factorize(stripped.to_numpy())
+        codes = stripped_codes[raw_codes].astype(np.int64)
+        # A token counts once per product
+        pairs = np.unique(codes * max(len(df), 1) + tokens.index.to_numpy())
+        codes, products = pairs // max(len(df), 1), pairs % max(len(df), 1)
+        token_weights = np.bincount(codes, weights=popularity[products], minlength=len(vocabulary))
+        kept = np.flatnonzero(pd.Series(vocabulary, dtype=object).str.len().to_numpy() >= MIN_TOKEN_LENGTH)
+        self.tokens = PrefixIndex(
+            [vocabulary[code] for code in kept], token_weights[kept], top_k=top_k, scan_limit=scan_limit
+        )
+
+        category_weights = pd.Series(popularity).groupby(
+            np.asarray(df['categoryName'].astype(object)), dropna=True
+        ).sum()
+        names = [str(name) for name in category_weights.index]
+        self.categories = PrefixIndex(
+            [normalize(name) for name in names], category_weights.to_numpy(), labels=names,
+            top_k=top_k, scan_limit=scan_limit
+        )
+
+    @property
+    def nbytes(self):
+        return self.tokens.nbytes + self.categories.nbytes
+
+    def suggest(self, text, n=8):
+        """
+        Up to n suggestions for the text typed so far, heaviest first
+
+        Returns (suggestion, kind) pairs: kind is 'category' for a category
+        name matching the whole text, 'title' for the text with its last word
+        completed from the title tokens.
+        """
+        query = normalize(text)
+        if not query:
+            return []
+        head, _, last = query.rpartition(' ')
+        suggestions = []
+        for position in self.categories.complete(query, n):
+            suggestions.append((self.categories.weights[position], self.categories.labels[position], 'category'))
+        for position in self.tokens.complete(last, n):
+            completed = f"{head} {self.tokens.keys[position]}" if head else self.tokens.keys[position]
+            suggestions.append((self.tokens.weights[position], completed, 'title'))
+        suggestions.sort(key=lambda suggestion: -suggestion[0])
+        return [(text, kind) for _, text, kind in suggestions[:n]]
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+# Compact dtypes of the numeric catalog columns (reviews falls back to float32 when it has NaN)
+NUMERIC_DTYPES = {'price': np.float32, 'stars': np.float32, 'reviews': np.int32}
+# Decimals of the CSV values, restored whenever float32 columns are widened to float64
+OUTPUT_DECIMALS = {'price': 2, 'stars': 1}
+
+
+def category_dtype(*names):
+    """
+    Categorical dtype whose sorted dictionary holds every category name of the given columns
+
+    Accepts Series (categorical or not) and plain iterables of names.
+    """
+    values = set()
+    for column in names:
+        if isinstance(getattr(column, 'dtype', None), pd.CategoricalDtype):
+            values.update(column.cat.categories)
+        else:
+            values.update(name for name in pd.unique(pd.Series(column).dropna()))
+    return pd.CategoricalDtype(sorted(values))
+
+
+def compact_catalog(df, categories=None, copy=False):
+    """
+    Catalog with compact dtypes: categoryName categorical, price/stars float32, reviews int32
+
+    categories: CategoricalDtype to use for categoryName (default: sorted
+    names present in df), so several frames can share one dictionary.
+    Columns that are absent are skipped. Returns df itself when nothing has
+    to change (a copy if copy=True).
+    """
+    dtypes = {}
+    if 'categoryName' in df.columns:
+        dtype = categories if categories is not None else category_dtype(df['categoryName'])
+        if df['categoryName'].dtype != dtype:
+            dtypes['categoryName'] = dtype
+    for column, dtype in NUMERIC_DTYPES.items():
+        if column not in df.columns:
+            continue
+        values = df[column]
+        if np.issubdtype(dtype, np.integer) and (
+                values.isna().any() or (len(values) and values.abs().max() > np.iinfo(dtype).max)):
+            dtype = np.float32
+        if values.dtype != dtype:
+            dtypes[column] = dtype
+    if not dtypes:
+        return df.copy() if copy else df
+    return df.astype(dtypes)
+
+
+def float64_values(values):
+    """
+    float64 array of a catalog column (Series), float32 price/stars rounded back to their CSV decimals
+
+    A float32 4.2 widened as is becomes 4.19999980926 and fails a
+    "stars >= 4.2" filter; rounding gives back the CSV value.
+    """
+    array = values.to_numpy(dtype=np.float64)
+    if values.dtype == np.float32 and values.name in OUTPUT_DECIMALS:
+        array = array.round(OUTPUT_DECIMALS[values.name])
+    return array
+
+
+def output_catalog(df):
+    """
+    Rows ready to be returned: float32 price/stars widened to float64 and rounded to their CSV decimals
+
+    Returns a new frame (see float64_values), other columns unchanged.
+    """
+    columns = {
+        column: pd.Series(float64_values(df[column]), index=df.index)
+        for column in OUTPUT_DECIMALS
+        if column in df.columns and df[column].dtype == np.float32
+    }
+    return df.assign(**columns)
+
+
+def memory_usage_mb(df):
+    """
+    Deep memory usage of a DataFrame in MB (strings included)
+    """
+    return df.memory_usage(deep=True).sum() / 2 ** 20
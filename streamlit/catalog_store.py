@@ -0,0 +1,246 @@
+import contextlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from catalog_dtypes import compact_catalog
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # Optional: without pyarrow the cache stores one pickle per column
+    pq = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: builds are only serialized within the process
+    fcntl = None
+
+REQUIRED_COLUMNS = ['title', 'price', 'stars', 'reviews', 'categoryName', 'imgUrl', 'productURL']
+# Long text columns only needed when a product card is rendered
+HEAVY_COLUMNS = ['imgUrl', 'productURL']
+CORE_COLUMNS = [column for column in REQUIRED_COLUMNS if column not in HEAVY_COLUMNS]
+
+ROW_GROUP_SIZE = 65536
+
+
+def clean_catalog(df):
+    """
+    Validation and cleaning applied to the clean CSV before it is served
+
+    The result uses the compact dtypes of compact_catalog (categorical
+    categoryName, float32 price/stars, int32 reviews).
+    """
+    missing_columns = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+    if missing_columns:
+        raise ValueError(f"Colonnes manquantes: {missing_columns}")
+
+    df = df.dropna(subset=['title', 'price', 'stars', 'reviews', 'categoryName'])
+    return compact_catalog(df[df['price'] > 0])
+
+
+class CatalogStore:
+    """
+    Columnar cache of the clean catalogue CSV, read column by column
+
+    The cache directory holds a manifest.json (written last) and one data
+    file per build: a Parquet file with row groups of ROW_GROUP_SIZE rows
+    when pyarrow is available, otherwise one pickle per column. The
+    manifest records the source CSV's mtime and size; load() rebuilds the
+    cache whenever they change. The DataFrame index (product ids) is kept.
+
+    load(columns) reads only the requested columns; fetch(ids) reads heavy
+    columns for a few products, touching only their Parquet row groups.
+
+    Builds are serialized by a lock file in the cache directory, so several
+    server processes (or stores) sharing the directory rebuild it once. A
+    build removes older builds but keeps the one the replaced manifest
+    pointed at, which readers of that manifest may still be opening. Create
+    one store per process: it caches the stored index of the current build.
+    """
+    def __init__(self, csv_path, cache_dir=None):
+        self.csv_path = csv_path
+        self.cache_dir = cache_dir or os.path.splitext(csv_path)[0] + '_columnar'
+        # (build, index, pickled columns) of the last build read, replaced as a whole
+        self._stored = (None, None, {})
+        # One rebuild at a time when several threads find the cache stale
+        self._build_lock = threading.Lock()
+
+    def source_fingerprint(self):
+        """
+        (mtime, size) of the source CSV, None if it is missing
+        """
+        try:
+            stat = os.stat(self.csv_path)
+        except OSError:
+            return None
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.cache_dir, 'manifest.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _usable(self, manifest):
+        return (
+            manifest is not None and
+            manifest['source'] == self.source_fingerprint() and
+            (manifest['format'] != 'parquet' or pq is not None)
+        )
+
+    def ensure(self):
+        """
+        Returns the manifest of an up-to-date cache, rebuilding it from the CSV if needed
+        """
+        manifest = self._read_manifest()
+        if not self._usable(manifest):
+            with self._locked():
+                manifest = self._read_manifest()
+                if not self._usable(manifest):
+                    manifest = self._build()
+        return manifest
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """
+        Holds the build lock of this store and, where fcntl exists, of the cache directory
+        """
+        with self._build_lock:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(os.path.join(self.cache_dir, 'build.lock'), 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def build(self, df=None):
+        """
+        Writes a new build of the cache from the CSV (or from an already cleaned df)
+
+        Readers keep using the previous build until the manifest is replaced.
+        """
+        with self._locked():
+            return self._build(df)
+
+    def _build(self, df=None):
+        fingerprint = self.source_fingerprint()
+        if df is None:
+            df = clean_catalog(pd.read_csv(self.csv_path))
+        previous = self._read_manifest()
+        build = f"build-{time.time_ns()}"
+        manifest = {
+            'source': fingerprint,
+            'build': build,
+            'format': 'parquet' if pq is not None else 'pickle',
+            'columns': df.columns.tolist(),
+            'n_rows': len(df),
+            'row_group_size': ROW_GROUP_SIZE,
+        }
+        if pq is not None:
+            df.to_parquet(os.path.join(self.cache_dir, f"{build}.parquet"), engine='pyarrow',
+                          index=True, row_group_size=ROW_GROUP_SIZE)
+        else:
+            build_dir = os.path.join(self.cache_dir, build)
+            os.makedirs(build_dir)
+            pd.Series(df.index, index=df.index).to_pickle(os.path.join(build_dir, '__index__.pkl'))
+            for column in df.columns:
+                df[column].to_pickle(os.path.join(build_dir, f"{column}.pkl"))
+
+        tmp_path = os.path.join(self.cache_dir, 'manifest.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, os.path.join(self.cache_dir, 'manifest.json'))
+        self._remove_old_builds([build] + ([previous['build']] if previous else []))
+        return manifest
+
+    def _remove_old_builds(self, keep):
+        keep = set(keep)
+        for name in os.listdir(self.cache_dir):
+            if name.startswith('build-') and name.split('.')[0] not in keep:
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+                except OSError:
+                    pass  # Still open elsewhere; removed by a later build
+
+    def _data_path(self, manifest):
+        suffix = '.parquet' if manifest['format'] == 'parquet' else ''
+        return os.path.join(self.cache_dir, manifest['build'] + suffix)
+
+    def load(self, columns=None):
+        """
+        Reads the given columns (all by default) of an up-to-date cache
+        """
+        manifest = self.ensure()
+        columns = list(columns) if columns is not None else manifest['columns']
+        path = self._data_path(manifest)
+        if manifest['format'] == 'parquet':
+            df = pd.read_parquet(path, columns=columns, engine='pyarrow')
+        else:
+            df = pd.concat([pd.read_pickle(os.path.join(path, f"{column}.pkl")) for column in columns], axis=1)
+        if self._stored[0] != manifest['build']:
+            self._stored = (manifest['build'], df.index, {})
+        return df
+
+    def _stored_build(self, manifest):
+        """
+        Index and pickled columns cached for the manifest's build, read again when the build changed
+        """
+        stored = self._stored
+        if stored[0] != manifest['build']:
+            path = self._data_path(manifest)
+            if manifest['format'] == 'parquet':
+                index = pd.read_parquet(path, columns=[], engine='pyarrow').index
+            else:
+                index = pd.Index(pd.read_pickle(os.path.join(path, '__index__.pkl')))
+            stored = self._stored = (manifest['build'], index, {})
+        return stored[1], stored[2]
+
+    def fetch(self, ids, columns=HEAVY_COLUMNS):
+        """
+        Values of the given columns for a few products, aligned with ids (NaN for unknown ids)
+
+        With Parquet only the row groups holding these products are decoded;
+        the pickle fallback loads each column once and keeps it.
+        """
+        manifest = self.ensure()
+        ids = pd.Index(ids)
+        index, stored_columns = self._stored_build(manifest)
+        positions = index.get_indexer(ids)
+        rows = np.flatnonzero(positions >= 0)
+        values = {column: np.full(len(ids), np.nan, dtype=object) for column in columns}
+        if len(rows) == 0:
+            return pd.DataFrame(values, index=ids)
+
+        path = self._data_path(manifest)
+        if manifest['format'] == 'parquet':
+            parquet = pq.ParquetFile(path)
+            groups = positions[rows] // manifest['row_group_size']
+            for group in np.unique(groups):
+                in_group = rows[groups == group]
+                offsets = positions[in_group] - group * manifest['row_group_size']
+                table = parquet.read_row_group(int(group), columns=list(columns))
+                for column in columns:
+                    values[column][in_group] = table.column(column).to_numpy(zero_copy_only=False)[offsets]
+        else:
+            for column in columns:
+                if column not in stored_columns:
+                    stored_columns[column] = pd.read_pickle(os.path.join(path, f"{column}.pkl")).to_numpy()
+                values[column][rows] = stored_columns[column][positions[rows]]
+        return pd.DataFrame(values, index=ids)
+
+if __name__ == '__main__':
+    # Pipeline step: python catalog_store.py ../data/clean/amazon_uk_final.csv
+    store = CatalogStore(sys.argv[1])
+    manifest = store.build()
+    print(f"Columnar catalog written: {manifest['n_rows']:,} rows ({manifest['format']}) in {store.cache_dir}")
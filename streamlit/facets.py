@@ -0,0 +1,242 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from result_cache import LRUCache
+
+# Price, stars and reviews are split into at most this many equal-frequency buckets
+N_BUCKETS = 32
+RANGE_COLUMNS = ['price', 'stars', 'reviews']
+
+# Number of set bits of every byte value
+_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def bitmap(positions, n_rows):
+    """
+    Packed bitmap (np.packbits, 8 rows per byte) of the given row positions
+    """
+    mask = np.zeros(n_rows, dtype=bool)
+    mask[positions] = True
+    return np.packbits(mask)
+
+
+def clear_rows(bits, positions):
+    """
+    Clears the bits of the given row positions in place
+    """
+    np.bitwise_and.at(bits, positions >> 3, ~(np.uint8(0x80) >> (positions & 7).astype(np.uint8)))
+
+
+class RangeFacet:
+    """
+    Bucketed bitmaps of one numeric column, answering low <= value <= high
+
+    Rows are split into equal-frequency buckets; cumulative[b] is the bitmap
+    of the rows in buckets 0..b, so the rows of buckets b_low..b_high come
+    from one AND NOT. The rows of the two boundary buckets that fall outside
+    the range are then cleared, found by binary search in the column's
+    sorted order, so the result is exact.
+    """
+    def __init__(self, values, n_buckets=N_BUCKETS):
+        values = np.asarray(values)
+        self.n_rows = len(values)
+        self.order = np.argsort(values, kind='stable').astype(np.int32)
+        self.sorted_values = values[self.order]
+        edges = np.quantile(self.sorted_values, np.linspace(0, 1, n_buckets + 1)[1:-1]) if self.n_rows else []
+        # Bucket b holds the sorted rows bounds[b]:bounds[b + 1]; equal values share a bucket
+        self.bounds = np.unique(np.r_[0, np.searchsorted(self.sorted_values, edges, side='left'), self.n_rows])
+        bucket_of_row = np.empty(self.n_rows, dtype=np.int32)
+        bucket_of_row[self.order] = np.repeat(np.arange(len(self.bounds) - 1), np.diff(self.bounds))
+        self.cumulative = np.stack([
+            np.packbits(bucket_of_row <= bucket) for bucket in range(len(self.bounds) - 1)
+        ]) if self.n_rows else np.zeros((0, 0), dtype=np.uint8)
+
+    @property
+    def nbytes(self):
+        return self.order.nbytes + self.sorted_values.nbytes + self.bounds.nbytes + self.cumulative.nbytes
+
+    def select(self, low=None, high=None):
+        """
+        Bitmap of the rows with low <= value <= high (None: unbounded)
+
+        The bounds are cast to the column's dtype first: a float32 rating of
+        4.2 is below the float64 4.2 but equal to float32(4.2).
+        """
+        dtype = self.sorted_values.dtype.type
+        low = None if low is None else dtype(low)
+        high = None if high is None else dtype(high)
+        start = 0 if low is None else np.searchsorted(self.sorted_values, low, side='left')
+        end = self.n_rows if high is None else np.searchsorted(self.sorted_values, high, side='right')
+        if start >= end:
+            return np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+        first = np.searchsorted(self.bounds, start, side='right') - 1
+        last = np.searchsorted(self.bounds, end - 1, side='right') - 1
+        bits = self.cumulative[last].copy()
+        if first > 0:
+            bits &= ~self.cumulative[first - 1]
+        # Rows of the boundary buckets outside [start, end) of the sorted order
+        clear_rows(bits, self.order[self.bounds[first]:start])
+        clear_rows(bits, self.order[end:self.bounds[last + 1]])
+        return bits
+
+
+class FacetIndex:
+    """
+    Bitmap index of the sidebar filters, built once per catalogue version
+
+    Each category keeps its rows as a packed bitmap, or as sorted int32
+    positions when that is smaller (fewer than one row in 32), expanded on
+    demand. price, stars and reviews have RangeFacet bucketed bitmaps. A
+    filter combination is the bitwise AND of its bitmaps; positions() and
+    top_k() turn the result into rows for the grid. Per-category counts and
+    price statistics are precomputed; describe() memoizes the statistics of
+    other selections.
+
+    sort_keys maps sort option names to functions of the column arrays
+    (price, stars, reviews) returning a key, smallest first. Each option
+    gets an int32 permutation of the catalogue sorted by its key (ties in
+    catalogue order), and first() pages through a selection in that order
+    without sorting it.
+    """
+    def __init__(self, df, n_buckets=N_BUCKETS, stats_cache_size=256, sort_keys=None):
+        self.n_rows = len(df)
+        self.columns = {column: df[column].to_numpy() for column in RANGE_COLUMNS}
+        self.ranges = {column: RangeFacet(self.columns[column], n_buckets) for column in RANGE_COLUMNS}
+
+        self.sort_keys = dict(sort_keys or {})
+        self.sort_orders = {
+            name: np.argsort(np.asarray(key(self.columns), dtype=np.float64), kind='stable').astype(np.int32)
+            for name, key in self.sort_keys.items()
+        }
+
+        categories = pd.Categorical(df['categoryName'])
+        self.categories = [str(name) for name in categories.categories]
+        codes = categories.codes
+        order = np.argsort(codes, kind='stable').astype(np.int32)
+        bounds = np.searchsorted(codes[order], np.arange(len(self.categories) + 1))
+        self._category_rows = []
+        for code in range(len(self.categories)):
+            rows = order[bounds[code]:bounds[code + 1]]
+            # A bitmap costs n_rows / 8 bytes, a position list 4 bytes per row
+            self._category_rows.append(bitmap(rows, self.n_rows) if len(rows) * 32 > self.n_rows else rows)
+        self._category_index = {name: code for code, name in enumerate(self.categories)}
+
+        known = codes >= 0
+        self.category_stats = pd.Series(self.columns['price'][known]).groupby(codes[known]).agg(
+            ['count', 'min', 'max', 'mean', 'median']
+        )
+        self.category_stats.index = [self.categories[code] for code in self.category_stats.index]
+        self._stats_cache = LRUCache(maxsize=stats_cache_size)
+
+    @property
+    def nbytes(self):
+        return (
+            sum(rows.nbytes for rows in self._category_rows) +
+            sum(facet.nbytes for facet in self.ranges.values()) +
+            sum(values.nbytes for values in self.columns.values()) +
+            sum(order.nbytes for order in self.sort_orders.values())
+        )
+
+    def all_rows(self):
+        return bitmap(slice(None), self.n_rows)
+
+    def from_positions(self, positions):
+        return bitmap(positions, self.n_rows)
+
+    def category(self, name):
+        """
+        Bitmap of the rows of a category (empty for an unknown name)
+        """
+        code = self._category_index.get(name)
+        if code is None:
+            return np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+        rows = self._category_rows[code]
+        return rows if rows.dtype == np.uint8 else bitmap(rows, self.n_rows)
+
+    def range(self, column, low=None, high=None):
+        """
+        Bitmap of the rows with low <= column <= high
+        """
+        return self.ranges[column].select(low, high)
+
+    @staticmethod
+    def combine(*bitmaps):
+        """
+        Rows selected by every bitmap (bitwise AND)
+        """
+        return np.bitwise_and.reduce(bitmaps)
+
+    @staticmethod
+    def count(bits):
+        return int(_POPCOUNT[bits].sum(dtype=np.int64))
+
+    def positions(self, bits):
+        """
+        Sorted positions of the selected rows
+        """
+        return np.flatnonzero(np.unpackbits(bits, count=self.n_rows).view(bool))
+
+    def describe(self, bits, column):
+        """
+        count, min, max, mean and median of a column over the selected rows (NaN when empty)
+
+        Memoized by selection, so reruns that keep the same upstream filters
+        (moving a slider further down the chain) reuse the statistics.
+        """
+        key = (column, hashlib.blake2b(bits.tobytes(), digest_size=16).digest())
+
+        def compute():
+            values = self.columns[column][self.positions(bits)]
+            if len(values) == 0:
+                return {'count': 0, 'min': np.nan, 'max': np.nan, 'mean': np.nan, 'median': np.nan}
+            return {
+                'count': len(values),
+                'min': values.min(),
+                'max': values.max(),
+                'mean': values.mean(dtype=np.float64),
+                'median': np.median(values),
+            }
+        return self._stats_cache.get_or_compute(key, compute)
+
+    @staticmethod
+    def top_k(keys, k):
+        """
+        Indices of the k smallest keys, in increasing key order (ties in input order)
+
+        Partial selection: only the k best are sorted, not the whole selection.
+        """
+        if k < len(keys):
+            kth = np.partition(keys, k - 1)[k - 1]
+            best = np.flatnonzero(keys <= kth)
+        else:
+            best = np.arange(len(keys))
+        return best[np.argsort(keys[best], kind='stable')][:k]
+
+    def first(self, bits, sort_option, k):
+        """
+        Positions of the first k selected rows in the order of a sort option
+
+        The option's permutation is scanned in growing chunks, keeping the
+        rows whose bit is set, until k are found. A small selection (under
+        one row in 64) is ranked directly with its keys instead, which gives
+        the same rows without walking most of the permutation.
+        """
+        if self.count(bits) * 64 < self.n_rows:
+            positions = self.positions(bits)
+            keys = np.asarray(self.sort_keys[sort_option](
+                {column: values[positions] for column, values in self.columns.items()}
+            ), dtype=np.float64)
+            return positions[self.top_k(keys, k)]
+
+        order = self.sort_orders[sort_option]
+        hits, found, start, chunk = [], 0, 0, max(8 * k, 4096)
+        while found < k and start < self.n_rows:
+            rows = order[start:start + chunk]
+            selected = rows[(bits[rows >> 3] << (rows & 7).astype(np.uint8)) & 0x80 != 0]
+            hits.append(selected)
+            found += len(selected)
+            start += chunk
+            chunk *= 2
+        return np.concatenate(hits)[:k].astype(np.int64) if hits else np.empty(0, dtype=np.int64)
@@ -0,0 +1,233 @@
+import base64
+import hashlib
+import io
+import os
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+try:
+    from PIL import Image
+except ImportError:  # Optional: without Pillow images are cached at their original size
+    Image = None
+
+THUMBNAIL_SIZE = (300, 300)
+USER_AGENT = 'Mozilla/5.0 (product-thumbnail-cache)'
+
+
+def fetch_url(url, timeout):
+    """
+    Downloads url and returns its bytes (HTTP errors and timeouts raise)
+    """
+    request = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.read()
+
+
+def make_thumbnail(data, size=THUMBNAIL_SIZE, quality=85):
+    """
+    JPEG thumbnail of an image, fitting in size and keeping its aspect ratio
+
+    Returns the original bytes when Pillow is not installed.
+    """
+    if Image is None:
+        return data
+    with Image.open(io.BytesIO(data)) as image:
+        image.thumbnail(size)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=quality)
+        return output.getvalue()
+
+
+class ImageCache:
+    """
+    Size-capped on-disk cache of product thumbnails, filled by concurrent downloads
+
+    Images are downloaded by a pool of max_workers threads with a per-request
+    timeout, shrunk to thumbnail_size and stored as cache_dir/<sha1 of url>.jpg.
+    When the files exceed max_bytes the least recently used are deleted
+    (recency survives restarts through the files' mtimes). Concurrent
+    requests for the same url share one download; a url that failed is not
+    retried for retry_after seconds.
+
+    get_many() waits (up to a deadline) for the images of the cards about
+    to be rendered; prefetch() only queues downloads, for the next page.
+    src() returns what an <img> tag or st.image can use: a data URI of the
+    cached thumbnail, or the remote url when it is not cached (yet).
+    """
+    def __init__(self, cache_dir, max_bytes=256 * 2**20, thumbnail_size=THUMBNAIL_SIZE, max_workers=8,
+                 timeout=5.0, retry_after=300.0, fetcher=fetch_url, clock=time.monotonic):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.thumbnail_size = thumbnail_size
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.fetcher = fetcher
+        self.clock = clock
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='image-fetch')
+        self._lock = threading.Lock()
+        self._files = OrderedDict()
+        self._in_flight = {}
+        self._failures = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        """
+        Registers the thumbnails already on disk, least recently used first
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.jpg'):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._files[key] = size
+            self.bytes += size
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.jpg")
+
+    def path(self, url):
+        """
+        Path of the cached thumbnail of url, None if it is not cached (marks it recently used)
+        """
+        if not isinstance(url, str) or not url:
+            return None
+        key = self.key(url)
+        with self._lock:
+            if key not in self._files:
+                return None
+            self._files.move_to_end(key)
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            # Deleted behind our back (another process sharing the directory)
+            with self._lock:
+                self.bytes -= self._files.pop(key, 0)
+            return None
+        return self._path(key)
+
+    def _download(self, url, key):
+        try:
+            thumbnail = make_thumbnail(self.fetcher(url, self.timeout), self.thumbnail_size)
+            tmp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(thumbnail)
+            os.replace(tmp_path, self._path(key))
+        except Exception:
+            with self._lock:
+                self.errors += 1
+                self._failures[key] = self.clock()
+                self._in_flight.pop(key, None)
+            return None
+        with self._lock:
+            self.bytes += len(thumbnail) - self._files.pop(key, 0)
+            self._files[key] = len(thumbnail)
+            self._evict()
+            self._in_flight.pop(key, None)
+        return self._path(key)
+
+    def _evict(self):
+        # Called with the lock held; the newest thumbnail is kept even if it alone exceeds the cap
+        while self.bytes > self.max_bytes and len(self._files) > 1:
+            key, size = self._files.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def _submit(self, url):
+        """
+        Future of the thumbnail path of url (None when it cannot be fetched right now)
+        """
+        key = self.key(url)
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                return future
+            failed_at = self._failures.get(key)
+            if failed_at is not None and self.clock() - failed_at < self.retry_after:
+                return None
+            self._failures.pop(key, None)
+            self.misses += 1
+            future = self._in_flight[key] = self.executor.submit(self._download, url, key)
+            return future
+
+    def get_many(self, urls, timeout=None):
+        """
+        Thumbnail paths of urls (None for missing ones), downloading the misses concurrently
+
+        Waits at most timeout seconds (default: the request timeout) for the
+        downloads; those still running finish in the background.
+        """
+        paths, futures = {}, {}
+        for url in dict.fromkeys(urls):
+            path = self.path(url)
+            if path is not None:
+                with self._lock:
+                    self.hits += 1
+                paths[url] = path
+            elif isinstance(url, str) and url:
+                future = self._submit(url)
+                if future is not None:
+                    futures[url] = future
+                paths[url] = None
+        if futures:
+            wait(futures.values(), timeout=self.timeout if timeout is None else timeout)
+            for url, future in futures.items():
+                if future.done():
+                    paths[url] = future.result()
+        return paths
+
+    def prefetch(self, urls):
+        """
+        Queues the downloads of the urls not cached yet; returns immediately
+        """
+        for url in dict.fromkeys(urls):
+            if isinstance(url, str) and url and self.path(url) is None:
+                self._submit(url)
+
+    def src(self, url, path=None):
+        """
+        Image source for a card: data URI of the cached thumbnail, else the remote url ('' if none)
+        """
+        path = path or self.path(url)
+        if path is None:
+            return url if isinstance(url, str) else ""
+        try:
+            with open(path, 'rb') as f:
+                return "data:image/jpeg;base64," + base64.b64encode(f.read()).decode('ascii')
+        except OSError:
+            return url if isinstance(url, str) else ""
+
+    def stats(self):
+        with self._lock:
+            return {
+                'files': len(self._files),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'errors': self.errors,
+                'evictions': self.evictions,
+                'in_flight': len(self._in_flight),
+            }
+
+    def close(self):
+        self.executor.shutdown(wait=False)
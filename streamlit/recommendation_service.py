@@ -0,0 +1,507 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http import HTTPStatus
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import pandas as pd
+
+from catalog_dtypes import output_catalog
+from recommender_sys import AmazonRecommender
+
+MAX_BODY_BYTES = 1 << 20
+
+# Marks a query parameter without default
+_REQUIRED = object()
+
+
+class HTTPError(Exception):
+    """
+    Error returned to the client as a JSON body with the given status
+    """
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class MicroBatcher:
+    """
+    Collects concurrent requests into batches bounded by size and wait time
+
+    run_batch(items) runs in the executor and returns one result per item
+    (an Exception instance fails that item only). The first request of a
+    batch waits at most max_wait seconds for company; while a batch runs,
+    new requests queue up for the next one, so batches grow with the load.
+    """
+    def __init__(self, run_batch, max_batch_size=64, max_wait=0.005, executor=None):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.executor = executor
+        self._queue = asyncio.Queue()
+        self._task = None
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        if self._task is None:
+            self._task = loop.create_task(self._collect())
+        future = loop.create_future()
+        self._queue.put_nowait((item, future))
+        return await future
+
+    async def _next_batch(self):
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0 and self._queue.empty():
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), max(timeout, 0)))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            # Callers that gave up (client gone) are not computed
+            batch = [(item, future) for item, future in batch if not future.done()]
+            if not batch:
+                continue
+            try:
+                results = await loop.run_in_executor(self.executor, self.run_batch, [item for item, _ in batch])
+            except Exception as error:
+                results = [error] * len(batch)
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    async def close(self):
+        """
+        Lets queued requests finish, then stops the collector
+        """
+        while self._task is not None and not self._queue.empty():
+            await asyncio.sleep(self.max_wait)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'mean_batch_size': self.items / self.batches if self.batches else 0.0,
+            'queued': self._queue.qsize(),
+            'max_batch_size': self.max_batch_size,
+            'max_wait': self.max_wait,
+        }
+
+
+def frame_records(frame):
+    """
+    JSON-ready records of a recommendation DataFrame, its index exposed as product_id
+
+    Goes through DataFrame.to_json so NaN becomes null and numpy scalars plain numbers;
+    float32 prices and ratings are rounded first (see output_catalog).
+    """
+    if frame.empty:
+        return []
+    frame = output_catalog(frame).reset_index()
+    frame = frame.rename(columns={frame.columns[0]: 'product_id'})
+    return json.loads(frame.to_json(orient='records'))
+
+
+def similar_batch(engine, items):
+    """
+    Answers (product_id, n, seed) requests with one get_similar_products_batch call per (n, seed)
+
+    Seeded requests are first looked up in the engine's similar_cache, under
+    the key of get_similar_products, and the batched answers are stored
+    back: a batch draw with a seed equals the single call with that seed.
+    Returns the records of each request, or a KeyError for unknown products.
+    """
+    cache = engine.similar_cache
+    generation = cache.generation
+    results = [None] * len(items)
+    groups = {}
+    for i, (product_id, n, seed) in enumerate(items):
+        if product_id not in engine.product_data.index:
+            results[i] = KeyError(product_id)
+            continue
+        frame = cache.get((product_id, n, seed)) if cache.maxsize > 0 and seed is not None else None
+        if frame is not None:
+            results[i] = frame_records(frame)
+        else:
+            groups.setdefault((n, seed), []).append(i)
+
+    for (n, seed), indices in groups.items():
+        product_ids = pd.unique(pd.Index([items[i][0] for i in indices]))
+        batch = engine.get_similar_products_batch(product_ids, n=n, random_state=seed)
+        per_source = {}
+        for source_id, frame in batch.groupby(level='source_id', sort=False):
+            frame = frame.droplevel('source_id').set_index('product_id')
+            frame.index.name = engine.product_data.index.name
+            per_source[source_id] = frame
+        if cache.maxsize > 0 and seed is not None:
+            for product_id in product_ids:
+                # Products without recommendations are cached empty, as by get_similar_products
+                cache.put((product_id, n, seed), per_source.get(product_id, pd.DataFrame()), generation)
+        for i in indices:
+            frame = per_source.get(items[i][0])
+            results[i] = frame_records(frame) if frame is not None else []
+    return results
+
+
+class RecommendationService:
+    """
+    Asyncio HTTP/1.1 service around one warm AmazonRecommender
+
+    loader() returns a ready engine (typically AmazonRecommender.load on a
+    snapshot); it runs in the executor at start-up and on every reload, while
+    the previous engine keeps serving. Endpoints (JSON responses):
+
+    - GET /similar/{id}?n=5&seed=42: micro-batched through get_similar_products_batch (seeded answers cached)
+    - GET /category/{name}?n=5
+    - GET /personalized?categories=a,b&min_price=&max_price=&min_rating=&n=5 (or POST a JSON body)
+    - GET /healthz: the process is up; GET /readyz: an engine is loaded and not draining
+    - GET /stats: batcher and engine cache statistics
+    - POST /admin/reload (or SIGHUP): loads a new engine and swaps it in atomically
+    """
+    def __init__(self, loader, host='127.0.0.1', port=8000, max_batch_size=64, max_wait_ms=5.0,
+                 n_threads=4, keepalive_timeout=15.0, shutdown_timeout=10.0):
+        self.loader = loader
+        self.host = host
+        self.port = port
+        self.keepalive_timeout = keepalive_timeout
+        self.shutdown_timeout = shutdown_timeout
+        self.executor = ThreadPoolExecutor(max_workers=n_threads, thread_name_prefix='recommender')
+        self.similar_batcher = MicroBatcher(
+            self._run_similar_batch, max_batch_size=max_batch_size,
+            max_wait=max_wait_ms / 1000, executor=self.executor
+        )
+        self.engine = None
+        self.generation = 0
+        self.last_reload_error = None
+        self.draining = False
+        self._server = None
+        self._reload_lock = None
+        self._connections = set()
+        self._in_flight = 0
+        self._idle = None
+
+    # Engine lifecycle
+
+    async def reload(self):
+        """
+        Loads a new engine in the executor and swaps it in; the old one serves meanwhile
+
+        Batches already running keep the engine they started with. On
+        failure the current engine stays in place and the error is raised.
+        """
+        async with self._reload_lock:
+            try:
+                engine = await asyncio.get_running_loop().run_in_executor(self.executor, self.loader)
+            except Exception as error:
+                self.last_reload_error = str(error)
+                raise
+            self.engine = engine
+            self.generation += 1
+            self.last_reload_error = None
+            return self.generation
+
+    def ready(self):
+        return self.engine is not None and not self.draining
+
+    def _run_similar_batch(self, items):
+        return similar_batch(self.engine, items)
+
+    # Server lifecycle
+
+    async def start(self):
+        self._reload_lock = asyncio.Lock()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        # Liveness is served while the first engine loads; readiness follows it
+        await self.reload()
+        return self
+
+    async def shutdown(self):
+        """
+        Stops accepting connections, lets in-flight requests finish, then closes everything
+        """
+        self.draining = True
+        if self._server is not None:
+            self._server.close()
+        try:
+            await asyncio.wait_for(self._idle.wait(), self.shutdown_timeout)
+        except asyncio.TimeoutError:
+            pass
+        for writer in list(self._connections):
+            writer.close()
+        await self.similar_batcher.close()
+        self.executor.shutdown(wait=False)
+
+    async def serve_forever(self):
+        await self.start()
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        if hasattr(signal, 'SIGHUP'):
+            loop.add_signal_handler(signal.SIGHUP, lambda: loop.create_task(self._reload_quietly()))
+        print(f"Serving recommendations on http://{self.host}:{self.port}")
+        await stop.wait()
+        await self.shutdown()
+
+    async def _reload_quietly(self):
+        try:
+            generation = await self.reload()
+            print(f"Engine reloaded (generation {generation})")
+        except Exception as e:
+            print(f"Reload failed, keeping the current engine: {str(e)}")
+
+    # HTTP
+
+    async def _read_request(self, reader):
+        request_line = await asyncio.wait_for(reader.readline(), self.keepalive_timeout)
+        if not request_line:
+            return None
+        try:
+            method, target, version = request_line.decode('latin-1').split()
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, 'malformed request line')
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length') or 0)
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, 'request body too large')
+        body = await reader.readexactly(length) if length else b''
+        keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+        return method, target, body, keep_alive
+
+    async def _handle_connection(self, reader, writer):
+        self._connections.add(writer)
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except HTTPError as error:
+                    await self._respond(writer, error.status, {'error': error.message}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, target, body, keep_alive = request
+
+                self._in_flight += 1
+                self._idle.clear()
+                try:
+                    status, payload = await self._dispatch(method, target, body)
+                finally:
+                    self._in_flight -= 1
+                    if self._in_flight == 0:
+                        self._idle.set()
+                keep_alive = keep_alive and not self.draining
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _respond(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload).encode('utf-8')
+        status = HTTPStatus(status)
+        head = (
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+    async def _dispatch(self, method, target, body):
+        url = urlsplit(target)
+        parts = [unquote(part) for part in url.path.strip('/').split('/')]
+        query = parse_qs(url.query)
+        try:
+            if parts == ['healthz']:
+                return HTTPStatus.OK, {'status': 'ok'}
+            if parts == ['readyz']:
+                if self.ready():
+                    return HTTPStatus.OK, {'status': 'ready', 'generation': self.generation}
+                state = 'draining' if self.draining else 'loading'
+                return HTTPStatus.SERVICE_UNAVAILABLE, {'status': state}
+            if parts == ['admin', 'reload']:
+                self._require_method(method, 'POST')
+                return await self._reload_endpoint()
+            if not self.ready():
+                raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, 'engine not ready')
+            if parts == ['stats']:
+                return HTTPStatus.OK, self._stats()
+            if len(parts) == 2 and parts[0] == 'similar':
+                self._require_method(method, 'GET')
+                return await self._similar_endpoint(parts[1], query)
+            if len(parts) == 2 and parts[0] == 'category':
+                self._require_method(method, 'GET')
+                return await self._category_endpoint(parts[1], query)
+            if parts == ['personalized']:
+                self._require_method(method, 'GET', 'POST')
+                return await self._personalized_endpoint(method, query, body)
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"no route for {url.path}")
+        except HTTPError as error:
+            return error.status, {'error': error.message}
+        except Exception as error:
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {'error': str(error)}
+
+    @staticmethod
+    def _require_method(method, *allowed):
+        if method not in allowed:
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, f"use {' or '.join(allowed)}")
+
+    @staticmethod
+    def _param(query, name, cast, default=_REQUIRED):
+        values = query.get(name)
+        if not values:
+            if default is _REQUIRED:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, f"missing parameter: {name}")
+            return default
+        try:
+            return cast(values[-1])
+        except (TypeError, ValueError):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"invalid parameter: {name}")
+
+    def _product_id(self, raw):
+        # Path segments are strings; the catalogue index is usually integer
+        index = self.engine.product_data.index
+        if pd.api.types.is_integer_dtype(index.dtype):
+            try:
+                return int(raw)
+            except ValueError:
+                raise HTTPError(HTTPStatus.NOT_FOUND, f"unknown product: {raw}")
+        return raw
+
+    async def _reload_endpoint(self):
+        if self._reload_lock.locked():
+            return HTTPStatus.CONFLICT, {'error': 'reload already in progress'}
+        try:
+            generation = await self.reload()
+        except Exception as error:
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {'error': f"reload failed: {error}", 'generation': self.generation}
+        return HTTPStatus.OK, {'status': 'reloaded', 'generation': generation}
+
+    async def _similar_endpoint(self, raw_id, query):
+        product_id = self._product_id(raw_id)
+        n = self._param(query, 'n', int, 5)
+        seed = self._param(query, 'seed', int, None)
+        try:
+            records = await self.similar_batcher.submit((product_id, n, seed))
+        except KeyError:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"unknown product: {raw_id}")
+        return HTTPStatus.OK, {'product_id': product_id, 'recommendations': records}
+
+    async def _category_endpoint(self, category, query):
+        engine = self.engine
+        if category not in engine._category_index:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"unknown category: {category}")
+        n = self._param(query, 'n', int, 5)
+        frame = await asyncio.get_running_loop().run_in_executor(
+            self.executor, partial(engine.get_category_recommendations, category, n)
+        )
+        return HTTPStatus.OK, {'category': category, 'recommendations': frame_records(frame)}
+
+    async def _personalized_endpoint(self, method, query, body):
+        if method == 'POST':
+            try:
+                prefs = json.loads(body or b'{}')
+            except ValueError:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, 'body must be JSON')
+            query = {
+                name: [','.join(value) if isinstance(value, list) else str(value)]
+                for name, value in prefs.items()
+            }
+        categories = [
+            category for value in query.get('categories', []) for category in value.split(',') if category
+        ]
+        if not categories:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, 'missing parameter: categories')
+        user_prefs = {
+            'categories': categories,
+            'min_price': self._param(query, 'min_price', float, 0.0),
+            'max_price': self._param(query, 'max_price', float, float('inf')),
+            'min_rating': self._param(query, 'min_rating', float, 0.0),
+        }
+        n = self._param(query, 'n', int, 5)
+        frame = await asyncio.get_running_loop().run_in_executor(
+            self.executor, partial(self.engine.get_personalized_recommendations, user_prefs, n)
+        )
+        return HTTPStatus.OK, {'preferences': user_prefs, 'recommendations': frame_records(frame)}
+
+    def _stats(self):
+        return {
+            'generation': self.generation,
+            'last_reload_error': self.last_reload_error,
+            'in_flight': self._in_flight,
+            'similar_batches': self.similar_batcher.stats(),
+            'caches': self.engine.cache_stats(),
+        }
+
+
+def snapshot_loader(model_dir, **options):
+    """
+    Loader for RecommendationService: the snapshot currently saved in model_dir
+    """
+    return partial(AmazonRecommender.load, model_dir, **options)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a saved AmazonRecommender snapshot over HTTP")
+    parser.add_argument('--model-dir', default=os.path.join('..', 'data', 'models', 'amazon_recommender'))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--similar-cache-size', type=int, default=2048)
+    args = parser.parse_args(argv)
+
+    service = RecommendationService(
+        snapshot_loader(args.model_dir, similar_cache_size=args.similar_cache_size),
+        host=args.host, port=args.port, max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms, n_threads=args.threads
+    )
+    asyncio.run(service.serve_forever())
+
+
+if __name__ == '__main__':
+    main()
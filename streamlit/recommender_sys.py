@@ -1,72 +1,528 @@
+import copy
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np 
 import pandas as pd
+from scipy import sparse
 from sklearn.preprocessing import MinMaxScaler
 from sklearn.neighbors import NearestNeighbors
+
+from ann_index import (ANN_BACKENDS, cosine_similarity_rows, cosine_top_k_block, measure_recall,
+                       normalize_rows, top_k_rows)
+from catalog_dtypes import category_dtype, compact_catalog, float64_values, output_catalog
+from quantile_sketch import KLLSketch
+from result_cache import LRUCache
+from sorted_index import patch_sorted_order, remap_positions
 from warnings import filterwarnings
 filterwarnings('ignore', category=UserWarning)
 
+SNAPSHOT_FORMAT_VERSION = 2
+
+# Lignes libres gardées en fin de matrice dense par partial_fit (part du catalogue) pour ajouter sans recopier
+FEATURE_HEADROOM = 0.125
+
+PRICE_LABELS = ['very_low', 'low', 'medium', 'high', 'very_high']
+RATING_BINS = [0, 3.5, 4.0, 4.5, 5.0]
+RATING_LABELS = ['low', 'medium', 'high', 'very_high']
+
+DEFAULT_TAXONOMY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'category_taxonomy.json')
+
+
+def load_taxonomy(path=DEFAULT_TAXONOMY_PATH):
+    """
+    Charge la taxonomie des catégories (grandes catégories → sous-catégories)
+
+    Format JSON : {"default_similarity": float, "groups": [{"name", "similarity",
+    "categories"}, ...]}. Ajouter un groupe ne coûte rien à la requête : la
+    matrice de similarité est construite une seule fois dans fit().
+    """
+    with open(path, encoding='utf-8') as f:
+        taxonomy = json.load(f)
+
+    if 'groups' not in taxonomy:
+        raise ValueError(f"Taxonomie invalide (clé 'groups' manquante): {path}")
+    taxonomy.setdefault('default_similarity', 0.3)
+    for group in taxonomy['groups']:
+        missing = {'name', 'similarity', 'categories'} - set(group)
+        if missing:
+            raise ValueError(f"Groupe de taxonomie invalide, clés manquantes: {sorted(missing)}")
+
+    return taxonomy
+
+
+# Bande de prix et similarité de catégorie minimale des candidats de get_similar_products
+MIN_PRICE_RATIO = 0.2
+MAX_PRICE_RATIO = 3.0
+MIN_CATEGORY_SIMILARITY = 0.4
+
+# Segments de get_similar_products :
+# (description, similarité de catégorie >, ratio de prix min <, < ratio max, note >=, nombre tiré)
+SIMILAR_SEGMENTS = [
+    ("Même catégorie, prix différent", 0.9, 0.5, 2.0, 0.0, 1),
+    ("Catégorie similaire", 0.6, 0.3, 2.5, 4.2, 2),
+    ("Différent mais pertinent", 0.4, 0.2, 3.0, 4.2, 2),
+]
+
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _mix64(x):
+    """
+    Finaliseur splitmix64, vectorisé sur des uint64
+    """
+    with np.errstate(over='ignore'):
+        x = x ^ (x >> np.uint64(30))
+        x = x * _MIX_1
+        x = x ^ (x >> np.uint64(27))
+        x = x * _MIX_2
+        return x ^ (x >> np.uint64(31))
+
+
+def _hash_uniform(seed, source, stream, positions):
+    """
+    Uniformes dans ]0, 1[ dérivées de (seed, source, stream, position) par hachage
+
+    Le bruit d'un candidat ne dépend pas de l'ordre ni de la composition du
+    pool : un même seed donne le même tirage en appel simple, en batch ou
+    réparti entre plusieurs processus.
+    """
+    with np.errstate(over='ignore'):
+        base = _mix64(np.uint64(seed) ^ _mix64(np.uint64(source) * np.uint64(4) + np.uint64(stream) + _GOLDEN))
+        x = _mix64(base ^ (np.asarray(positions, dtype=np.uint64) * _GOLDEN))
+    return ((x >> np.uint64(11)).astype(np.float64) + 0.5) / 2.0 ** 53
+
+
+def _draw_seed(random_state):
+    """
+    Seed entier à partir de random_state (None, int, RandomState ou Generator)
+    """
+    if random_state is None:
+        return int(np.random.randint(0, 2 ** 31 - 1))
+    if isinstance(random_state, (int, np.integer)):
+        return int(random_state) % 2 ** 64
+    return int(random_state.integers(0, 2 ** 63 - 1)) if hasattr(random_state, 'integers') \
+        else int(random_state.randint(0, 2 ** 31 - 1))
+
+
+def _top_k(keys, k, values=None):
+    """
+    Les k plus grandes clés (ordre décroissant) par argpartition ; renvoie values[...] si fourni
+    """
+    k = min(k, len(keys))
+    top = np.argpartition(-keys, k - 1)[:k] if k < len(keys) else np.arange(len(keys))
+    top = top[np.argsort(-keys[top], kind='stable')]
+    return top if values is None else values[top]
+
+
+def _nlargest_positions(scores, positions, n):
+    """
+    Les n positions de plus grand score, équivalent exact de DataFrame.nlargest(keep='first')
+
+    Sélection en O(m) par argpartition ; les égalités gardent l'ordre des
+    positions et les scores NaN ne complètent le résultat qu'en dernier.
+    """
+    valid = np.flatnonzero(~np.isnan(scores))
+    chosen = np.empty(0, dtype=np.int64)
+    if len(valid) and n > 0:
+        k = min(n, len(valid))
+        # Seuil = k-ième plus grand score ; on garde toutes les égalités avec lui
+        threshold = -np.partition(-scores[valid], k - 1)[k - 1]
+        chosen = valid[scores[valid] >= threshold]
+        chosen = chosen[np.lexsort((positions[chosen], -scores[chosen]))][:k]
+    if len(chosen) < n:
+        missing = np.flatnonzero(np.isnan(scores))
+        missing = missing[np.argsort(positions[missing], kind='stable')][:n - len(chosen)]
+        chosen = np.concatenate([chosen, missing])
+    return positions[chosen], scores[chosen]
+
+
+def _top_k_allowed(keys, k, values, is_allowed):
+    """
+    Les k valeurs de plus grande clé qui passent is_allowed, en élargissant la sélection au besoin
+    """
+    width = k
+    while True:
+        top = _top_k(keys, 4 * width, values)
+        allowed = [value for value in top if is_allowed(value)][:k]
+        if len(allowed) == k or len(top) == len(keys):
+            return np.asarray(allowed, dtype=np.int64)
+        width *= 4
+
+
+def _top_categories(category_counts):
+    """
+    Effectifs des 50 catégories principales, à partir des effectifs rangés dans l'ordre du dictionnaire
+
+    Les égalités sont départagées par cet ordre : fit() et fit_from_csv()
+    (qui additionne les effectifs de chaque morceau) choisissent les mêmes.
+    """
+    return category_counts[category_counts > 0].nlargest(50)
+
+
+def _main_categories(names, top_categories):
+    """
+    Nom de catégorie, ou 'Other' hors des catégories principales (colonne catégorielle acceptée)
+    """
+    if isinstance(names.dtype, pd.CategoricalDtype):
+        names = names.astype(object)
+    return names.where(names.isin(top_categories), 'Other')
+
+
+def index_fingerprint(index):
+    """
+    Empreinte (SHA-1) des identifiants produits dans leur ordre
+
+    Deux tables de même longueur mais filtrées ou triées autrement ont des
+    empreintes différentes : load() refuse alors un product_data désaligné.
+    """
+    hashes = pd.util.hash_pandas_object(pd.Index(index), index=False).to_numpy()
+    return hashlib.sha1(np.ascontiguousarray(hashes).tobytes()).hexdigest()
+
+
+def _remove_features_dir(path, owner_pid):
+    """
+    Supprime un répertoire de features temporaire, seulement depuis le processus qui l'a créé
+
+    Un worker forké hérite du finaliseur : il ne doit pas effacer les
+    fichiers encore mappés par le processus parent.
+    """
+    if os.getpid() == owner_pid:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+# Modèle partagé par les workers de get_similar_products_batch
+_BATCH_RECOMMENDER = None
+
+
+def _init_batch_worker(recommender):
+    global _BATCH_RECOMMENDER
+    _BATCH_RECOMMENDER = recommender
+
+
+def _similar_block_worker(source_positions, n, random_state):
+    return _BATCH_RECOMMENDER._similar_block(source_positions, n, random_state)
+
+
+# Features normalisées partagées par les workers de precompute_neighbors
+_NEIGHBOR_FEATURES = None
+
+
+def _init_neighbor_worker(features):
+    global _NEIGHBOR_FEATURES
+    _NEIGHBOR_FEATURES = features
+
+
+def _neighbor_block_worker(start, stop, k, path):
+    ids = np.load(os.path.join(path, 'neighbor_ids.npy'), mmap_mode='r+')
+    scores = np.load(os.path.join(path, 'neighbor_scores.npy'), mmap_mode='r+')
+    ids[start:stop], scores[start:stop] = cosine_top_k_block(_NEIGHBOR_FEATURES, start, stop, k)
+    ids.flush()
+    scores.flush()
+    return stop - start
+
+
 class AmazonRecommender:
     """
     Système de recommandation pour les produits Amazon
     """
-    def __init__(self):
+    # Tableaux dérivés écrits tels quels dans un snapshot (un fichier .npy chacun)
+    _SNAPSHOT_ARRAYS = (
+        'category_codes', 'category_similarity', 'price_bins',
+        'family_codes', 'family_order', 'family_offsets',
+        'prices', 'stars', 'reviews',
+        'price_order', 'sorted_prices',
+        'category_price_order', 'category_price_offsets', 'category_sorted_prices',
+        'category_sorted_stars', 'category_sorted_reviews',
+        'neighbor_ids', 'neighbor_scores',
+        'leaderboard_order', 'leaderboard_scores', 'leaderboard_offsets'
+    )
+
+    def __init__(self, taxonomy_path=DEFAULT_TAXONOMY_PATH, candidate_pool='scan', n_candidates=200,
+                 knn_backend='brute', knn_params=None, feature_format='dense',
+                 personalized_cache_size=1024, drift_tolerance=0.05,
+                 similar_cache_size=0, similar_cache_ttl=None, similar_cache_max_bytes=None,
+                 price_sketch_k=None):
+        """
+        feature_format : 'dense' (DataFrame float64) ou 'sparse' (CSR float32, bien plus compact)
+        candidate_pool : 'scan' parcourt toute la bande de prix (résultat exact),
+            'knn' ne garde que les n_candidates plus proches voisins du produit
+        knn_backend : 'brute' (sklearn, exact), 'lsh' ou 'ivf' (approximatifs, NumPy pur),
+            réglés par knn_params (voir ann_index)
+        personalized_cache_size : nombre de réponses de get_personalized_recommendations
+            gardées en cache LRU (0 pour désactiver)
+        drift_tolerance : dérive tolérée par partial_fit avant de refaire les features
+            (part du catalogue qui changerait de quintile de prix, déplacement
+            relatif des plages des features numériques)
+        similar_cache_size : nombre de réponses de get_similar_products (appels
+            avec une seed entière) gardées en cache (0, par défaut, désactive le
+            cache), avec expiration optionnelle après similar_cache_ttl secondes
+            et plafond mémoire similar_cache_max_bytes
+        price_sketch_k : si fixé, les quintiles de prix viennent d'un KLLSketch
+            de cette taille au lieu d'un tri complet (erreur de rang ~1.7 / k)
+        """
+        if candidate_pool not in ('scan', 'knn'):
+            raise ValueError(f"candidate_pool inconnu: {candidate_pool}")
+        if knn_backend != 'brute' and knn_backend not in ANN_BACKENDS:
+            raise ValueError(f"knn_backend inconnu: {knn_backend}")
+        if feature_format not in ('dense', 'sparse'):
+            raise ValueError(f"feature_format inconnu: {feature_format}")
+        self.feature_format = feature_format
+        self.drift_tolerance = drift_tolerance
+        self.price_sketch_k = price_sketch_k
+        self.candidate_pool = candidate_pool
+        self.n_candidates = n_candidates
+        self.knn_backend = knn_backend
+        self.knn_params = dict(knn_params or {})
         self.knn_model = None
         self.scaler = MinMaxScaler()
         self.product_features = None
+        self._feature_buffer = None
+        self._features_finalizer = None
+        self.feature_columns = None
         self.product_data = None
+        self.categories = None
+        self.category_codes = None
+        self.category_similarity = None
+        self._category_index = {}
+        self.taxonomy = load_taxonomy(taxonomy_path)
+        self.top_categories = None
+        self.price_bins = None
+        self.price_max = None
+        self.reviews_max = None
+        self.titles_lower = None
+        self.family_codes = None
+        self.family_order = None
+        self.family_offsets = None
+        self._family_index = None
+        self.prices = None
+        self.stars = None
+        self.reviews = None
+        self.price_order = None
+        self.sorted_prices = None
+        self.category_price_order = None
+        self.category_price_offsets = None
+        self.category_sorted_prices = None
+        self.category_sorted_stars = None
+        self.category_sorted_reviews = None
+        self.personalized_cache = LRUCache(personalized_cache_size)
+        self.similar_cache = LRUCache(similar_cache_size, ttl=similar_cache_ttl, max_bytes=similar_cache_max_bytes)
+        self.neighbor_ids = None
+        self.neighbor_scores = None
+        self.leaderboard_order = None
+        self.leaderboard_scores = None
+        self.leaderboard_offsets = None
+        self.last_update = None
+        self.global_positions = None
     
     def _calculate_category_similarity(self, cat1, cat2):
         """
         Calcule la similarité entre deux catégories basée sur des règles métier
         """
-        electronics_categories = {
-            'Hi-Fi Speakers', 'PC & Video Games', 'PC Gaming Accessories',
-            'Headphones', 'Home Audio & Theater', 'TV & Home Cinema',
-            'Home Entertainment', 'Electrical', 'Consumer Electronics'
-        }
-        
-        home_categories = {
-            'Home & Kitchen', 'Furniture', 'Home Entertainment Furniture',
-            'Home Improvement', 'Home Accessories', 'Home Storage'
-        }
-        
         if cat1 == cat2:
             return 1.0
-        elif cat1 in electronics_categories and cat2 in electronics_categories:
-            if 'Speakers' in cat1 and 'Speakers' in cat2:
-                return 0.8
-            return 0.6
-        elif cat1 in home_categories and cat2 in home_categories:
-            return 0.6
-        else:
-            return 0.3
-    
-    def create_product_features(self, df):
+        code1 = self._category_index.get(cat1)
+        code2 = self._category_index.get(cat2)
+        if code1 is None or code2 is None:
+            return float(self.taxonomy['default_similarity'])
+        return float(self.category_similarity[code1, code2])
+
+    @staticmethod
+    def _title_family_key(title):
+        """
+        Clé de famille d'un produit : début du titre (avant le premier '|'), en minuscules
+        """
+        return str(title).lower().split('|')[0].strip()
+
+    def _get_titles_lower(self):
+        """
+        Titres en minuscules, calculés une seule fois (à la demande après un load)
+        """
+        if self.titles_lower is None:
+            self.titles_lower = self.product_data['title'].astype(str).str.lower().to_numpy()
+        return self.titles_lower
+
+    def _build_title_index(self):
+        """
+        Indexe les familles de produits (titres partageant le même début)
+
+        Chaque produit reçoit un code de famille ; les positions sont triées par
+        famille avec un tableau d'offsets, si bien que les membres d'une famille
+        sont une simple tranche. Le dictionnaire clé -> code utilisé par
+        partial_fit est gardé au passage (voir _get_family_index).
+        """
+        titles_lower = self._get_titles_lower()
+        family_keys = pd.Series(titles_lower).str.split('|', n=1).str[0].str.strip()
+        codes, keys = pd.factorize(family_keys)
+        self._family_index = dict(zip(keys, range(len(keys))))
+        self.family_codes = codes.astype(np.int32)
+        self.family_order = np.argsort(self.family_codes, kind='stable').astype(np.int32)
+        self.family_offsets = np.searchsorted(
+            self.family_codes[self.family_order],
+            np.arange(self.family_codes.max() + 2 if len(codes) else 1)
+        ).astype(np.int64)
+
+    def get_product_family(self, product_id):
+        """
+        Retourne les identifiants des produits de la même famille que product_id
+        """
+        code = self.family_codes[self.product_data.index.get_loc(product_id)]
+        members = self.family_order[self.family_offsets[code]:self.family_offsets[code + 1]]
+        return self.product_data.index[members]
+
+    def _build_product_arrays(self):
+        """
+        Copie prix, notes et avis dans des tableaux NumPy alignés sur les positions
+
+        Prix et notes float32 sont arrondis à leurs décimales du CSV (voir
+        float64_values) : une note de 4.2 doit passer le seuil 4.2 des filtres.
+        """
+        self.prices = float64_values(self.product_data['price'])
+        self.stars = float64_values(self.product_data['stars'])
+        self.reviews = self.product_data['reviews'].to_numpy(dtype=np.float64)
+
+    def _build_price_index(self):
+        """
+        Permutations triées par prix, globale et par catégorie
+
+        La version par catégorie est rangée bloc par bloc (positions triées par
+        (catégorie, prix)) avec un tableau d'offsets : la bande de prix d'une
+        catégorie se trouve par deux searchsorted dans sa tranche.
+        """
+        self.price_order = np.argsort(self.prices, kind='stable').astype(np.int32)
+        self.sorted_prices = self.prices[self.price_order]
+
+        self.category_price_order = np.lexsort((self.prices, self.category_codes)).astype(np.int32)
+        self.category_sorted_prices = self.prices[self.category_price_order]
+        # Notes et avis rangés comme l'index : une bande de prix se lit en tranches contiguës
+        self.category_sorted_stars = self.stars[self.category_price_order]
+        self.category_sorted_reviews = self.reviews[self.category_price_order]
+        self.category_price_offsets = np.searchsorted(
+            self.category_codes[self.category_price_order],
+            np.arange(len(self.categories) + 1)
+        ).astype(np.int64)
+
+    def _build_indexes(self, missing_only=False):
+        """
+        Construit les index dérivés de product_data (tous, ou seulement ceux absents d'un snapshot)
+        """
+        builders = (
+            ('category_similarity', self._build_category_similarity),
+            ('family_codes', self._build_title_index),
+            ('prices', self._build_product_arrays),
+            ('category_sorted_stars', self._build_price_index),
+            ('leaderboard_order', self._build_leaderboards),
+        )
+        for attr, build in builders:
+            if not missing_only or getattr(self, attr) is None:
+                build()
+
+    def _price_band_positions(self, min_price, max_price, category_codes=None):
+        """
+        Positions des produits dont le prix est dans [min_price, max_price]
+
+        Le coût est proportionnel à la taille de la bande : deux recherches
+        dichotomiques par catégorie demandée (ou sur l'index global).
+        """
+        if category_codes is None:
+            start = np.searchsorted(self.sorted_prices, min_price, side='left')
+            stop = np.searchsorted(self.sorted_prices, max_price, side='right')
+            return self.price_order[start:stop]
+
+        slices = [
+            self.category_price_order[start:stop]
+            for start, stop in self._category_band_bounds(min_price, max_price, category_codes)
+        ]
+        if not slices:
+            return np.empty(0, dtype=np.int32)
+        return np.concatenate(slices)
+
+    def _category_band_bounds(self, min_price, max_price, category_codes):
+        """
+        Bornes [start, stop) dans l'index (catégorie, prix) de la bande de prix de chaque catégorie
+
+        Les catégories sans produit dans la bande sont omises.
+        """
+        bounds = []
+        for code in category_codes:
+            begin, end = self.category_price_offsets[code], self.category_price_offsets[code + 1]
+            prices = self.category_sorted_prices[begin:end]
+            start = begin + np.searchsorted(prices, min_price, side='left')
+            stop = begin + np.searchsorted(prices, max_price, side='right')
+            if stop > start:
+                bounds.append((start, stop))
+        return bounds
+
+    def _build_category_similarity(self):
+        """
+        Construit la matrice C×C de similarité entre catégories à partir de la taxonomie
+
+        Chaque groupe (grande catégorie → sous-catégories) donne sa similarité
+        aux paires de catégories qu'il contient ; une paire couverte par
+        plusieurs groupes garde la valeur la plus haute.
+        """
+        n_categories = len(self.categories)
+        similarity = np.full(
+            (n_categories, n_categories),
+            self.taxonomy['default_similarity'],
+            dtype=np.float64
+        )
+        for group in self.taxonomy['groups']:
+            codes = [self._category_index[c] for c in group['categories'] if c in self._category_index]
+            if codes:
+                block = np.ix_(codes, codes)
+                similarity[block] = np.maximum(similarity[block], group['similarity'])
+        np.fill_diagonal(similarity, 1.0)
+        self.category_similarity = similarity
+        return similarity
+
+    def create_product_features(self, df, price_sketch=None):
         """
         Crée les features avec pondérations adaptatives
+
+        Avec feature_format='sparse', la matrice est une CSR float32 : trois
+        colonnes numériques plus un seul 1 par groupe one-hot (6 valeurs non
+        nulles par produit au lieu d'environ 63 cellules float64).
+        price_sketch : KLLSketch des prix (ex. fusion de sketches calculés par
+        morceaux) dont sont tirées les bornes des quintiles, voir _price_segments.
         """
-        feature_df = pd.DataFrame(index=df.index)
-        
         # Features numériques normalisées
-        feature_df['price_norm'] = np.log1p(df['price']) / np.log1p(df['price'].max())
-        feature_df['stars_norm'] = df['stars'] / 5
-        feature_df['reviews_norm'] = np.log1p(df['reviews']) / np.log1p(df['reviews'].max())
+        self._feature_buffer = None
+        self._release_features_dir()
+        self.price_max = float(df['price'].max())
+        self.reviews_max = float(df['reviews'].max())
+        numeric = self._numeric_features(df)
         
         # Segmentation des prix
-        price_quantiles = pd.qcut(df['price'], q=5, labels=['very_low', 'low', 'medium', 'high', 'very_high'])
-        price_dummies = pd.get_dummies(price_quantiles, prefix='price')
+        price_quantiles, price_bins = self._price_segments(df['price'], price_sketch)
+        self.price_bins = np.asarray(price_bins, dtype=np.float64)
         
         # Segmentation des notes
         rating_cats = pd.cut(df['stars'], 
-                           bins=[0, 3.5, 4.0, 4.5, 5.0], 
-                           labels=['low', 'medium', 'high', 'very_high'])
-        rating_dummies = pd.get_dummies(rating_cats, prefix='rating')
+                           bins=RATING_BINS, 
+                           labels=RATING_LABELS)
         
         # Catégories principales
-        top_categories = df['categoryName'].value_counts().nlargest(50).index
-        df_filtered = df.copy()
-        df_filtered.loc[~df_filtered['categoryName'].isin(top_categories), 'categoryName'] = 'Other'
-        category_dummies = pd.get_dummies(df_filtered['categoryName'], prefix='category')
+        top_categories = _top_categories(df['categoryName'].value_counts(sort=False)).index
+        self.top_categories = top_categories.tolist()
+        main_categories = _main_categories(df['categoryName'], top_categories)
+        
+        if self.feature_format == 'sparse':
+            self.product_features = self._sparse_features(numeric, price_quantiles, rating_cats, main_categories)
+            return self.product_features
+        
+        feature_df = pd.DataFrame(numeric, index=df.index)
+        price_dummies = pd.get_dummies(price_quantiles, prefix='price')
+        rating_dummies = pd.get_dummies(rating_cats, prefix='rating')
+        category_dummies = pd.get_dummies(main_categories, prefix='category')
         
         self.product_features = pd.concat([
             feature_df,
@@ -80,189 +536,1650 @@ class AmazonRecommender:
             columns=self.product_features.columns, 
             index=df.index
         )
+        self.feature_columns = self.product_features.columns.tolist()
         
         return self.product_features
 
-    def get_similar_products(self, product_id, n=5):
+    def _sparse_features(self, numeric, price_quantiles, rating_cats, main_categories):
+        """
+        Construit la matrice de features en CSR float32 à partir de codes entiers
+
+        Donne les mêmes valeurs que la version dense : seul le bloc numérique
+        passe par le MinMaxScaler (un one-hot reste 0/1, et une colonne
+        constante vaut 0 comme après MinMaxScaler).
+        """
+        numeric_block = self.scaler.fit_transform(pd.DataFrame(numeric)).astype(np.float32)
+        n_products, n_numeric = numeric_block.shape
+        
+        category_labels = sorted(main_categories.unique().tolist())
+        groups = [
+            ('price', PRICE_LABELS, np.asarray(price_quantiles.cat.codes)),
+            ('rating', RATING_LABELS, np.asarray(rating_cats.cat.codes)),
+            ('category', category_labels,
+             np.asarray(pd.Categorical(main_categories, categories=category_labels).codes)),
+        ]
+        
+        columns = list(numeric)
+        indices = np.empty((n_products, n_numeric + len(groups)), dtype=np.int32)
+        data = np.zeros((n_products, n_numeric + len(groups)), dtype=np.float32)
+        indices[:, :n_numeric] = np.arange(n_numeric)
+        data[:, :n_numeric] = numeric_block
+        for i, (prefix, labels, codes) in enumerate(groups):
+            column = n_numeric + i
+            present = codes >= 0
+            counts = np.bincount(codes[present], minlength=len(labels))
+            varying = (counts > 0) & (counts < n_products)
+            indices[:, column] = len(columns) + np.where(present, codes, 0)
+            data[:, column] = present & varying[np.where(present, codes, 0)]
+            columns.extend(f"{prefix}_{label}" for label in labels)
+        
+        features = sparse.csr_matrix(
+            (data.ravel(), indices.ravel(), np.arange(0, data.size + 1, data.shape[1])),
+            shape=(n_products, len(columns))
+        )
+        features.eliminate_zeros()
+        self.feature_columns = columns
+        return features
+
+    def _price_segments(self, prices, price_sketch=None):
+        """
+        Quintile de prix de chaque produit (PRICE_LABELS) et bornes des quintiles
+
+        Bornes exactes de pd.qcut par défaut ; avec un sketch (fourni, ou
+        construit si price_sketch_k est fixé) les bornes sont approchées et
+        les prix hors de [min, max] du sketch n'ont pas de quintile.
+        """
+        if price_sketch is None and self.price_sketch_k is not None:
+            price_sketch = KLLSketch.from_values(prices, k=self.price_sketch_k, seed=0)
+        if price_sketch is None:
+            return pd.qcut(prices, q=5, labels=PRICE_LABELS, retbins=True)
+        price_bins = price_sketch.qcut_edges(len(PRICE_LABELS))
+        return pd.cut(prices, bins=price_bins, labels=PRICE_LABELS, include_lowest=True), price_bins
+
+    def _numeric_features(self, df):
+        """
+        Features numériques avant normalisation, calculées dans le type flottant des colonnes
+        """
+        return {
+            'price_norm': np.log1p(df['price']) / np.log1p(self.price_max),
+            'stars_norm': df['stars'] / 5,
+            'reviews_norm': np.log1p(df['reviews']) / np.log1p(self.reviews_max),
+        }
+
+    def _fit_feature_layout(self, stats, price_sketch):
+        """
+        Paramètres de create_product_features à partir des statistiques d'un passage sur le CSV
+
+        stats : n_products, extremes (min et max de price, stars et reviews
+        dans les types compacts), category_counts (dans l'ordre du
+        dictionnaire), rating_counts. Les bornes des quintiles viennent de
+        price_sketch ; leurs effectifs, de la colonne price de la table
+        produits. Fixe price_max, reviews_max, price_bins, top_categories,
+        feature_columns et le MinMaxScaler (ajusté sur les seuls minima et
+        maxima de chaque colonne, ce qui donne exactement les mêmes
+        paramètres qu'un fit sur la matrice). Retourne le masque des colonnes
+        constantes, comme _constant_feature_columns.
+        """
+        n_products, extremes = stats['n_products'], stats['extremes']
+        self.price_max = float(extremes['price'].max())
+        self.reviews_max = float(extremes['reviews'].max())
+        
+        price_quantiles, price_bins = self._price_segments(self.product_data['price'], price_sketch)
+        self.price_bins = np.asarray(price_bins, dtype=np.float64)
+        price_codes = np.asarray(price_quantiles.cat.codes)
+        
+        top_categories = _top_categories(stats['category_counts'])
+        self.top_categories = top_categories.index.tolist()
+        main_counts = dict(zip(self.top_categories, top_categories.tolist()))
+        n_other = n_products - sum(main_counts.values())
+        if n_other > 0:
+            main_counts['Other'] = n_other
+        category_labels = sorted(main_counts)
+        
+        onehot_counts = np.concatenate([
+            np.bincount(price_codes[price_codes >= 0], minlength=len(PRICE_LABELS)),
+            stats['rating_counts'],
+            [main_counts[label] for label in category_labels],
+        ])
+        numeric_columns = ['price_norm', 'stars_norm', 'reviews_norm']
+        self.feature_columns = (
+            numeric_columns +
+            [f"price_{label}" for label in PRICE_LABELS] +
+            [f"rating_{label}" for label in RATING_LABELS] +
+            [f"category_{label}" for label in category_labels]
+        )
+        
+        # Les transformations numériques étant croissantes, min et max suffisent
+        extremes = pd.DataFrame(self._numeric_features(extremes))
+        if self.feature_format == 'dense':
+            # Un one-hot vaut 0 et 1, sauf s'il est toujours (ou jamais) présent
+            onehot_extremes = np.array([onehot_counts == n_products, onehot_counts > 0], dtype=np.float64)
+            extremes = pd.concat([
+                extremes, pd.DataFrame(onehot_extremes, columns=self.feature_columns[len(numeric_columns):])
+            ], axis=1)
+        self.scaler.fit(extremes)
+        self.scaler.n_samples_seen_ = n_products
+        
+        onehot_constant = (onehot_counts == 0) | (onehot_counts == n_products)
+        return np.concatenate([self.scaler.data_range_[:len(numeric_columns)] == 0, onehot_constant])
+
+    def _write_features(self, chunks, constant, features_dir):
+        """
+        Écrit la matrice de features, morceau par morceau, dans des .npy mappés
+
+        chunks : morceaux successifs des lignes de product_data (colonnes
+        price, stars, reviews et categoryName), par exemple relus du CSV.
+        Dense : features.npy (float64, N x F). Sparse : features_data.npy,
+        features_indices.npy et features_indptr.npy, dimensionnés pour au plus
+        une valeur par groupe de colonnes et par ligne. La matrice renvoyée
+        lit directement ces fichiers.
+        """
+        os.makedirs(features_dir, exist_ok=True)
+        index = self.product_data.index
+        n_products, n_columns = len(index), len(self.feature_columns)
+        
+        def open_array(name, dtype, shape):
+            return np.lib.format.open_memmap(os.path.join(features_dir, f"{name}.npy"), mode='w+', dtype=dtype, shape=shape)
+        
+        if self.feature_format == 'dense':
+            features = open_array('features', np.float64, (n_products, n_columns))
+        else:
+            # 3 colonnes numériques + un one-hot par groupe (prix, note, catégorie)
+            capacity = n_products * 6
+            index_dtype = np.int32 if capacity < np.iinfo(np.int32).max else np.int64
+            data = open_array('features_data', np.float32, (capacity,))
+            indices = open_array('features_indices', index_dtype, (capacity,))
+            indptr = open_array('features_indptr', index_dtype, (n_products + 1,))
+            indptr[0] = 0
+            nnz = 0
+        
+        start = 0
+        for chunk in chunks:
+            stop = start + len(chunk)
+            if stop > n_products:
+                raise ValueError("Le CSV a plus de lignes qu'au premier passage")
+            rows = self._assemble_rows(*self._encode_rows(chunk), constant)
+            if self.feature_format == 'dense':
+                features[start:stop] = rows
+            else:
+                data[nnz:nnz + rows.nnz] = rows.data
+                indices[nnz:nnz + rows.nnz] = rows.indices
+                indptr[start + 1:stop + 1] = nnz + rows.indptr[1:]
+                nnz += rows.nnz
+            start = stop
+        if start != n_products:
+            raise ValueError("Le CSV a moins de lignes qu'au premier passage")
+        
+        if self.feature_format == 'dense':
+            features.flush()
+            return pd.DataFrame(features, columns=self.feature_columns, index=index, copy=False)
+        for array in (data, indices, indptr):
+            array.flush()
+        return sparse.csr_matrix((data[:nnz], indices[:nnz], indptr), shape=(n_products, n_columns), copy=False)
+
+    def _release_features_dir(self):
+        """
+        Supprime le répertoire temporaire créé par fit_from_csv, dès que ses features sont remplacées
+        """
+        if self._features_finalizer is not None:
+            self._features_finalizer()
+            self._features_finalizer = None
+
+    def _feature_matrix(self):
+        """
+        Matrice de features au format attendu par l'index KNN (ndarray ou CSR)
+        """
+        if sparse.issparse(self.product_features):
+            return self.product_features
+        return np.asarray(self.product_features)
+
+    # Colonnes renvoyées pour chaque produit recommandé
+    _RECOMMENDATION_COLUMNS = ['title', 'categoryName', 'price', 'stars', 'reviews', 'imgUrl', 'productURL']
+
+    def get_similar_products(self, product_id, n=5, random_state=None):
         """
         Version raffinée avec recommandations plus pertinentes
+
+        random_state (int, RandomState ou Generator) rend le tirage reproductible.
+        Si le cache est activé (similar_cache_size), seuls les appels avec un
+        random_state entier sont servis depuis le cache, indexé par
+        (product_id, n, seed) ; sans seed, chaque appel refait un tirage.
         """
         try:
-            original = self.product_data.loc[product_id]
-            recommendations = []
-            
-            # Limites de ratio de prix
-            max_price_ratio = 3.0
-            min_price_ratio = 0.2
-            
-            similar_products = self.product_data[
-                (self.product_data.index != product_id) &
-                (~self.product_data['title'].str.lower().str.contains(
-                    original['title'].lower().split('|')[0].strip()
-                )) &
-                (self.product_data['price'] >= original['price'] * min_price_ratio) &
-                (self.product_data['price'] <= original['price'] * max_price_ratio)
-            ].copy()
-            
-            similar_products['category_similarity'] = similar_products['categoryName'].apply(
-                lambda x: self._calculate_category_similarity(x, original['categoryName'])
-            )
-            
-            similar_products['price_ratio'] = similar_products['price'] / original['price']
-            similar_products['price_score'] = 1 - np.abs(np.log(similar_products['price_ratio']))
-            similar_products['price_score'] = similar_products['price_score'].clip(0, 1)
-            
-            # Score initial garanti positif
-            similar_products['initial_score'] = (
-                similar_products['category_similarity'] * 0.4 +
-                similar_products['price_score'] * 0.3 +
-                (similar_products['stars'] / 5) * 0.3
-            ).clip(0, 1)  # S'assurer que le score est entre 0 et 1
-            
-            segments = [
-                ("Même catégorie, prix différent", 
-                lambda x: (x['category_similarity'] > 0.9) & 
-                        (0.5 < x['price_ratio']) & (x['price_ratio'] < 2.0), 1),
-                
-                ("Catégorie similaire", 
-                lambda x: (x['category_similarity'] > 0.6) & 
-                        (0.3 < x['price_ratio']) & (x['price_ratio'] < 2.5) &
-                        (x['stars'] >= 4.2), 2),
-                
-                ("Différent mais pertinent", 
-                lambda x: (x['category_similarity'] > 0.4) & 
-                        (0.2 < x['price_ratio']) & (x['price_ratio'] < 3.0) &
-                        (x['stars'] >= 4.2), 2)
+            if self.similar_cache.maxsize > 0 and isinstance(random_state, (int, np.integer)):
+                key = (product_id, n, int(random_state))
+                return self.similar_cache.get_or_compute(
+                    key, lambda: self._similar_products(product_id, n, random_state)
+                ).copy()
+            return self._similar_products(product_id, n, random_state)
+        except Exception as e:
+            print(f"Erreur dans get_similar_products: {str(e)}")
+            return pd.DataFrame()
+
+    def _similar_products(self, product_id, n, random_state):
+        original_pos = self.product_data.index.get_loc(product_id)
+        return self._similar_frame(*self._similar_positions(original_pos, n, random_state))
+
+    def _similar_frame(self, positions, scores):
+        """
+        DataFrame renvoyé par get_similar_products à partir des positions recommandées
+        """
+        if len(positions) == 0:
+            return pd.DataFrame()
+        
+        output = output_catalog(self.product_data.iloc[positions][self._recommendation_columns()])
+        output['final_score'] = scores
+        return output
+
+    def _recommendation_columns(self):
+        """
+        Colonnes de _RECOMMENDATION_COLUMNS présentes dans la table produits
+
+        La table peut ne contenir que les colonnes légères, les URL (imgUrl,
+        productURL) étant alors chargées à part pour les produits affichés.
+        """
+        return [column for column in self._RECOMMENDATION_COLUMNS if column in self.product_data.columns]
+
+    def cache_stats(self):
+        """
+        Statistiques des caches de résultats (taux de succès, évictions, octets, génération)
+        """
+        return {
+            'similar': self.similar_cache.stats(),
+            'personalized': self.personalized_cache.stats(),
+        }
+
+    def _invalidate_caches(self):
+        """
+        Nouvelle génération pour tous les caches de résultats (après fit ou mise à jour)
+        """
+        self.similar_cache.invalidate()
+        self.personalized_cache.invalidate()
+
+    def _similar_positions(self, original_pos, n=5, random_state=None, neighbors=None):
+        """
+        Cœur de get_similar_products : positions recommandées et scores finaux
+
+        neighbors : pool KNN déjà calculé pour cette source (mode candidate_pool='knn')
+        """
+        source = self._similar_source(original_pos)
+        candidates = None
+        if self.candidate_pool == 'knn':
+            # Règles métier appliquées au seul pool des plus proches voisins
+            if neighbors is None:
+                neighbors = self._knn_candidates([original_pos])[0]
+            candidates = neighbors[neighbors >= 0]
+            candidate_prices = self.prices[candidates]
+            category_similarity = self.category_similarity[:, source['category']]
+            candidates = candidates[
+                (candidate_prices >= source['price'] * MIN_PRICE_RATIO) &
+                (candidate_prices <= source['price'] * MAX_PRICE_RATIO) &
+                (category_similarity[self.category_codes[candidates]] > MIN_CATEGORY_SIMILARITY)
             ]
-            
-            for desc, condition, count in segments:
-                segment_products = similar_products[condition(similar_products)].copy()
-                
-                if not segment_products.empty:
-                    # S'assurer que les poids sont positifs
-                    weights = np.maximum(0, 
-                        segment_products['initial_score'] * 
-                        np.log1p(segment_products['reviews'])
-                    )
-                    
-                    # Normaliser les poids si non nuls
-                    if weights.sum() > 0:
-                        weights = weights / weights.sum()
-                        selected = segment_products.sample(
-                            n=min(count, len(segment_products)), 
-                            weights=weights,
-                            replace=False
-                        )
-                    else:
-                        # Si tous les poids sont nuls, sélectionner aléatoirement
-                        selected = segment_products.sample(
-                            n=min(count, len(segment_products)),
-                            replace=False
-                        )
-                    
-                    for _, product in selected.iterrows():
-                        recommendations.append(product)
-            
-            if not recommendations:
-                return pd.DataFrame()
-                
-            result = pd.DataFrame(recommendations)
-            
-            # Scores de diversité garantis positifs
-            result['price_div'] = np.clip(
-                abs(result['price'] - original['price']) / original['price'],
-                0, 1
+        
+        picks = self._segment_picks(source, _draw_seed(random_state), candidates)
+        return self._rank_segment_picks(source, picks, n)
+
+    def _similar_source(self, original_pos):
+        """
+        Ce que le tirage doit savoir du produit source (transmissible à un shard)
+        """
+        return {
+            'position': int(original_pos),
+            'price': float(self.prices[original_pos]),
+            'stars': float(self.stars[original_pos]),
+            'category': int(self.category_codes[original_pos]),
+            'family': int(self.family_codes[original_pos]),
+            'title_prefix': self._title_family_key(self.product_data['title'].iat[original_pos]),
+        }
+
+    def _segment_picks(self, source, seed, candidates=None, always_fallback=False):
+        """
+        Tirage de chaque segment parmi les candidats : [(positions, clés, positions_repli, clés_repli)]
+
+        Sans candidats fournis, la bande de prix est lue dans l'index trié,
+        catégorie par catégorie. Les positions renvoyées sont globales
+        (global_positions pour un shard) et triées par clé décroissante. Le
+        tirage de repli (poids ignorés) ne sert que si aucun candidat de poids
+        positif n'est retenu ; un shard le calcule toujours (always_fallback)
+        puisque ce choix dépend de tous les shards.
+        """
+        original_price = source['price']
+        category_similarity = self.category_similarity[:, source['category']]
+        if candidates is None:
+            candidates = self._price_band_positions(
+                original_price * MIN_PRICE_RATIO,
+                original_price * MAX_PRICE_RATIO,
+                np.flatnonzero(category_similarity > MIN_CATEGORY_SIMILARITY)
+            )
+        global_candidates = self._global_positions(candidates)
+        
+        # Même produit ou même famille (même début de titre) : simple comparaison de codes
+        keep = (global_candidates != source['position']) & (self.family_codes[candidates] != source['family'])
+        candidates, global_candidates = candidates[keep], global_candidates[keep]
+        
+        category_similarity = category_similarity[self.category_codes[candidates]]
+        price_ratio = self.prices[candidates] / original_price
+        stars = self.stars[candidates]
+        reviews = self.reviews[candidates]
+        
+        price_score = np.clip(1 - np.abs(np.log(price_ratio)), 0, 1)
+        
+        # Score initial garanti positif
+        initial_score = np.clip(
+            category_similarity * 0.4 +
+            price_score * 0.3 +
+            (stars / 5) * 0.3,
+            0, 1
+        )
+        # S'assurer que les poids sont positifs
+        weights = np.maximum(0, initial_score * np.log1p(reviews))
+        
+        # Titres contenant le début du titre original : vérifiés à la demande,
+        # uniquement pour les candidats effectivement tirés
+        title_prefix = source['title_prefix']
+        titles_lower = self._get_titles_lower()
+        title_checks = {}
+        
+        def is_allowed(member):
+            if member not in title_checks:
+                title_checks[member] = title_prefix not in titles_lower[candidates[member]]
+            return title_checks[member]
+        
+        empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        picks = []
+        for segment, (desc, min_similarity, min_ratio, max_ratio, min_stars, count) in enumerate(SIMILAR_SEGMENTS):
+            in_segment = (
+                (category_similarity > min_similarity) &
+                (min_ratio < price_ratio) & (price_ratio < max_ratio) &
+                (stars >= min_stars)
             )
-            result['rating_div'] = abs(result['stars'] - original['stars']) / 2
-            result['cat_div'] = 1 - result['category_similarity']
-            result['pop_div'] = (np.log1p(result['reviews']) / 
-                                np.log1p(result['reviews'].max())).clip(0, 1)
+            members = np.flatnonzero(in_segment)
             
-            # Score final garanti positif
-            result['final_score'] = (
-                0.35 * result['cat_div'] +
-                0.25 * result['price_div'] +
-                0.20 * result['rating_div'] +
-                0.20 * result['pop_div']
-            ).clip(0, 1)  # S'assurer que le score final est entre 0 et 1
+            # Tirage pondéré sans remise (Gumbel top-k) : les clés ne dépendent que du
+            # candidat, donc écarter un candidat exclu revient à prendre la clé suivante
+            gumbel = -np.log(-np.log(_hash_uniform(seed, source['position'], segment, global_candidates[members])))
+            positive = weights[members] > 0
+            keys = np.log(weights[members[positive]]) + gumbel[positive]
+            chosen = _top_k_allowed(keys, count, np.arange(len(keys)), lambda i: is_allowed(members[positive][i]))
+            weighted = global_candidates[members[positive][chosen]], keys[chosen]
             
-            return result.nlargest(min(n, len(result)), 'final_score')[
-                ['title', 'categoryName', 'price', 'stars', 'reviews', 'imgUrl', 'productURL', 'final_score']
-            ]
-        except Exception as e:
-            print(f"Erreur dans get_similar_products: {str(e)}")
-            return pd.DataFrame()
-    
+            fallback = empty
+            if always_fallback or len(chosen) == 0:
+                # Si tous les poids sont nuls, sélectionner aléatoirement
+                chosen = _top_k_allowed(gumbel, count, np.arange(len(members)), lambda i: is_allowed(members[i]))
+                fallback = global_candidates[members[chosen]], gumbel[chosen]
+            picks.append(weighted + fallback)
+        return picks
+
+    def _rank_segment_picks(self, source, picks, n):
+        """
+        Retient les tirages de chaque segment puis classe la sélection par score de diversité
+
+        picks : sortie de _segment_picks (ou concaténation des sorties de
+        plusieurs shards) ; les attributs des produits retenus sont lus par
+        position globale.
+        """
+        selected = []
+        for (desc, min_similarity, min_ratio, max_ratio, min_stars, count), segment_picks in zip(SIMILAR_SEGMENTS, picks):
+            positions, keys, fallback_positions, fallback_keys = segment_picks
+            if len(positions) == 0:
+                positions, keys = fallback_positions, fallback_keys
+            if len(positions):
+                selected.append(positions[np.argsort(-keys, kind='stable')[:count]])
+        
+        if not selected:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        selected = np.concatenate(selected).astype(np.int64)
+        
+        original_price = source['price']
+        category_similarity = self.category_similarity[self.category_codes[selected], source['category']]
+        stars = self.stars[selected]
+        
+        # Scores de diversité garantis positifs
+        selected_reviews = np.log1p(self.reviews[selected])
+        max_reviews = selected_reviews.max()
+        price_div = np.clip(np.abs(self.prices[selected] - original_price) / original_price, 0, 1)
+        rating_div = np.abs(stars - source['stars']) / 2
+        cat_div = 1 - category_similarity
+        pop_div = np.clip(selected_reviews / max_reviews, 0, 1) if max_reviews > 0 else np.zeros(len(selected))
+        
+        # Score final garanti positif
+        final_score = np.clip(
+            0.35 * cat_div +
+            0.25 * price_div +
+            0.20 * rating_div +
+            0.20 * pop_div,
+            0, 1
+        )
+        
+        order = np.argsort(-final_score, kind='stable')[:n]
+        return selected[order], final_score[order]
+
+    def _shard(self, positions):
+        """
+        Sous-modèle de service limité aux produits aux positions données (triées)
+
+        Ne garde que ce qu'il faut pour _segment_picks et _category_top :
+        tableaux par produit, titres et index (catégorie, prix) reconstruit sur
+        le sous-ensemble. Les codes de catégorie et de famille restent ceux du
+        catalogue complet ; global_positions relie chaque ligne du shard à sa
+        position globale.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        shard = copy.copy(self)
+        for name in self._SNAPSHOT_ARRAYS:
+            setattr(shard, name, None)
+        shard.product_features = None
+        shard._feature_buffer = None
+        shard._features_finalizer = None
+        shard.knn_model = None
+        shard._family_index = None
+        shard.candidate_pool = 'scan'
+        shard.personalized_cache = LRUCache(0)
+        shard.similar_cache = LRUCache(0)
+        
+        shard.product_data = self.product_data.iloc[positions][['title', 'categoryName']]
+        shard.titles_lower = self._get_titles_lower()[positions]
+        shard.category_similarity = np.asarray(self.category_similarity)
+        shard.category_codes = np.asarray(self.category_codes[positions])
+        shard.family_codes = np.asarray(self.family_codes[positions])
+        shard.prices = np.asarray(self.prices[positions])
+        shard.stars = np.asarray(self.stars[positions])
+        shard.reviews = np.asarray(self.reviews[positions])
+        shard.global_positions = positions
+        shard._build_price_index()
+        return shard
+
+    def _global_positions(self, positions):
+        """
+        Positions dans le catalogue complet (un shard ne contient qu'une partie des lignes)
+        """
+        if self.global_positions is None:
+            return np.asarray(positions, dtype=np.int64)
+        return self.global_positions[positions]
+
+    def get_similar_products_batch(self, product_ids, n=5, random_state=None, n_jobs=1, block_size=1000):
+        """
+        Recommandations pour des milliers de produits en un seul appel
+
+        Les sources sont traitées par blocs qui partagent les tableaux
+        précalculés (optionnellement répartis sur n_jobs processus). Avec le
+        même random_state (entier), chaque source donne exactement le résultat
+        de get_similar_products(product_id, n, random_state).
+
+        Retourne un DataFrame long indexé par (source_id, rank).
+        """
+        product_ids = pd.Index(product_ids)
+        source_positions = self.product_data.index.get_indexer(product_ids)
+        known = source_positions >= 0
+        if not known.all():
+            print(f"get_similar_products_batch: {int((~known).sum())} produits inconnus ignorés")
+        source_ids = product_ids[known]
+        source_positions = source_positions[known]
+
+        blocks = [
+            source_positions[start:start + block_size]
+            for start in range(0, len(source_positions), block_size)
+        ]
+        if n_jobs == 1 or len(blocks) <= 1:
+            results = [self._similar_block(block, n, random_state) for block in blocks]
+        else:
+            if n_jobs is None or n_jobs < 0:
+                n_jobs = os.cpu_count()
+            # fork partage les tableaux du modèle avec les workers sans les copier
+            context = mp.get_context('fork') if 'fork' in mp.get_all_start_methods() else None
+            with ProcessPoolExecutor(
+                max_workers=min(n_jobs, len(blocks)),
+                mp_context=context,
+                initializer=_init_batch_worker,
+                initargs=(self,)
+            ) as executor:
+                results = list(executor.map(
+                    _similar_block_worker, blocks, [n] * len(blocks), [random_state] * len(blocks)
+                ))
+
+        return self._batch_frame(source_ids, results)
+
+    def _batch_frame(self, source_ids, results):
+        """
+        Assemblage unique, à partir des positions entières, du DataFrame long de get_similar_products_batch
+
+        results : blocs (nombre de résultats par source, positions, scores) dans l'ordre des sources
+        """
+        columns = ['source_id', 'rank', 'product_id'] + self._recommendation_columns() + ['final_score']
+        if not results:
+            return pd.DataFrame(columns=columns).set_index(['source_id', 'rank'])
+        counts = np.concatenate([block_counts for block_counts, _, _ in results])
+        positions = np.concatenate([block_positions for _, block_positions, _ in results])
+        scores = np.concatenate([block_scores for _, _, block_scores in results])
+        starts = np.cumsum(counts) - counts
+        ranks = np.arange(len(positions)) - np.repeat(starts, counts) + 1
+
+        output = output_catalog(self.product_data.iloc[positions][self._recommendation_columns()].reset_index(drop=True))
+        output.insert(0, 'source_id', np.repeat(source_ids.to_numpy(), counts))
+        output.insert(1, 'rank', ranks)
+        output.insert(2, 'product_id', self.product_data.index[positions])
+        output['final_score'] = scores
+        return output.set_index(['source_id', 'rank'])
+
+    def _similar_block(self, source_positions, n=5, random_state=None):
+        """
+        Traite un bloc de sources : (nombre de résultats par source, positions, scores)
+        """
+        counts = np.zeros(len(source_positions), dtype=np.int64)
+        positions, scores = [], []
+        # En mode KNN, un seul appel kneighbors pour tout le bloc
+        neighbors = self._knn_candidates(source_positions) if self.candidate_pool == 'knn' else None
+        for i, original_pos in enumerate(source_positions):
+            try:
+                block_positions, block_scores = self._similar_positions(
+                    original_pos, n, random_state,
+                    neighbors=neighbors[i] if neighbors is not None else None
+                )
+            except Exception as e:
+                print(f"Erreur dans get_similar_products_batch: {str(e)}")
+                continue
+            counts[i] = len(block_positions)
+            positions.append(block_positions)
+            scores.append(block_scores)
+        if not positions:
+            return counts, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        return counts, np.concatenate(positions), np.concatenate(scores)
+
     def get_category_recommendations(self, category, n=5):
         """
         Recommande les meilleurs produits d'une catégorie
+
+        Simple tranche du classement précalculé de la catégorie (voir _build_leaderboards).
         """
-        category_products = self.product_data[
-            self.product_data['categoryName'] == category
-        ].copy()
+        code = self._category_index.get(category)
+        if code is None:
+            return pd.DataFrame()
         
-        if len(category_products) == 0:
+        start = self.leaderboard_offsets[code]
+        stop = min(start + n, self.leaderboard_offsets[code + 1])
+        if stop <= start:
             return pd.DataFrame()
         
-        category_products['value_score'] = (
-            category_products['stars'] / 5 * 0.4 +
-            (1 - category_products['price'] / category_products['price'].max()) * 0.3 +
-            (np.log1p(category_products['reviews']) / 
-             np.log1p(category_products['reviews'].max())) * 0.3
-        )
+        recommendations = output_catalog(self.product_data.iloc[self.leaderboard_order[start:stop]][[
+            'title', 'categoryName', 'price', 'stars'
+        ]])
+        recommendations['value_score'] = self.leaderboard_scores[start:stop]
+        return recommendations
+
+    def _category_top(self, code, n, max_price, max_reviews):
+        """
+        Les n meilleurs produits d'une catégorie (positions globales, value_score) avec des maxima imposés
+
+        Utilisé par un shard qui ne détient qu'une partie de la catégorie : les
+        maxima sont ceux de la catégorie entière, si bien que la fusion des
+        résultats des shards redonne le classement exact.
+        """
+        begin, end = self.category_price_offsets[code], self.category_price_offsets[code + 1]
+        members = np.asarray(self.category_price_order[begin:end], dtype=np.int64)
+        scores = self._value_scores(members, max_price, max_reviews)
+        return _nlargest_positions(scores, self._global_positions(members), n)
+
+    def _value_scores(self, positions, max_price, max_reviews):
+        """
+        value_score des produits aux positions données (maxima de leur catégorie)
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (
+                self.stars[positions] / 5 * 0.4 +
+                (1 - self.prices[positions] / max_price) * 0.3 +
+                (np.log1p(self.reviews[positions]) / 
+                 np.log1p(max_reviews)) * 0.3
+            )
+
+    def _build_leaderboards(self):
+        """
+        Classement de chaque catégorie par value_score décroissant, en disposition compacte
+
+        leaderboard_order contient les positions catégorie par catégorie,
+        leaderboard_scores les scores alignés et leaderboard_offsets le début
+        de chaque catégorie. Les égalités gardent l'ordre du catalogue, comme
+        nlargest.
+        """
+        n_categories = len(self.categories)
+        order = self.category_price_order
+        max_price, max_reviews = self._category_maxima()
         
-        return category_products.nlargest(n, 'value_score')[[
-            'title', 'categoryName', 'price', 'stars', 'value_score'
-        ]]
+        codes = self.category_codes[order]
+        scores = self._value_scores(order, max_price[codes], max_reviews[codes])
+        
+        # lexsort place les scores indéfinis (NaN) en fin de catégorie, comme nlargest
+        ranking = np.lexsort((order, -scores, codes))
+        
+        self.leaderboard_order = order[ranking].astype(np.int32)
+        self.leaderboard_scores = scores[ranking]
+        self.leaderboard_offsets = np.searchsorted(codes[ranking], np.arange(n_categories + 1)).astype(np.int64)
+
+    def _category_maxima(self, codes=None):
+        """
+        Prix et nombre d'avis maximaux de chaque catégorie (NaN pour une catégorie vide)
+
+        Lus dans l'index (catégorie, prix) déjà trié ; codes limite le calcul
+        à quelques catégories (tableaux alignés sur codes).
+        """
+        if codes is not None:
+            codes = np.asarray(codes, dtype=np.int64)
+            max_price = np.full(len(codes), np.nan)
+            max_reviews = np.full(len(codes), np.nan)
+            for i, code in enumerate(codes):
+                begin, end = self.category_price_offsets[code], self.category_price_offsets[code + 1]
+                if end > begin:
+                    max_price[i] = self.category_sorted_prices[end - 1]
+                    max_reviews[i] = self.category_sorted_reviews[begin:end].max()
+            return max_price, max_reviews
+
+        n_categories = len(self.categories)
+        starts = self.category_price_offsets[:-1]
+        non_empty = self.category_price_offsets[1:] > starts
+        max_price = np.full(n_categories, np.nan)
+        max_reviews = np.full(n_categories, np.nan)
+        max_price[non_empty] = self.category_sorted_prices[self.category_price_offsets[1:][non_empty] - 1]
+        max_reviews[non_empty] = np.maximum.reduceat(self.reviews[self.category_price_order], starts[non_empty])
+        return max_price, max_reviews
+
+    def refresh_category_leaderboard(self, category):
+        """
+        Recalcule le classement d'une seule catégorie après modification de ses produits
+        """
+        self._rescore_leaderboards([self._category_index[category]])
+
+    def _rescore_leaderboards(self, codes):
+        """
+        Reclasse entièrement les catégories codes, en place dans leur tranche
+
+        Les tranches doivent déjà avoir la taille de la catégorie dans l'index
+        (catégorie, prix) ; les classements mappés depuis un snapshot (lecture
+        seule) sont copiés une fois avant modification.
+        """
+        if len(codes) and not (self.leaderboard_order.flags.writeable and self.leaderboard_scores.flags.writeable):
+            self.leaderboard_order = np.array(self.leaderboard_order)
+            self.leaderboard_scores = np.array(self.leaderboard_scores)
+        for code in codes:
+            begin, end = self.category_price_offsets[code], self.category_price_offsets[code + 1]
+            start, stop = self.leaderboard_offsets[code], self.leaderboard_offsets[code + 1]
+            if end == begin:
+                continue
+            members = np.asarray(self.category_price_order[begin:end], dtype=np.int64)
+            scores = self._value_scores(members, self.prices[members].max(), self.reviews[members].max())
+            ranking = np.lexsort((members, -scores))
+            self.leaderboard_order[start:stop] = members[ranking]
+            self.leaderboard_scores[start:stop] = scores[ranking]
+
+    def _patch_leaderboards(self, row_map, dirty, affected_codes, old_maxima):
+        """
+        Corrige les classements après une modification de lignes sans reclasser les catégories intactes
+
+        Le value_score d'un produit ne dépend que de ses valeurs et des maxima
+        de sa catégorie (old_maxima : ceux d'avant la modification, alignés sur
+        affected_codes). Les lignes supprimées ou modifiées quittent leur
+        tranche et les lignes modifiées ou ajoutées sont insérées à leur rang
+        (patch_sorted_order, clés (catégorie, -score, position)) ; seules les
+        catégories dont un maximum a bougé sont reclassées entièrement.
+        """
+        n_categories = len(self.categories)
+        affected_codes = np.asarray(affected_codes, dtype=np.int64)
+        max_price, max_reviews = np.full(n_categories, np.nan), np.full(n_categories, np.nan)
+        max_price[affected_codes], max_reviews[affected_codes] = self._category_maxima(affected_codes)
+        
+        def moved(new, old):
+            return (new != old) & ~(np.isnan(new) & np.isnan(old))
+        
+        old_price, old_reviews = old_maxima
+        rescored = affected_codes[
+            moved(max_price[affected_codes], old_price) | moved(max_reviews[affected_codes], old_reviews)
+        ]
+        
+        dirty_codes = self.category_codes[dirty]
+        dirty_scores = self._value_scores(dirty, max_price[dirty_codes], max_reviews[dirty_codes])
+        entry_codes = np.repeat(np.arange(n_categories), np.diff(self.leaderboard_offsets))
+        self.leaderboard_order, (entry_codes, negated_scores) = patch_sorted_order(
+            self.leaderboard_order, [entry_codes, -np.asarray(self.leaderboard_scores)],
+            row_map, dirty, [dirty_codes, -dirty_scores], len(self.category_codes)
+        )
+        self.leaderboard_scores = -negated_scores
+        self.leaderboard_offsets = np.searchsorted(entry_codes, np.arange(n_categories + 1)).astype(np.int64)
+        self._rescore_leaderboards(rescored)
     
     def get_personalized_recommendations(self, user_prefs, n=5):
         """
         Recommandations personnalisées basées sur les préférences utilisateur
+
+        Les réponses sont gardées dans un cache LRU indexé par les préférences
+        normalisées (voir cache_stats()), invalidé à chaque fit ou mise à jour.
         """
-        mask = (
-            self.product_data['categoryName'].isin(user_prefs['categories']) &
-            (self.product_data['price'] >= user_prefs['min_price']) &
-            (self.product_data['price'] <= user_prefs['max_price']) &
-            (self.product_data['stars'] >= user_prefs['min_rating'])
+        key = self._preference_key(user_prefs, n)
+        recommendations = self.personalized_cache.get(key)
+        if recommendations is None:
+            recommendations = self._personalized_recommendations(*key)
+            self.personalized_cache.put(key, recommendations)
+        return recommendations.copy()
+
+    @staticmethod
+    def _preference_key(user_prefs, n):
+        """
+        Clé de cache : l'ordre et les doublons des catégories ne changent pas le résultat
+        """
+        return (
+            tuple(sorted(set(user_prefs['categories']))),
+            float(user_prefs['min_price']),
+            float(user_prefs['max_price']),
+            float(user_prefs['min_rating']),
+            n,
         )
+
+    def _personalized_recommendations(self, categories, min_price, max_price, min_rating, n):
+        """
+        Union des bandes de prix des catégories demandées, filtrée par note, puis top-n
+
+        Les tranches de l'index (catégorie, prix) donnent directement prix,
+        notes et avis des candidats, sans masque sur tout le catalogue.
+        """
+        codes = [self._category_index[c] for c in categories if c in self._category_index]
+        bounds = self._category_band_bounds(min_price, max_price, codes)
+        if not bounds:
+            return pd.DataFrame()
         
-        candidates = self.product_data[mask].copy()
-        if len(candidates) == 0:
+        take = np.concatenate([np.arange(start, stop) for start, stop in bounds])
+        keep = take[self.category_sorted_stars[take] >= min_rating]
+        if len(keep) == 0:
             return pd.DataFrame()
         
-        candidates['pref_score'] = (
-            candidates['stars'] / 5 * 0.4 +
-            (1 - candidates['price'] / candidates['price'].max()) * 0.3 +
-            (np.log1p(candidates['reviews']) / 
-             np.log1p(candidates['reviews'].max())) * 0.3
-        )
+        positions = np.asarray(self.category_price_order[keep], dtype=np.int64)
+        prices = self.category_sorted_prices[keep]
+        stars = self.category_sorted_stars[keep]
+        reviews = self.category_sorted_reviews[keep]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = (
+                stars / 5 * 0.4 +
+                (1 - prices / prices.max()) * 0.3 +
+                (np.log1p(reviews) / 
+                 np.log1p(reviews.max())) * 0.3
+            )
         
-        return candidates.nlargest(n, 'pref_score')[[
-            'title', 'categoryName', 'price', 'stars', 'pref_score'
-        ]]
+        positions, scores = _nlargest_positions(scores, positions, n)
+        recommendations = output_catalog(self.product_data.iloc[positions][[
+            'title', 'categoryName', 'price', 'stars'
+        ]])
+        recommendations['pref_score'] = scores
+        return recommendations
     
-    def fit(self, df, verbose=True):
+    def fit(self, df, verbose=True, price_sketch=None):
         """
         Entraîne le système de recommandation
+
+        price_sketch : KLLSketch des prix pour les quintiles (voir create_product_features)
+        Le catalogue est d'abord ramené aux types compacts (voir compact_catalog).
         """
         if verbose:
             print("Creating features...")
             
+        df = compact_catalog(df)
         self.product_data = df
-        self.create_product_features(df)
+        self.titles_lower = None
+        self._family_index = None
+        self.neighbor_ids = None
+        self.neighbor_scores = None
+        self._invalidate_caches()
+        self._encode_categories(df)
+        self._build_indexes()
+        self.create_product_features(df, price_sketch)
         
         if verbose:
             print("Training the KNN model...")
             
-        self.knn_model = NearestNeighbors(
-            n_neighbors=50,
-            metric='cosine',
-            algorithm='brute',
-            n_jobs=-1
+        self._fit_knn()
+        
+        if verbose:
+            print("Training completed!")
+            
+        return self
+
+    # Colonnes relues par le second passage de fit_from_csv : celles dont dépendent les features
+    _FEATURE_SOURCE_COLUMNS = ['price', 'stars', 'reviews', 'categoryName']
+    # Table produits gardée par défaut par fit_from_csv (sans les URL, lues à part par l'app)
+    _LIGHT_COLUMNS = ['title', 'categoryName', 'price', 'stars', 'reviews']
+
+    def fit_from_csv(self, path, chunksize=200_000, features_dir=None, usecols=None, verbose=True, **read_csv_options):
+        """
+        Entraîne le modèle en deux passages par morceaux sur un CSV, sans jamais charger le catalogue complet
+
+        Premier passage : chaque morceau de chunksize lignes met à jour les
+        statistiques globales (effectif, minima et maxima de price, stars et
+        reviews, effectifs des catégories et des tranches de notes, KLLSketch
+        des prix de taille price_sketch_k, 200 par défaut, pour les bornes des
+        quintiles), puis seules ses colonnes usecols (plus le titre et les
+        colonnes des features) sont gardées, en types compacts, pour la table
+        produits. Par défaut ce sont les colonnes légères (titre, catégorie,
+        prix, note, avis) : les URL ne sont gardées que si usecols les demande
+        (l'app les lit à part, voir CatalogStore).
+        Second passage : les colonnes des features sont relues morceau par
+        morceau et les features écrites dans des .npy mappés sous
+        features_dir, que product_features lit directement. Sans
+        features_dir, le modèle crée un répertoire temporaire qui lui
+        appartient : il est supprimé dès que ces features sont remplacées
+        (fit, fit_from_csv, reconstruction par partial_fit) ou quand le modèle
+        est libéré.
+
+        En mémoire : la table produits compacte (deux fois le temps de
+        concaténer ses morceaux) et un morceau du CSV, jamais le CSV complet
+        ni la matrice de features. Le modèle obtenu est celui de fit() sur
+        cette table avec le même sketch des prix (price_sketch) : mêmes
+        paramètres, mêmes features, donc mêmes recommandations.
+        """
+        usecols = list(usecols) if usecols is not None else list(self._LIGHT_COLUMNS)
+        columns = list(dict.fromkeys(usecols + ['title'] + self._FEATURE_SOURCE_COLUMNS))
+        numeric_columns = ['price', 'stars', 'reviews']
+        if verbose:
+            print("Reading catalog...")
+        price_sketch = KLLSketch(self.price_sketch_k, seed=0) if self.price_sketch_k is not None else KLLSketch(seed=0)
+        pieces, lows, highs = [], [], []
+        category_counts = pd.Series(dtype=np.int64)
+        rating_counts = np.zeros(len(RATING_LABELS), dtype=np.int64)
+        for chunk in pd.read_csv(path, usecols=columns, chunksize=chunksize, **read_csv_options):
+            chunk = compact_catalog(chunk)
+            lows.append(chunk[numeric_columns].min())
+            highs.append(chunk[numeric_columns].max())
+            category_counts = category_counts.add(chunk['categoryName'].value_counts(sort=False), fill_value=0)
+            rating_codes = pd.cut(chunk['stars'], bins=RATING_BINS, labels=False).dropna().astype(int)
+            rating_counts += np.bincount(rating_codes, minlength=len(RATING_LABELS))
+            price_sketch.update(chunk['price'])
+            pieces.append(chunk[columns])
+        if not pieces:
+            raise ValueError(f"Aucun produit dans {path}")
+        
+        # Un dictionnaire de catégories commun à tous les morceaux, puis la table compacte
+        categories = category_dtype(*(piece['categoryName'] for piece in pieces))
+        for i, piece in enumerate(pieces):
+            pieces[i] = piece.astype({'categoryName': categories})
+        df = compact_catalog(pd.concat(pieces), categories=categories)
+        del pieces
+        dtypes = df[numeric_columns].dtypes.to_dict()
+        stats = {
+            'n_products': len(df),
+            'extremes': pd.DataFrame({
+                column: [np.nanmin([low[column] for low in lows]), np.nanmax([high[column] for high in highs])]
+                for column in numeric_columns
+            }).astype(dtypes),
+            'category_counts': category_counts.reindex(categories.categories, fill_value=0).astype(np.int64),
+            'rating_counts': rating_counts,
+        }
+        
+        if verbose:
+            print("Creating features...")
+        self.product_data = df
+        self.titles_lower = None
+        self._family_index = None
+        self.neighbor_ids = None
+        self.neighbor_scores = None
+        self._invalidate_caches()
+        self._encode_categories(df)
+        self._build_indexes()
+        
+        constant = self._fit_feature_layout(stats, price_sketch)
+        self._feature_buffer = None
+        self._release_features_dir()
+        if features_dir is None:
+            features_dir = tempfile.mkdtemp(prefix='amazon_features_')
+            self._features_finalizer = weakref.finalize(self, _remove_features_dir, features_dir, os.getpid())
+        chunks = (
+            compact_catalog(chunk, categories=categories).astype(dtypes)
+            for chunk in pd.read_csv(path, usecols=self._FEATURE_SOURCE_COLUMNS, chunksize=chunksize, **read_csv_options)
         )
-        self.knn_model.fit(self.product_features)
+        self.product_features = self._write_features(chunks, constant, features_dir)
+        
+        if verbose:
+            print("Training the KNN model...")
+            
+        self._fit_knn()
         
         if verbose:
             print("Training completed!")
             
-        return self
\ No newline at end of file
+        return self
+
+    def partial_fit(self, df=None, removed_ids=None, verbose=True):
+        """
+        Met à jour le modèle entraîné avec un lot de modifications du catalogue
+
+        df : produits ajoutés ou modifiés (mêmes colonnes que pour fit, indexés
+        par identifiant produit) ; removed_ids : identifiants à retirer. Les
+        suppressions sont appliquées en premier.
+
+        Les lignes modifiées sont transformées avec les paramètres appris
+        (maxima, quantiles de prix, catégories principales, scaler) et les
+        index triés et classements sont corrigés par fusion, sans retri ; les
+        lignes de features sont écrites en place quand aucune ligne n'est
+        supprimée (voir _write_feature_rows). Les features ne sont refaites que
+        si la dérive de ces paramètres dépasse drift_tolerance (ou si une
+        catégorie inconnue apparaît). Le résumé est dans last_update.
+        """
+        summary = {'inserted': 0, 'updated': 0, 'removed': 0, 'rebuilt': False, 'drift': {}}
+        if removed_ids is not None:
+            self._remove_rows(removed_ids, summary)
+        if df is not None and len(df):
+            self._upsert_rows(df, summary)
+        self._invalidate_caches()
+        self.last_update = summary
+        
+        if verbose:
+            print(
+                f"Catalog update: {summary['inserted']} inserted, {summary['updated']} updated, "
+                f"{summary['removed']} removed" + (" (full rebuild)" if summary['rebuilt'] else "")
+            )
+        return self
+
+    def upsert_products(self, df, verbose=True):
+        """
+        Ajoute ou remplace des produits (voir partial_fit)
+        """
+        return self.partial_fit(df, verbose=verbose)
+
+    def remove_products(self, product_ids, verbose=True):
+        """
+        Retire des produits du modèle (voir partial_fit)
+        """
+        return self.partial_fit(removed_ids=product_ids, verbose=verbose)
+
+    def _remove_rows(self, product_ids, summary):
+        positions = self.product_data.index.get_indexer(pd.Index(product_ids))
+        positions = np.unique(positions[positions >= 0])
+        if len(positions) == 0:
+            return
+        
+        keep = np.ones(len(self.product_data), dtype=bool)
+        keep[positions] = False
+        row_map = np.where(keep, np.cumsum(keep) - 1, -1)
+        affected = np.unique(self.category_codes[positions])
+        self._apply_update(self.product_data[keep], row_map, np.empty(0, dtype=np.int64), affected, summary)
+        summary['removed'] += len(positions)
+
+    def _upsert_rows(self, df, summary):
+        df = df[~df.index.duplicated(keep='last')]
+        existing = self.product_data.index.get_indexer(df.index)
+        replaced = existing >= 0
+        
+        data = self.product_data
+        if isinstance(data['categoryName'].dtype, pd.CategoricalDtype):
+            # Dictionnaire commun : remplacements et concaténation restent en types compacts
+            categories = category_dtype(data['categoryName'], df['categoryName'])
+            data = compact_catalog(data, categories)
+            df = compact_catalog(df, categories)
+        if replaced.any():
+            data = data.copy()
+            columns = [col for col in data.columns if col in df.columns]
+            data.loc[df.index[replaced], columns] = df.loc[replaced, columns]
+        if not replaced.all():
+            data = pd.concat([data, df.loc[~replaced].reindex(columns=data.columns)])
+        summary['updated'] += int(replaced.sum())
+        summary['inserted'] += int((~replaced).sum())
+        
+        # Une nouvelle catégorie change le dictionnaire de codes : reconstruction complète
+        unknown = sorted(set(df['categoryName']) - set(self._category_index))
+        if unknown:
+            summary['drift']['new_categories'] = unknown
+            summary['rebuilt'] = True
+            self.fit(data, verbose=False)
+            return
+        
+        n_old = len(self.product_data)
+        dirty = np.concatenate([existing[replaced], np.arange(n_old, len(data))]).astype(np.int64)
+        affected = np.unique(np.concatenate([
+            self.category_codes[existing[replaced]],
+            [self._category_index[name] for name in df['categoryName']]
+        ])).astype(np.int64)
+        self._apply_update(data, None, dirty, affected, summary)
+
+    def _apply_update(self, data, row_map, dirty, affected_codes, summary):
+        """
+        Applique une modification de lignes à tous les tableaux et index dérivés
+
+        row_map : ancienne position -> nouvelle (-1 si supprimée), None si aucune
+        ligne n'a bougé ; dirty : nouvelles positions modifiées ou ajoutées.
+        """
+        n_rows = len(data)
+        family_index = self._get_family_index()
+        # Clés triées des index, lues avec les anciens codes avant modification
+        family_sorted_codes = self.family_codes[self.family_order]
+        category_sorted_codes = self.category_codes[self.category_price_order]
+        old_maxima = self._category_maxima(affected_codes)
+        
+        def patched(old, values):
+            new = np.empty(n_rows, dtype=old.dtype)
+            if row_map is None:
+                new[:len(old)] = old
+            else:
+                kept = row_map >= 0
+                new[row_map[kept]] = old[kept]
+            new[dirty] = values
+            return new
+        
+        self.product_data = data
+        rows = data.iloc[dirty]
+        titles = rows['title'].astype(str).str.lower()
+        self.prices = patched(self.prices, float64_values(rows['price']))
+        self.stars = patched(self.stars, float64_values(rows['stars']))
+        self.reviews = patched(self.reviews, rows['reviews'].to_numpy(dtype=np.float64))
+        self.category_codes = patched(self.category_codes, [self._category_index[name] for name in rows['categoryName']])
+        if self.titles_lower is not None:
+            self.titles_lower = patched(self.titles_lower, titles.to_numpy())
+        
+        # Familles : les nouvelles clés reçoivent les codes suivants
+        n_families = len(self.family_offsets) - 1
+        new_family_codes = []
+        for key in titles.str.split('|', n=1).str[0].str.strip():
+            if key not in family_index:
+                family_index[key] = n_families
+                n_families += 1
+            new_family_codes.append(family_index[key])
+        self.family_codes = patched(self.family_codes, new_family_codes)
+        self.family_order, (family_sorted_codes,) = patch_sorted_order(
+            self.family_order, [family_sorted_codes], row_map, dirty, [self.family_codes[dirty]], n_rows
+        )
+        self.family_offsets = np.searchsorted(family_sorted_codes, np.arange(n_families + 1)).astype(np.int64)
+        
+        # Index de prix global et (catégorie, prix)
+        self.price_order, (self.sorted_prices,) = patch_sorted_order(
+            self.price_order, [self.sorted_prices], row_map, dirty, [self.prices[dirty]], n_rows
+        )
+        self.category_price_order, (category_sorted_codes, self.category_sorted_prices) = patch_sorted_order(
+            self.category_price_order, [category_sorted_codes, self.category_sorted_prices],
+            row_map, dirty, [self.category_codes[dirty], self.prices[dirty]], n_rows
+        )
+        self.category_sorted_stars = self.stars[self.category_price_order]
+        self.category_sorted_reviews = self.reviews[self.category_price_order]
+        self.category_price_offsets = np.searchsorted(
+            category_sorted_codes, np.arange(len(self.categories) + 1)
+        ).astype(np.int64)
+        
+        self._patch_leaderboards(row_map, dirty, affected_codes, old_maxima)
+        self._patch_features(row_map, dirty, summary)
+
+    def _get_family_index(self):
+        """
+        Dictionnaire clé de famille -> code
+
+        Construit au fit ; après un load (le snapshot ne garde que les codes),
+        reconstruit à la première mise à jour depuis un représentant par famille.
+        """
+        if self._family_index is None:
+            sizes = np.diff(self.family_offsets)
+            codes = np.flatnonzero(sizes > 0)
+            representatives = self.family_order[self.family_offsets[codes]]
+            keys = (self.product_data['title'].iloc[representatives].astype(str).str.lower()
+                    .str.split('|', n=1).str[0].str.strip())
+            self._family_index = dict(zip(keys, codes.tolist()))
+        return self._family_index
+
+    def _encode_rows(self, rows):
+        """
+        Features brutes de quelques lignes avec les paramètres appris au fit
+
+        Retourne le bloc numérique (m, 3) avant MinMaxScaler et, pour chaque
+        ligne, la colonne one-hot de chaque groupe (prix, note, catégorie ; -1 si aucune).
+        """
+        numeric = np.column_stack(list(self._numeric_features(rows).values())).astype(np.float64)
+        
+        column_index = {str(col): i for i, col in enumerate(self.feature_columns)}
+        price_columns = np.array([column_index.get(f"price_{label}", -1) for label in PRICE_LABELS] + [-1])
+        rating_columns = np.array([column_index.get(f"rating_{label}", -1) for label in RATING_LABELS] + [-1])
+        price_codes = pd.cut(rows['price'], bins=self.price_bins, labels=False, include_lowest=True)
+        rating_codes = pd.cut(rows['stars'], bins=RATING_BINS, labels=False)
+        main_categories = _main_categories(rows['categoryName'], self.top_categories)
+        
+        onehot = np.column_stack([
+            price_columns[np.nan_to_num(price_codes, nan=-1).astype(int)],
+            rating_columns[np.nan_to_num(rating_codes, nan=-1).astype(int)],
+            [column_index.get(f"category_{name}", -1) for name in main_categories],
+        ]).astype(np.int64)
+        return numeric, onehot
+
+    def _constant_feature_columns(self):
+        """
+        Colonnes constantes au fit (mises à 0 par la normalisation)
+        """
+        if sparse.issparse(self.product_features):
+            return np.bincount(self.product_features.indices, minlength=len(self.feature_columns)) == 0
+        return self.scaler.data_range_ == 0
+
+    def _assemble_rows(self, numeric, onehot, constant):
+        """
+        Lignes de features normalisées, au format de product_features
+        """
+        n_numeric = numeric.shape[1]
+        if self.feature_format == 'sparse':
+            scaled = numeric * self.scaler.scale_ + self.scaler.min_
+            present = onehot >= 0
+            indices = np.hstack([np.broadcast_to(np.arange(n_numeric), numeric.shape), np.where(present, onehot, 0)])
+            data = np.hstack([scaled, present & ~constant[np.where(present, onehot, 0)]]).astype(np.float32)
+            rows = sparse.csr_matrix(
+                (data.ravel(), indices.ravel(), np.arange(0, data.size + 1, data.shape[1])),
+                shape=(len(numeric), len(self.feature_columns))
+            )
+            rows.eliminate_zeros()
+            return rows
+        
+        raw = np.zeros((len(numeric), len(self.feature_columns)))
+        raw[:, :n_numeric] = numeric
+        rows, groups = np.nonzero(onehot >= 0)
+        raw[rows, onehot[rows, groups]] = 1
+        return raw * self.scaler.scale_ + self.scaler.min_
+
+    def _feature_drift(self, onehot, constant):
+        """
+        Écart entre les paramètres appris au fit et ceux qu'aurait le catalogue actuel
+
+        price_bins_shift : part du catalogue située entre l'ancienne et la nouvelle
+            position d'une borne intérieure de quintile (produits qui changeraient de tranche)
+        numeric_range_shift : déplacement des extrêmes des features numériques,
+            relatif à leur plage au fit (erreur de normalisation des lignes existantes)
+        """
+        # Quantiles lus dans l'index de prix trié, comme np.quantile (interpolation linéaire)
+        sorted_prices = self.sorted_prices
+        ranks = np.linspace(0, 1, len(PRICE_LABELS) + 1)[1:-1] * (len(sorted_prices) - 1)
+        below, fraction = np.floor(ranks).astype(np.int64), ranks % 1
+        above = np.minimum(below + 1, len(sorted_prices) - 1)
+        edges = sorted_prices[below] + fraction * (sorted_prices[above] - sorted_prices[below])
+        moved = np.abs(
+            np.searchsorted(sorted_prices, edges) - np.searchsorted(sorted_prices, self.price_bins[1:-1])
+        )
+        price_bins_shift = moved.max() / len(sorted_prices)
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            current = np.array([
+                [np.log1p(self.prices.min()), np.log1p(self.prices.max())] / np.log1p(self.price_max),
+                [self.stars.min() / 5, self.stars.max() / 5],
+                [np.log1p(self.reviews.min()), np.log1p(self.reviews.max())] / np.log1p(self.reviews_max),
+            ])
+        low, high = self.scaler.data_min_[:3], self.scaler.data_max_[:3]
+        span = np.where(high > low, high - low, 1.0)
+        numeric_range_shift = np.nanmax(np.maximum(np.abs(current[:, 0] - low), np.abs(current[:, 1] - high)) / span)
+        
+        # Une catégorie hors des 50 principales qui dépasse la plus petite d'entre elles
+        counts = np.bincount(self.category_codes, minlength=len(self.categories))
+        is_top = np.zeros(len(self.categories), dtype=bool)
+        is_top[[self._category_index[c] for c in self.top_categories if c in self._category_index]] = True
+        top_categories_changed = bool(is_top.any() and (~is_top).any() and counts[~is_top].max() > counts[is_top].min())
+        
+        return {
+            'price_bins_shift': float(price_bins_shift),
+            'numeric_range_shift': float(numeric_range_shift),
+            'top_categories_changed': top_categories_changed,
+            'new_feature_columns': bool(constant[onehot[onehot >= 0]].any()),
+        }
+
+    def _patch_features(self, row_map, dirty, summary):
+        """
+        Remplace/ajoute les lignes de features modifiées, ou refait tout si la dérive est trop forte
+        """
+        constant = self._constant_feature_columns()
+        numeric, onehot = self._encode_rows(self.product_data.iloc[dirty])
+        drift = self._feature_drift(onehot, constant)
+        summary['drift'].update(drift)
+        
+        if (drift['price_bins_shift'] > self.drift_tolerance or
+                drift['numeric_range_shift'] > self.drift_tolerance or
+                drift['top_categories_changed'] or drift['new_feature_columns']):
+            summary['rebuilt'] = True
+            self.create_product_features(self.product_data)
+            self._fit_knn()
+            # Toute la table de voisins dépend des anciennes features
+            self.neighbor_ids = None
+            self.neighbor_scores = None
+            return
+        
+        new_rows = self._assemble_rows(numeric, onehot, constant)
+        if row_map is None and not sparse.issparse(self.product_features):
+            self._write_feature_rows(dirty, new_rows)
+        elif row_map is None:
+            self.product_features = self._splice_sparse_rows(dirty, new_rows)
+        else:
+            n_rows = len(self.product_data)
+            n_old = self.product_features.shape[0]
+            take = np.empty(n_rows, dtype=np.int64)
+            kept = row_map >= 0
+            take[row_map[kept]] = np.flatnonzero(kept)
+            take[dirty] = n_old + np.arange(len(dirty))
+            if sparse.issparse(self.product_features):
+                self.product_features = sparse.vstack([self.product_features, new_rows], format='csr')[take]
+            else:
+                values = np.vstack([np.asarray(self.product_features), new_rows])[take]
+                self.product_features = pd.DataFrame(values, columns=self.feature_columns, index=self.product_data.index)
+                self._feature_buffer = None
+        
+        if self.knn_backend == 'brute':
+            # Un index brute ne fait que valider et garder la matrice : refait à la prochaine requête KNN
+            self.knn_model = None
+        else:
+            self.knn_model.update(self._feature_matrix(), row_map, dirty)
+        self._patch_neighbor_table(row_map, dirty)
+
+    def _write_feature_rows(self, dirty, new_rows):
+        """
+        Écrit en place les lignes de features modifiées ou ajoutées (format dense, aucune ligne supprimée)
+
+        La matrice dense est une vue sur les premières lignes de
+        _feature_buffer, qui garde FEATURE_HEADROOM de lignes libres : les
+        ajouts ne recopient pas la matrice tant qu'il reste de la place. La
+        première mise à jour après un fit ou un load copie la matrice dans un
+        tel tampon (un snapshot mappé est en lecture seule).
+        """
+        values = np.asarray(self.product_features)
+        n_old, n_rows = values.shape[0], len(self.product_data)
+        buffer = self._feature_buffer
+        if (buffer is None or not buffer.flags.writeable or len(buffer) < n_rows or
+                values.ctypes.data != buffer.ctypes.data or values.strides != buffer.strides):
+            buffer = np.empty((n_rows + int(n_rows * FEATURE_HEADROOM), values.shape[1]), dtype=np.float64)
+            buffer[:n_old] = values
+            self._feature_buffer = buffer
+        buffer[dirty] = new_rows
+        self.product_features = pd.DataFrame(
+            buffer[:n_rows], columns=self.feature_columns, index=self.product_data.index, copy=False
+        )
+
+    def _splice_sparse_rows(self, dirty, new_rows):
+        """
+        CSR des features avec les lignes dirty remplacées par new_rows (lignes au-delà de la fin : ajouts)
+
+        Les valeurs des lignes inchangées sont recopiées par tranches
+        contiguës entre deux lignes modifiées, sans indexation ligne par ligne.
+        """
+        features = self.product_features
+        n_old, n_rows = features.shape[0], len(self.product_data)
+        dirty = np.asarray(dirty, dtype=np.int64)
+        ranking = np.argsort(dirty, kind='stable')
+        dirty, new_rows = dirty[ranking], new_rows[ranking]
+        
+        lengths = np.zeros(n_rows, dtype=np.int64)
+        lengths[:n_old] = np.diff(features.indptr)
+        lengths[dirty] = np.diff(new_rows.indptr)
+        indptr = np.concatenate([[0], np.cumsum(lengths)])
+        data = np.empty(indptr[-1], dtype=features.data.dtype)
+        indices = np.empty(indptr[-1], dtype=features.indices.dtype)
+        
+        # Tranches de lignes inchangées [start, stop) entre les lignes modifiées
+        replaced = dirty[dirty < n_old]
+        starts = np.concatenate([[0], replaced + 1])
+        stops = np.concatenate([replaced, [n_old]])
+        for start, stop in zip(starts, stops):
+            if stop > start:
+                source = slice(features.indptr[start], features.indptr[stop])
+                target = slice(indptr[start], indptr[stop])
+                data[target] = features.data[source]
+                indices[target] = features.indices[source]
+        # Lignes modifiées ou ajoutées, entrée par entrée
+        targets = np.repeat(indptr[dirty] - new_rows.indptr[:-1], np.diff(new_rows.indptr)) + np.arange(new_rows.nnz)
+        data[targets] = new_rows.data
+        indices[targets] = new_rows.indices
+        return sparse.csr_matrix((data, indices, indptr), shape=(n_rows, features.shape[1]))
+
+    def _get_knn_model(self):
+        """
+        Index KNN de la matrice courante, refait à la demande après une mise à jour (backend brute)
+        """
+        if self.knn_model is None:
+            self._fit_knn()
+        return self.knn_model
+
+    def _patch_neighbor_table(self, row_map, dirty, memory_budget_mb=256):
+        """
+        Corrige la table de voisins précalculée sans la recalculer entièrement
+
+        Les lignes modifiées ou ajoutées sont recalculées ; comme la similarité
+        cosinus est symétrique, le même bloc indique aux autres produits si
+        une ligne modifiée bat leur k-ième voisin actuel. Les voisins supprimés
+        ou modifiés qui ne reviennent pas laissent un trou (-1), ignoré par
+        _knn_candidates, jusqu'au prochain precompute_neighbors.
+        """
+        if self.neighbor_ids is None:
+            return
+        
+        n_rows = len(self.product_data)
+        old_ids = np.asarray(self.neighbor_ids)
+        k = old_ids.shape[1]
+        ids = np.full((n_rows, k), -1, dtype=np.int32)
+        scores = np.full((n_rows, k), -np.inf, dtype=np.float32)
+        if row_map is None:
+            ids[:len(old_ids)] = old_ids
+            scores[:len(old_ids)] = self.neighbor_scores
+        else:
+            kept = row_map >= 0
+            ids[row_map[kept]] = remap_positions(old_ids[kept], row_map)
+            scores[row_map[kept]] = np.asarray(self.neighbor_scores)[kept]
+        
+        # Seuil d'entrée : le k-ième voisin avant la modification
+        kth_scores = scores[:, -1].copy()
+        
+        # Voisins supprimés ou modifiés : retirés, puis trous renvoyés en fin de ligne
+        is_dirty = np.zeros(n_rows, dtype=bool)
+        is_dirty[dirty] = True
+        stale = (ids < 0) | is_dirty[np.maximum(ids, 0)]
+        ids[stale] = -1
+        scores[stale] = -np.inf
+        holed = np.flatnonzero(stale.any(axis=1))
+        order = np.lexsort((ids[holed], -scores[holed]), axis=1)
+        ids[holed] = np.take_along_axis(ids[holed], order, axis=1)
+        scores[holed] = np.take_along_axis(scores[holed], order, axis=1)
+        
+        features = normalize_rows(self._feature_matrix())
+        block_size = max(1, int(memory_budget_mb * 1024 ** 2 // (12 * n_rows)))
+        for start in range(0, len(dirty), block_size):
+            chunk = np.asarray(dirty[start:start + block_size])
+            similarity = cosine_similarity_rows(features, chunk)
+            similarity[chunk, np.arange(len(chunk))] = -np.inf
+            
+            own_ids, own_scores = top_k_rows(similarity.T, k)
+            ids[chunk, :own_ids.shape[1]] = own_ids
+            scores[chunk, :own_ids.shape[1]] = own_scores
+            
+            # Paires (produit, ligne du bloc) qui battent le k-ième voisin du produit
+            rows, columns = np.nonzero((similarity > kth_scores[:, None]) & ~is_dirty[:, None])
+            targets, rows = np.unique(rows, return_inverse=True)
+            if len(targets) == 0:
+                continue
+            entry_rows = np.concatenate([np.repeat(np.arange(len(targets)), k), rows])
+            entry_ids = np.concatenate([ids[targets].ravel(), chunk[columns]])
+            entry_scores = np.concatenate([scores[targets].ravel(), similarity[targets[rows], columns]])
+            order = np.lexsort((entry_ids, -entry_scores, entry_rows))
+            entry_rows, entry_ids, entry_scores = entry_rows[order], entry_ids[order], entry_scores[order]
+            ranks = np.arange(len(order)) - np.searchsorted(entry_rows, entry_rows)
+            best = ranks < k
+            ids[targets[entry_rows[best]], ranks[best]] = entry_ids[best]
+            scores[targets[entry_rows[best]], ranks[best]] = entry_scores[best]
+        
+        self.neighbor_ids = ids
+        self.neighbor_scores = scores
+
+    def _fit_knn(self, state=None):
+        """
+        Entraîne l'index KNN sur la matrice de features courante
+
+        state : tableaux d'un index approximatif déjà construit (snapshot)
+        """
+        features = self._feature_matrix()
+        if self.knn_backend == 'brute':
+            self.knn_model = NearestNeighbors(
+                n_neighbors=50,
+                metric='cosine',
+                algorithm='brute',
+                n_jobs=-1
+            )
+            self.knn_model.fit(features)
+            return
+
+        self.knn_model = ANN_BACKENDS[self.knn_backend](**self.knn_params)
+        if state:
+            self.knn_model.load_state(features, state)
+        else:
+            self.knn_model.fit(features)
+
+    def _knn_candidates(self, positions):
+        """
+        Pool de candidats : les n_candidates plus proches voisins de chaque position (une ligne par source)
+
+        Lu directement dans la table précalculée (precompute_neighbors) quand elle existe.
+        """
+        positions = np.asarray(positions)
+        if self.neighbor_ids is not None and self.neighbor_ids.shape[1] >= self.n_candidates:
+            return np.asarray(self.neighbor_ids[positions, :self.n_candidates], dtype=np.int64)
+
+        features = self._feature_matrix()
+        n_neighbors = min(self.n_candidates + 1, features.shape[0])
+        return self._get_knn_model().kneighbors(
+            features[positions],
+            n_neighbors=n_neighbors,
+            return_distance=False
+        )
+
+    def precompute_neighbors(self, path, k=50, memory_budget_mb=256, n_jobs=1):
+        """
+        Calcule hors ligne les k plus proches voisins (cosinus) de tous les produits
+
+        Produit scalaire par blocs de lignes + argpartition ; la taille des
+        blocs respecte memory_budget_mb par worker. Écrit dans path
+        neighbor_ids.npy (N, k) int32 et neighbor_scores.npy (N, k) float32,
+        puis les rattache au modèle en mmap : get_similar_products lit alors
+        son pool de candidats dans la table (candidate_pool='knn').
+        Si path est un snapshot, son manifest est mis à jour.
+        """
+        features = normalize_rows(self._feature_matrix())
+        n_products = features.shape[0]
+        k = min(k, n_products - 1)
+
+        # Bloc de similarités float32 + indices int64 d'argpartition : 12 octets par cellule
+        block_size = max(1, int(memory_budget_mb * 1024 ** 2 // (12 * n_products)))
+        blocks = [(start, min(start + block_size, n_products)) for start in range(0, n_products, block_size)]
+
+        os.makedirs(path, exist_ok=True)
+        for name, dtype in (('neighbor_ids', np.int32), ('neighbor_scores', np.float32)):
+            array = np.lib.format.open_memmap(
+                os.path.join(path, f"{name}.npy"), mode='w+', dtype=dtype, shape=(n_products, k)
+            )
+            del array
+
+        if n_jobs == 1 or len(blocks) <= 1:
+            _init_neighbor_worker(features)
+            for start, stop in blocks:
+                _neighbor_block_worker(start, stop, k, path)
+            _init_neighbor_worker(None)
+        else:
+            if n_jobs is None or n_jobs < 0:
+                n_jobs = os.cpu_count()
+            context = mp.get_context('fork') if 'fork' in mp.get_all_start_methods() else None
+            with ProcessPoolExecutor(
+                max_workers=min(n_jobs, len(blocks)),
+                mp_context=context,
+                initializer=_init_neighbor_worker,
+                initargs=(features,)
+            ) as executor:
+                starts, stops = zip(*blocks)
+                list(executor.map(_neighbor_block_worker, starts, stops, [k] * len(blocks), [path] * len(blocks)))
+
+        self.neighbor_ids = np.load(os.path.join(path, 'neighbor_ids.npy'), mmap_mode='r')
+        self.neighbor_scores = np.load(os.path.join(path, 'neighbor_scores.npy'), mmap_mode='r')
+
+        manifest_path = os.path.join(path, 'manifest.json')
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding='utf-8') as f:
+                manifest = json.load(f)
+            manifest['arrays'] = sorted(set(manifest['arrays']) | {'neighbor_ids', 'neighbor_scores'})
+            with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(manifest_path + '.tmp', manifest_path)
+
+        return self.neighbor_ids, self.neighbor_scores
+
+    def evaluate_knn_recall(self, k=10, n_queries=200, random_state=0):
+        """
+        Rappel@k et latence de l'index KNN courant face à la recherche exacte
+        """
+        return measure_recall(self._get_knn_model(), self._feature_matrix(), k, n_queries, random_state)
+
+    def _encode_categories(self, df):
+        """
+        Encode categoryName en codes entiers (dictionnaire trié, conservé une seule fois)
+        """
+        codes, categories = pd.factorize(df['categoryName'], sort=True)
+        self.categories = categories.tolist()
+        self.category_codes = codes.astype(np.int32)
+        self._category_index = {name: code for code, name in enumerate(self.categories)}
+
+    def save(self, path):
+        """
+        Écrit l'état dérivé du modèle dans un snapshot versionné
+
+        Le répertoire contient un manifest.json, un fichier .npy par tableau
+        (mappables en mémoire au chargement) et la table produits.
+        """
+        if self.product_features is None:
+            raise ValueError("Le modèle doit être entraîné avant d'être sauvegardé")
+
+        os.makedirs(path, exist_ok=True)
+
+        if sparse.issparse(self.product_features):
+            arrays = {
+                'features_data': self.product_features.data,
+                'features_indices': self.product_features.indices,
+                'features_indptr': self.product_features.indptr,
+            }
+        else:
+            arrays = {'features': np.ascontiguousarray(self.product_features.values)}
+        arrays.update({
+            'scaler_data_min': self.scaler.data_min_,
+            'scaler_data_max': self.scaler.data_max_,
+        })
+        for name in self._SNAPSHOT_ARRAYS:
+            value = getattr(self, name)
+            if value is not None:
+                arrays[name] = value
+        if self.knn_backend != 'brute':
+            for name, value in self.knn_model.state_arrays().items():
+                arrays[f"knn_{name}"] = value
+        for name, value in arrays.items():
+            target = os.path.join(path, f"{name}.npy")
+            # Un tableau déjà mappé depuis ce fichier (ex. table de voisins) est déjà à jour
+            if isinstance(value, np.memmap) and os.path.abspath(value.filename) == os.path.abspath(target):
+                continue
+            # Écriture puis renommage : un snapshot mappé en mémoire par ailleurs reste lisible
+            with open(target + '.tmp', 'wb') as f:
+                np.save(f, np.asarray(value))
+            os.replace(target + '.tmp', target)
+
+        products_path = os.path.join(path, 'products.pkl')
+        self.product_data.to_pickle(products_path + '.tmp', compression=None)
+        os.replace(products_path + '.tmp', products_path)
+
+        manifest = {
+            'format_version': SNAPSHOT_FORMAT_VERSION,
+            'n_products': int(len(self.product_data)),
+            'index_fingerprint': index_fingerprint(self.product_data.index),
+            'feature_format': self.feature_format,
+            'feature_columns': [str(col) for col in self.feature_columns],
+            'categories': self.categories,
+            'top_categories': self.top_categories,
+            'taxonomy': self.taxonomy,
+            'candidate_pool': self.candidate_pool,
+            'n_candidates': self.n_candidates,
+            'knn_backend': self.knn_backend,
+            'knn_params': self.knn_params,
+            'price_max': self.price_max,
+            'reviews_max': self.reviews_max,
+            'drift_tolerance': self.drift_tolerance,
+            'price_sketch_k': self.price_sketch_k,
+            'arrays': sorted(arrays),
+        }
+        # Le manifest est écrit en dernier : un snapshot sans manifest est incomplet
+        tmp_path = os.path.join(path, 'manifest.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, os.path.join(path, 'manifest.json'))
+
+        return path
+
+    @classmethod
+    def load(cls, path, product_data=None, mmap=True, taxonomy_path=None, **options):
+        """
+        Recharge un snapshot écrit par save() sans réentraîner
+
+        Les tableaux sont mappés en mémoire (mmap_mode='r') : le chargement est
+        quasi instantané et plusieurs processus partagent les mêmes pages.
+        Si product_data est fourni (ex. le DataFrame déjà chargé par l'app),
+        il remplace la table produits du snapshot après vérification (mêmes
+        identifiants, dans le même ordre : voir index_fingerprint).
+        La taxonomie sauvegardée est réutilisée sauf si taxonomy_path est
+        fourni, auquel cas la matrice de similarité est reconstruite.
+        options : réglages d'exécution non sauvegardés, passés au constructeur
+        (ex. similar_cache_size, personalized_cache_size).
+        """
+        with open(os.path.join(path, 'manifest.json'), encoding='utf-8') as f:
+            manifest = json.load(f)
+
+        version = manifest.get('format_version')
+        if version != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(
+                f"Version de snapshot non supportée: {version} "
+                f"(attendue: {SNAPSHOT_FORMAT_VERSION})"
+            )
+
+        mmap_mode = 'r' if mmap else None
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in manifest['arrays']
+        }
+
+        if product_data is None:
+            product_data = pd.read_pickle(os.path.join(path, 'products.pkl'))
+        elif len(product_data) != manifest['n_products']:
+            raise ValueError(
+                f"product_data contient {len(product_data)} produits, "
+                f"le snapshot en attend {manifest['n_products']}"
+            )
+        elif index_fingerprint(product_data.index) != manifest['index_fingerprint']:
+            raise ValueError(
+                "Les identifiants de product_data (ordre compris) ne sont pas ceux du snapshot"
+            )
+
+        recommender = cls(
+            taxonomy_path=taxonomy_path or DEFAULT_TAXONOMY_PATH,
+            candidate_pool=manifest.get('candidate_pool', 'scan'),
+            n_candidates=manifest.get('n_candidates', 200),
+            knn_backend=manifest.get('knn_backend', 'brute'),
+            knn_params=manifest.get('knn_params'),
+            feature_format=manifest.get('feature_format', 'dense'),
+            drift_tolerance=manifest.get('drift_tolerance', 0.05),
+            price_sketch_k=manifest.get('price_sketch_k'),
+            **options
+        )
+        if taxonomy_path is None:
+            recommender.taxonomy = manifest['taxonomy']
+        else:
+            arrays.pop('category_similarity', None)
+        recommender.product_data = product_data
+        recommender.categories = manifest['categories']
+        recommender._category_index = {name: code for code, name in enumerate(recommender.categories)}
+        recommender.top_categories = manifest['top_categories']
+        recommender.price_max = manifest['price_max']
+        recommender.reviews_max = manifest['reviews_max']
+        for name in cls._SNAPSHOT_ARRAYS:
+            if name in arrays:
+                setattr(recommender, name, arrays[name])
+        recommender._build_indexes(missing_only=True)
+
+        recommender.feature_columns = manifest['feature_columns']
+        if recommender.feature_format == 'sparse':
+            recommender.product_features = sparse.csr_matrix(
+                (arrays['features_data'], arrays['features_indices'], arrays['features_indptr']),
+                shape=(manifest['n_products'], len(recommender.feature_columns)),
+                copy=False
+            )
+        else:
+            recommender.product_features = pd.DataFrame(
+                arrays['features'],
+                columns=recommender.feature_columns,
+                index=product_data.index,
+                copy=False
+            )
+
+        # Reconstruit le scaler à partir de ses paramètres sans refaire de fit
+        scaler = recommender.scaler
+        scaler.data_min_ = np.asarray(arrays['scaler_data_min'])
+        scaler.data_max_ = np.asarray(arrays['scaler_data_max'])
+        scaler.data_range_ = scaler.data_max_ - scaler.data_min_
+        scaler.n_features_in_ = len(scaler.data_min_)
+        scaler.feature_names_in_ = np.asarray(manifest['feature_columns'][:scaler.n_features_in_], dtype=object)
+        scaler.n_samples_seen_ = manifest['n_products']
+        feature_range_min, feature_range_max = scaler.feature_range
+        data_range = np.where(scaler.data_range_ == 0, 1.0, scaler.data_range_)
+        scaler.scale_ = (feature_range_max - feature_range_min) / data_range
+        scaler.min_ = feature_range_min - scaler.data_min_ * scaler.scale_
+
+        recommender._fit_knn(state={
+            name[len('knn_'):]: value for name, value in arrays.items() if name.startswith('knn_')
+        })
+
+        return recommender
\ No newline at end of file
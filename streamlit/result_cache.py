@@ -0,0 +1,199 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+def _default_sizeof(value):
+    """
+    Approximate size in bytes of a cached value (deep for DataFrames)
+    """
+    memory_usage = getattr(value, 'memory_usage', None)
+    if memory_usage is not None:
+        try:
+            return int(memory_usage(deep=True).sum())
+        except TypeError:
+            pass
+    nbytes = getattr(value, 'nbytes', None)
+    if nbytes is not None:
+        return int(nbytes)
+    return sys.getsizeof(value)
+
+
+class _InFlight:
+    """
+    A computation in progress that concurrent callers of the same key wait on
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class LRUCache:
+    """
+    Bounded, thread-safe least-recently-used cache with optional TTL and memory cap
+
+    maxsize: maximum number of entries (0 disables caching)
+    ttl: seconds after which an entry expires (None: entries only leave by eviction)
+    max_bytes: cap on the summed sizeof() of the entries (None: no cap)
+
+    get() returns None on a miss, so None itself cannot be cached.
+    get_or_compute() coalesces concurrent misses on the same key: one caller
+    computes, the others wait for its result. invalidate() bumps the
+    generation: entries are dropped and computations started before it are
+    not stored.
+    """
+    def __init__(self, maxsize=1024, ttl=None, max_bytes=None, sizeof=_default_sizeof, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.clock = clock
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.coalesced = 0
+
+    def _lookup(self, key):
+        # Caller holds the lock; entries are (value, size, expires_at)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, size, expires_at = entry
+        if expires_at is not None and self.clock() >= expires_at:
+            del self._entries[key]
+            self.bytes -= size
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _store(self, key, value, generation):
+        # Caller holds the lock
+        if self.maxsize <= 0 or generation != self.generation:
+            return
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        if key in self._entries:
+            self.bytes -= self._entries.pop(key)[1]
+        expires_at = self.clock() + self.ttl if self.ttl is not None else None
+        self._entries[key] = (value, size, expires_at)
+        self.bytes += size
+        while len(self._entries) > self.maxsize or (self.max_bytes is not None and self.bytes > self.max_bytes):
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    def get(self, key):
+        with self._lock:
+            value = self._lookup(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def put(self, key, value, generation=None):
+        """
+        Stores value under key; generation is the cache's generation when its computation started
+
+        A value computed before an invalidate() is not stored.
+        """
+        with self._lock:
+            self._store(key, value, self.generation if generation is None else generation)
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns the cached value for key, computing it once with compute() on a miss
+        """
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                self.misses += 1
+                in_flight = self._in_flight[key] = _InFlight()
+                generation = self.generation
+                owner = True
+            else:
+                self.coalesced += 1
+                owner = False
+
+        if not owner:
+            in_flight.done.wait()
+            if in_flight.error is not None:
+                raise in_flight.error
+            return in_flight.value
+
+        try:
+            in_flight.value = compute()
+        except BaseException as error:
+            in_flight.error = error
+            raise
+        finally:
+            with self._lock:
+                if self._in_flight.get(key) is in_flight:
+                    del self._in_flight[key]
+                if in_flight.error is None:
+                    self._store(key, in_flight.value, generation)
+            in_flight.done.set()
+        return in_flight.value
+
+    def invalidate(self):
+        """
+        Starts a new generation: every current entry and pending computation becomes stale
+        """
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._in_flight.clear()
+            self.bytes = 0
+
+    def clear(self):
+        """
+        Drops every entry; the counters are kept so hit rates span refits
+        """
+        self.invalidate()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __getstate__(self):
+        # Pickled (e.g. for worker processes) as an empty cache with the same settings
+        return {
+            'maxsize': self.maxsize, 'ttl': self.ttl, 'max_bytes': self.max_bytes,
+            'sizeof': self.sizeof, 'clock': self.clock,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'hit_rate': (self.hits + self.coalesced) / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'generation': self.generation,
+            }
@@ -0,0 +1,162 @@
+import re
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from catalog_dtypes import float64_values
+from result_cache import LRUCache
+
+# Titles containing one of these words are accessories or "compatible with" products
+ACCESSORY_KEYWORDS = [
+    'cable', 'case', 'cover', 'accessory', 'accessories', 'stand',
+    'mount', 'holder', 'protector', 'aux', 'adapter', 'compatible', 'for'
+]
+ALL_TERMS_BOOST = 100
+EXACT_PHRASE_BOOST = 50
+ACCESSORY_PENALTY = 100
+CATEGORY_BONUS = 50
+
+SearchResult = namedtuple('SearchResult', ['positions', 'scores', 'n_matches'])
+
+
+def _gather(offsets, postings, rows):
+    """
+    Concatenation of the posting lists of the given rows, without a Python loop
+    """
+    starts, ends = offsets[rows], offsets[rows + 1]
+    lengths = ends - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.empty(0, dtype=postings.dtype)
+    # Position in postings of every gathered item: run start + rank inside the run
+    shifts = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return postings[shifts + np.arange(total)]
+
+
+class SearchIndex:
+    """
+    In-memory inverted index over product titles and category names
+
+    Titles are lower-cased and split on whitespace; each token keeps the
+    sorted int32 positions of the products holding it (one CSR layout for
+    the whole vocabulary). A query term has no whitespace, so it appears in
+    a title exactly when it is a substring of one of the title's tokens:
+    the vocabulary is scanned once per term (cached) and the postings of
+    the matching tokens are merged.
+
+    A product matches when its title contains the whole query, case
+    ignored, as the search bar's title.str.contains did (but without regex
+    syntax): the postings of the query terms are intersected, then the
+    remaining titles are checked for the query itself. Matches are scored
+    with the rules of the search bar:
+
+    - +100 when every query term appears in the title (+50 more with
+      exact_phrase when the whole query appears as typed)
+    - -100 when the title contains an accessory keyword
+    - +50 when a query term appears in the category name
+    - + min(stars, 5) + min(log1p(reviews) / 20, 2.5), floored at 0
+
+    Scores are computed with vectorized array operations; positions refer
+    to the rows of the DataFrame the index was built from.
+    """
+    def __init__(self, df, term_cache_size=1024):
+        n_products = len(df)
+        titles = pd.Series(df['title'].to_numpy(), dtype=object).fillna('').astype(str).str.lower()
+        self.titles = titles.to_numpy()
+
+        tokens = titles.str.split().explode().dropna()
+        token_codes, vocabulary = pd.factorize(tokens.to_numpy(), sort=True)
+        # Unique (token, product) pairs, sorted by token then position
+        pairs = np.unique(token_codes.astype(np.int64) * max(n_products, 1) + tokens.index.to_numpy())
+        self.vocabulary = np.asarray(vocabulary, dtype=object)
+        self.postings = (pairs % max(n_products, 1)).astype(np.int32)
+        self.offsets = np.concatenate([
+            [0], np.cumsum(np.bincount(pairs // max(n_products, 1), minlength=len(vocabulary)))
+        ]).astype(np.int64)
+        # One string for the substring scans; token i starts at token_starts[i]
+        self._joined = '\n'.join(self.vocabulary) + '\n'
+        self._token_starts = np.concatenate([[0], np.cumsum([len(token) + 1 for token in self.vocabulary])])[:-1]
+
+        categories = pd.Categorical(df['categoryName'])
+        self.category_names = [str(name).lower() for name in categories.categories]
+        self.category_codes = categories.codes.astype(np.int32)
+        self.category_postings = np.argsort(self.category_codes, kind='stable').astype(np.int32)
+        self.category_offsets = np.searchsorted(
+            self.category_codes[self.category_postings], np.arange(len(self.category_names) + 1)
+        ).astype(np.int64)
+
+        accessory_pattern = '|'.join(re.escape(word) for word in ACCESSORY_KEYWORDS)
+        self.accessory = titles.str.contains(accessory_pattern, regex=True).to_numpy(dtype=bool)
+        stars = float64_values(df['stars'])
+        reviews = df['reviews'].to_numpy(dtype=np.float64)
+        self.base_scores = np.minimum(stars, 5) + np.minimum(np.log1p(reviews) / 20, 2.5)
+
+        self.n_products = n_products
+        self._term_cache = LRUCache(maxsize=term_cache_size)
+
+    @property
+    def nbytes(self):
+        arrays = [
+            self.postings, self.offsets, self._token_starts, self.category_codes,
+            self.category_postings, self.category_offsets, self.accessory, self.base_scores,
+        ]
+        return sum(array.nbytes for array in arrays) + len(self._joined)
+
+    def _term_positions(self, term):
+        """
+        Sorted positions of the products whose title contains term
+        """
+        def compute():
+            offsets = [match.start() for match in re.finditer(re.escape(term), self._joined)]
+            tokens = np.unique(np.searchsorted(self._token_starts, offsets, side='right') - 1)
+            return np.unique(_gather(self.offsets, self.postings, tokens))
+        return self._term_cache.get_or_compute(term, compute)
+
+    def _category_matches(self, terms, positions):
+        """
+        Mask of the given products whose category name contains one of the terms
+        """
+        codes = [code for code, name in enumerate(self.category_names) if any(term in name for term in terms)]
+        return np.isin(self.category_codes[positions], codes)
+
+    def search(self, query, k=None, exact_phrase=False):
+        """
+        Best products for a free-text query
+
+        Returns SearchResult(positions, scores, n_matches): the positions of
+        the k best products whose title contains the query (all of them if
+        k is None) by decreasing score, ties in catalogue order, and the
+        total number of matches.
+        """
+        phrase = query.lower()
+        terms = list(dict.fromkeys(phrase.split()))
+        if not terms or self.n_products == 0:
+            return SearchResult(np.empty(0, dtype=np.int64), np.empty(0), 0)
+
+        # A title containing the query holds every term inside one of its tokens
+        term_positions = sorted((self._term_positions(term) for term in terms), key=len)
+        candidates = term_positions[0]
+        for positions in term_positions[1:]:
+            candidates = np.intersect1d(candidates, positions, assume_unique=True)
+        if phrase != terms[0]:
+            # Several terms (or surrounding spaces): they must appear together, as typed
+            candidates = candidates[np.fromiter(
+                (phrase in title for title in self.titles[candidates]), dtype=bool, count=len(candidates)
+            )]
+
+        scores = self.base_scores[candidates] + ALL_TERMS_BOOST
+        scores[self.accessory[candidates]] -= ACCESSORY_PENALTY
+        scores[self._category_matches(terms, candidates)] += CATEGORY_BONUS
+        if exact_phrase:
+            scores += EXACT_PHRASE_BOOST
+        scores = np.maximum(scores, 0)
+
+        if k is not None and k < len(candidates):
+            # Every candidate tied with the k-th score is kept, so ties are cut in catalogue order
+            kth = np.partition(-scores, k - 1)[k - 1]
+            best = np.flatnonzero(-scores <= kth)
+        else:
+            best = np.arange(len(candidates))
+        best = best[np.lexsort((candidates[best], -scores[best]))][:k]
+        return SearchResult(candidates[best].astype(np.int64), scores[best], len(candidates))
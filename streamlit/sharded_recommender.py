@@ -0,0 +1,270 @@
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from catalog_dtypes import output_catalog
+from recommender_sys import MAX_PRICE_RATIO, MIN_CATEGORY_SIMILARITY, MIN_PRICE_RATIO, _draw_seed, _nlargest_positions
+
+SHARD_STRATEGIES = ('category', 'price')
+
+# Shard served by the current worker process
+_SHARD = None
+
+
+def _init_shard(recommender, positions):
+    global _SHARD
+    _SHARD = recommender._shard(positions)
+
+
+def _shard_segment_picks(requests):
+    """
+    Segment draws of this shard for a list of (source, seed) requests
+    """
+    return [_SHARD._segment_picks(source, seed, always_fallback=True) for source, seed in requests]
+
+
+def _shard_category_top(code, n, max_price, max_reviews):
+    return _SHARD._category_top(code, n, max_price, max_reviews)
+
+
+def partition_by_category(category_codes, n_categories, n_shards):
+    """
+    Assigns whole categories to shards, balancing product counts (longest processing time first)
+
+    Returns the shard of every category.
+    """
+    counts = np.bincount(category_codes, minlength=n_categories)
+    assignment = np.zeros(n_categories, dtype=np.int64)
+    loads = np.zeros(n_shards, dtype=np.int64)
+    for code in np.argsort(-counts, kind='stable'):
+        shard = int(np.argmin(loads))
+        assignment[code] = shard
+        loads[shard] += counts[code]
+    return assignment
+
+
+def partition_by_price(prices, n_shards):
+    """
+    Splits the catalogue into price ranges of roughly equal size
+
+    Returns the interior boundaries; a product goes to the shard
+    searchsorted(boundaries, price, side='right'), so equal prices share a shard.
+    """
+    return np.unique(np.quantile(prices, np.arange(1, n_shards) / n_shards))
+
+
+def _merge_picks(shard_picks):
+    """
+    Concatenates, segment by segment, the draws returned by several shards
+    """
+    return [
+        tuple(np.concatenate(parts) for parts in zip(*segment))
+        for segment in zip(*shard_picks)
+    ]
+
+
+class ShardedRecommender:
+    """
+    Serves a fitted AmazonRecommender from product shards held by worker processes
+
+    The catalogue is split by category group (shard_by='category') or price
+    range (shard_by='price'); each shard lives in its own single-worker
+    process with its own (category, price) index. A request is only sent to
+    the shards that can hold candidates (eligible categories overlapping the
+    price band for get_similar_products, the category's shards for
+    get_category_recommendations) and their partial results are merged.
+
+    Draws are keyed by (seed, source, segment, candidate) and category scores
+    use the whole category's maxima, so with an integer random_state the
+    merged results are exactly those of the unsharded recommender. Only the
+    'scan' candidate pool can be sharded.
+    """
+    def __init__(self, recommender, n_shards=4, shard_by='category'):
+        if shard_by not in SHARD_STRATEGIES:
+            raise ValueError(f"shard_by must be one of {SHARD_STRATEGIES}, got {shard_by!r}")
+        if recommender.candidate_pool != 'scan':
+            raise ValueError("only candidate_pool='scan' can be sharded")
+        if recommender.product_data is None:
+            raise ValueError("the recommender must be fitted or loaded before sharding")
+        self.recommender = recommender
+        self.shard_by = shard_by
+
+        category_codes = np.asarray(recommender.category_codes)
+        prices = np.asarray(recommender.prices)
+        n_categories = len(recommender.categories)
+        if shard_by == 'category':
+            shard_of_product = partition_by_category(category_codes, n_categories, n_shards)[category_codes]
+        else:
+            shard_of_product = np.searchsorted(partition_by_price(prices, n_shards), prices, side='right')
+        shard_positions = [np.flatnonzero(shard_of_product == shard) for shard in range(n_shards)]
+        self.shard_positions = [positions for positions in shard_positions if len(positions)]
+        self.n_shards = len(self.shard_positions)
+
+        # Per (shard, category) product count and price range, for routing
+        self.shard_category_counts = np.stack([
+            np.bincount(category_codes[positions], minlength=n_categories) for positions in self.shard_positions
+        ])
+        self.shard_min_price = np.full((self.n_shards, n_categories), np.inf)
+        self.shard_max_price = np.full((self.n_shards, n_categories), -np.inf)
+        for shard, positions in enumerate(self.shard_positions):
+            np.minimum.at(self.shard_min_price[shard], category_codes[positions], prices[positions])
+            np.maximum.at(self.shard_max_price[shard], category_codes[positions], prices[positions])
+
+        # Whole-category maxima, shared by every shard's value_score
+        self.category_max_price, self.category_max_reviews = recommender._category_maxima()
+        self._executors = None
+
+    def start(self):
+        """
+        Starts one worker process per shard (each builds its shard from the forked model)
+        """
+        if self._executors is not None:
+            return self
+        # fork shares the model's arrays with the workers without copying them
+        context = mp.get_context('fork') if 'fork' in mp.get_all_start_methods() else None
+        self._executors = [
+            ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=context,
+                initializer=_init_shard,
+                initargs=(self.recommender, positions)
+            )
+            for positions in self.shard_positions
+        ]
+        return self
+
+    def close(self):
+        if self._executors is not None:
+            for executor in self._executors:
+                executor.shutdown()
+            self._executors = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def shard_sizes(self):
+        return [len(positions) for positions in self.shard_positions]
+
+    def _similar_shards(self, source):
+        """
+        Shards holding an eligible category whose prices overlap the source's price band
+        """
+        eligible = self.recommender.category_similarity[:, source['category']] > MIN_CATEGORY_SIMILARITY
+        overlap = (
+            (self.shard_min_price[:, eligible] <= source['price'] * MAX_PRICE_RATIO) &
+            (self.shard_max_price[:, eligible] >= source['price'] * MIN_PRICE_RATIO)
+        )
+        return np.flatnonzero(overlap.any(axis=1))
+
+    def _similar_requests(self, source_positions, random_state):
+        """
+        Sources, their seeds and their requests grouped by shard
+        """
+        sources, seeds = [], []
+        requests = [[] for _ in range(self.n_shards)]
+        for original_pos in source_positions:
+            source = self.recommender._similar_source(original_pos)
+            seed = _draw_seed(random_state)
+            sources.append(source)
+            seeds.append(seed)
+            for shard in self._similar_shards(source):
+                requests[shard].append(len(sources) - 1)
+        return sources, seeds, requests
+
+    def _gather_picks(self, sources, seeds, requests):
+        """
+        Sends each shard its requests in one task; returns the merged draws of every source
+        """
+        self.start()
+        futures = {
+            shard: self._executors[shard].submit(
+                _shard_segment_picks, [(sources[i], seeds[i]) for i in indices]
+            )
+            for shard, indices in enumerate(requests) if indices
+        }
+        shard_picks = [[] for _ in sources]
+        for shard, future in futures.items():
+            for i, picks in zip(requests[shard], future.result()):
+                shard_picks[i].append(picks)
+        return [_merge_picks(picks) for picks in shard_picks]
+
+    def get_similar_products(self, product_id, n=5, random_state=None):
+        """
+        Same contract as AmazonRecommender.get_similar_products, computed on the shards
+        """
+        try:
+            original_pos = self.recommender.product_data.index.get_loc(product_id)
+            sources, seeds, requests = self._similar_requests([original_pos], random_state)
+            picks = self._gather_picks(sources, seeds, requests)[0]
+            return self.recommender._similar_frame(*self.recommender._rank_segment_picks(sources[0], picks, n))
+        except Exception as e:
+            print(f"Error in get_similar_products: {str(e)}")
+            return pd.DataFrame()
+
+    def get_similar_products_batch(self, product_ids, n=5, random_state=None):
+        """
+        Same contract as AmazonRecommender.get_similar_products_batch
+
+        Each shard receives every source routed to it in a single task, so the
+        shards work in parallel on the whole batch.
+        """
+        product_ids = pd.Index(product_ids)
+        source_positions = self.recommender.product_data.index.get_indexer(product_ids)
+        known = source_positions >= 0
+        if not known.all():
+            print(f"get_similar_products_batch: {int((~known).sum())} unknown products skipped")
+        source_ids = product_ids[known]
+        if not len(source_ids):
+            return self.recommender._batch_frame(source_ids, [])
+
+        sources, seeds, requests = self._similar_requests(source_positions[known], random_state)
+        counts = np.zeros(len(sources), dtype=np.int64)
+        positions, scores = [], []
+        for i, (source, picks) in enumerate(zip(sources, self._gather_picks(sources, seeds, requests))):
+            source_positions, source_scores = self.recommender._rank_segment_picks(source, picks, n)
+            counts[i] = len(source_positions)
+            positions.append(source_positions)
+            scores.append(source_scores)
+        return self.recommender._batch_frame(
+            source_ids, [(counts, np.concatenate(positions), np.concatenate(scores))]
+        )
+
+    def get_category_recommendations(self, category, n=5):
+        """
+        Same contract as AmazonRecommender.get_category_recommendations
+
+        Each shard holding the category returns its n best products; the
+        merge keeps the n best overall (ties by catalogue order).
+        """
+        recommender = self.recommender
+        code = recommender._category_index.get(category)
+        if code is None or n <= 0:
+            return pd.DataFrame()
+        shards = np.flatnonzero(self.shard_category_counts[:, code])
+        if not len(shards):
+            return pd.DataFrame()
+
+        self.start()
+        futures = [
+            self._executors[shard].submit(
+                _shard_category_top, code, n, self.category_max_price[code], self.category_max_reviews[code]
+            )
+            for shard in shards
+        ]
+        results = [future.result() for future in futures]
+        positions, scores = _nlargest_positions(
+            np.concatenate([shard_scores for _, shard_scores in results]),
+            np.concatenate([shard_positions for shard_positions, _ in results]),
+            n
+        )
+
+        recommendations = output_catalog(recommender.product_data.iloc[positions][[
+            'title', 'categoryName', 'price', 'stars'
+        ]])
+        recommendations['value_score'] = scores
+        return recommendations
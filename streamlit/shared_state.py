@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import namedtuple
+
+# Everything a page needs, built together for one version of the catalog
+ServingBundle = namedtuple('ServingBundle', [
+    'generation', 'fingerprint', 'catalog', 'recommender', 'search_index', 'autocomplete', 'facets', 'built_at'
+])
+
+
+class SharedServingState:
+    """
+    One read-only serving bundle per process, warmed up in the background and swapped atomically
+
+    loader(fingerprint) returns a dict with the ServingBundle fields catalog,
+    recommender, search_index, autocomplete and facets; fingerprint()
+    identifies the current version of the source data (None if missing).
+    start() builds the first bundle in a background thread. refresh() (cheap,
+    meant for every rerun) starts a rebuild when the fingerprint changed;
+    sessions keep the bundle they read until the new one replaces it in a
+    single assignment, so a page never mixes two versions. A failed build
+    keeps the current bundle and is reported by status().
+
+    Bundles are shared by every session: callers must not modify them.
+    """
+    def __init__(self, loader, fingerprint, check_interval=2.0, clock=time.monotonic):
+        self.loader = loader
+        self.fingerprint = fingerprint
+        self.check_interval = check_interval
+        self.clock = clock
+        self.bundle = None
+        self.generation = 0
+        self.last_error = None
+        self.last_build_seconds = None
+        self._building = None
+        self._failed = None
+        self._last_check = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    def start(self):
+        """
+        Starts warming up the first bundle (no-op once a bundle exists or is being built)
+        """
+        with self._lock:
+            if self.bundle is None and self._building is None:
+                self._start_build(self.fingerprint())
+        return self
+
+    def _start_build(self, fingerprint):
+        # Called with the lock held
+        self._building = fingerprint
+        threading.Thread(target=self._build, args=(fingerprint,), name='serving-bundle-build', daemon=True).start()
+
+    def _build(self, fingerprint):
+        started = time.perf_counter()
+        try:
+            parts = self.loader(fingerprint)
+        except Exception as error:
+            with self._lock:
+                self.last_error = str(error)
+                self._failed = fingerprint
+                self._building = None
+            if self.bundle is None:
+                # Let waiting pages report the failure instead of blocking
+                self._ready.set()
+            return
+        with self._lock:
+            self.generation += 1
+            self.bundle = ServingBundle(
+                generation=self.generation, fingerprint=fingerprint, built_at=time.time(), **parts
+            )
+            self.last_error = None
+            self._failed = None
+            self.last_build_seconds = time.perf_counter() - started
+            self._building = None
+        self._ready.set()
+
+    def refresh(self):
+        """
+        Starts a background rebuild if the source data changed since the current bundle
+
+        The fingerprint is checked at most every check_interval seconds; a
+        version whose build failed is only retried once the data changes
+        again. Returns True when a rebuild was started.
+        """
+        now = self.clock()
+        with self._lock:
+            if self._building is not None:
+                return False
+            if self._last_check is not None and now - self._last_check < self.check_interval:
+                return False
+            self._last_check = now
+        fingerprint = self.fingerprint()
+        with self._lock:
+            current = self.bundle.fingerprint if self.bundle is not None else None
+            if self._building is not None or fingerprint is None or fingerprint in (current, self._failed):
+                return False
+            self._start_build(fingerprint)
+            return True
+
+    def current(self, timeout=None):
+        """
+        The current bundle, waiting up to timeout seconds for the first one (None if not ready)
+        """
+        self._ready.wait(timeout)
+        return self.bundle
+
+    def status(self):
+        """
+        Readiness summary: state is 'warming', 'ready', 'refreshing' or 'failed'
+        """
+        with self._lock:
+            if self.bundle is None:
+                state = 'failed' if self.last_error is not None and self._building is None else 'warming'
+            else:
+                state = 'refreshing' if self._building is not None else 'ready'
+            return {
+                'state': state,
+                'generation': self.generation,
+                'built_at': self.bundle.built_at if self.bundle is not None else None,
+                'build_seconds': self.last_build_seconds,
+                'error': self.last_error,
+            }
@@ -0,0 +1,71 @@
+import numpy as np
+
+
+def remap_positions(positions, row_map):
+    """
+    Translates old row positions through row_map (old -> new position, -1 when dropped)
+
+    Negative input positions (padding) stay -1.
+    """
+    positions = np.asarray(positions)
+    valid = positions >= 0
+    return np.where(valid, row_map[np.where(valid, positions, 0)], -1)
+
+
+def insertion_points(sorted_keys, new_keys):
+    """
+    Left insertion points of new entries into arrays sorted lexicographically by sorted_keys
+
+    sorted_keys and new_keys are lists of aligned arrays, primary key first.
+    The primary key is searched for all entries at once; only entries tied on
+    it are refined key by key, so the cost stays close to one searchsorted.
+    """
+    first, new_first = sorted_keys[0], new_keys[0]
+    points = np.searchsorted(first, new_first, side='left')
+    ends = np.searchsorted(first, new_first, side='right')
+    for i in np.flatnonzero(ends > points):
+        lo, hi = points[i], ends[i]
+        for key, new in zip(sorted_keys[1:], new_keys[1:]):
+            segment = key[lo:hi]
+            lo, hi = lo + np.searchsorted(segment, new[i], side='left'), lo + np.searchsorted(segment, new[i], side='right')
+            if lo == hi:
+                break
+        points[i] = lo
+    return points
+
+
+def patch_sorted_order(order, sorted_keys, row_map, dirty, dirty_keys, n_rows):
+    """
+    Patches a permutation sorted by (*keys, position) after rows were removed, replaced or appended
+
+    order: positions sorted by sorted_keys then by position (stable argsort/lexsort)
+    sorted_keys: key arrays aligned with order
+    row_map: old position -> new position (-1 for removed rows), or None when no row moved
+    dirty: new positions whose keys changed or that were appended
+    dirty_keys: their key values, aligned with dirty
+    n_rows: number of rows after the change
+
+    Kept entries are remapped and filtered in one vectorized pass, dirty
+    entries are merged in at their insertion points: O(N) copies instead of
+    an O(N log N) re-sort. Returns (order, sorted_keys) as new arrays.
+    """
+    order = np.asarray(order)
+    mapped = order if row_map is None else remap_positions(order, row_map)
+    is_dirty = np.zeros(n_rows, dtype=bool)
+    is_dirty[dirty] = True
+    alive = mapped >= 0
+    alive[alive] = ~is_dirty[mapped[alive]]
+
+    kept_order = mapped[alive]
+    kept_keys = [np.asarray(key)[alive] for key in sorted_keys]
+
+    dirty = np.asarray(dirty, dtype=np.int64)
+    dirty_keys = [np.asarray(key) for key in dirty_keys]
+    ranking = np.lexsort([dirty] + dirty_keys[::-1])
+    dirty = dirty[ranking]
+    dirty_keys = [key[ranking] for key in dirty_keys]
+
+    points = insertion_points(kept_keys + [kept_order], dirty_keys + [dirty])
+    new_order = np.insert(kept_order, points, dirty).astype(order.dtype)
+    new_keys = [np.insert(kept, points, new) for kept, new in zip(kept_keys, dirty_keys)]
+    return new_order, new_keys
@@ -0,0 +1,52 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The app modules import each other by their bare names (run from streamlit/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CATEGORIES = [
+    'Hi-Fi Speakers', 'PC & Video Games', 'PC Gaming Accessories', 'Headphones', 'Home Audio & Theater',
+    'TV & Home Cinema', 'Home Entertainment', 'Electrical', 'Home & Kitchen', 'Furniture',
+    'Home Improvement', 'Home Storage', 'Sports & Outdoors', 'Skin Care', 'Make-up', 'Toys',
+] + [f"Category {i}" for i in range(50)]
+WORDS = (
+    'apple samsung sony wireless bluetooth speaker case cover usb cable headphones kettle chair lamp '
+    'desk mouse keyboard gaming portable mini pro max black white red blue for with stand holder'
+).split()
+
+
+def make_catalog(n_products=3000, seed=0):
+    """
+    Synthetic clean catalogue with the columns of amazon_uk_final.csv
+
+    Category sizes decrease with their rank (Zipf law) and about a third
+    of the titles have a '|' suffix, so products share title families as in
+    the real data.
+    """
+    rng = np.random.default_rng(seed)
+    weights = 1.0 / np.arange(1, len(CATEGORIES) + 1) ** 1.1
+    titles = []
+    for _ in range(n_products):
+        title = ' '.join(rng.choice(WORDS, rng.integers(2, 7))).title()
+        if rng.random() < 0.3:
+            title += ' | ' + ' '.join(rng.choice(WORDS, 3))
+        titles.append(f"{title} {rng.integers(0, 500)}")
+    return pd.DataFrame({
+        'asin': [f"B{i:09d}" for i in range(n_products)],
+        'title': titles,
+        'imgUrl': [f"https://images.example/{i}.jpg" for i in range(n_products)],
+        'productURL': [f"https://shop.example/{i}" for i in range(n_products)],
+        'stars': np.round(rng.uniform(1, 5, n_products) * 2) / 2,
+        'reviews': rng.integers(0, 20000, n_products),
+        'price': np.round(np.exp(rng.normal(3, 1.2, n_products)), 2) + 0.5,
+        'categoryName': rng.choice(CATEGORIES, n_products, p=weights / weights.sum()),
+    })
+
+
+@pytest.fixture
+def catalog():
+    return make_catalog()
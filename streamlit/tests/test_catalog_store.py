@@ -0,0 +1,72 @@
+import os
+import threading
+
+import pytest
+
+import catalog_store
+from catalog_store import CatalogStore
+from conftest import make_catalog
+
+
+def write_csv(path, df, mtime_ns):
+    df.to_csv(path, index=False)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def builds(store):
+    return sorted(name for name in os.listdir(store.cache_dir) if name.startswith('build-'))
+
+
+def test_concurrent_stores_build_once(tmp_path):
+    csv_path = str(tmp_path / 'catalog.csv')
+    write_csv(csv_path, make_catalog(500), 10**18)
+    stores = [CatalogStore(csv_path) for _ in range(4)]
+    barrier = threading.Barrier(len(stores))
+    manifests = []
+
+    def load(store):
+        barrier.wait()
+        manifests.append(store.ensure())
+        store.fetch(store.load(['title']).index[:5])
+
+    threads = [threading.Thread(target=load, args=(store,)) for store in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({manifest['build'] for manifest in manifests}) == 1
+    assert len(builds(stores[0])) == 1
+
+
+def test_rebuild_keeps_the_build_of_the_replaced_manifest(tmp_path):
+    csv_path = str(tmp_path / 'catalog.csv')
+    write_csv(csv_path, make_catalog(500), 10**18)
+    store = CatalogStore(csv_path)
+    first = store.ensure()['build']
+
+    write_csv(csv_path, make_catalog(500, seed=1), 2 * 10**18)
+    second = store.ensure()['build']
+    assert {first, second} == {name.split('.')[0] for name in builds(store)}
+
+    write_csv(csv_path, make_catalog(500, seed=2), 3 * 10**18)
+    third = store.ensure()['build']
+    assert {second, third} == {name.split('.')[0] for name in builds(store)}
+
+
+@pytest.mark.parametrize('parquet', [True, False])
+def test_fetch_follows_a_rebuild(tmp_path, monkeypatch, parquet):
+    if not parquet:
+        monkeypatch.setattr(catalog_store, 'pq', None)
+    elif catalog_store.pq is None:
+        pytest.skip('pyarrow is not installed')
+    csv_path = str(tmp_path / 'catalog.csv')
+    df = make_catalog(500)
+    write_csv(csv_path, df, 10**18)
+    store = CatalogStore(csv_path)
+    ids = store.load().index[:10]
+    assert store.fetch(ids)['imgUrl'].tolist() == df.loc[ids, 'imgUrl'].tolist()
+
+    df['imgUrl'] = df['imgUrl'].str.replace('images.example', 'cdn.example')
+    write_csv(csv_path, df, 2 * 10**18)
+    store.load(['title'])
+    assert store.fetch(ids)['imgUrl'].tolist() == df.loc[ids, 'imgUrl'].tolist()
@@ -0,0 +1,15 @@
+import numpy as np
+
+from catalog_dtypes import compact_catalog
+from conftest import make_catalog
+from facets import FacetIndex
+
+
+def test_range_bounds_keep_equal_float32_values():
+    catalog = make_catalog(2000, seed=6)
+    catalog['stars'] = np.random.default_rng(6).choice([3.0, 4.2, 4.3], len(catalog))
+    facets = FacetIndex(compact_catalog(catalog))
+    for low in (4.2, np.float64(4.2)):
+        assert facets.count(facets.range('stars', low, None)) == (catalog['stars'] >= 4.2).sum()
+    price = catalog['price'].iloc[0]
+    assert facets.count(facets.range('price', price, price)) == (catalog['price'] == price).sum()
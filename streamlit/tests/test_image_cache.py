@@ -0,0 +1,138 @@
+import io
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+
+from image_cache import ImageCache, make_thumbnail
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+def image_bytes(seed):
+    """
+    A noisy PNG (random bytes without Pillow), so thumbnails differ in size
+    """
+    pixels = np.random.default_rng(seed).integers(0, 256, (400, 400 + 10 * seed, 3), dtype=np.uint8)
+    if Image is None:
+        return pixels.tobytes()[:20000 + 1000 * seed]
+    output = io.BytesIO()
+    Image.fromarray(pixels).save(output, format='PNG')
+    return output.getvalue()
+
+
+class ImageServer(ThreadingHTTPServer):
+    """
+    Local image host: /img/<n> answers after a short delay, /slow after one second, anything else 404
+    """
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), ImageHandler)
+        self.images = {f"/img/{i}": image_bytes(i) for i in range(6)}
+        self.requests = Counter()
+        self.requests_lock = threading.Lock()
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server_address[1]}{path}"
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        with self.server.requests_lock:
+            self.server.requests[self.path] += 1
+        if self.path == '/slow':
+            time.sleep(1.0)
+        elif self.path in self.server.images:
+            time.sleep(0.1)
+        if self.path not in self.server.images:
+            self.send_error(404)
+            return
+        body = self.server.images[self.path]
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ImageServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_concurrent_requests_share_one_download(server, tmp_path):
+    cache = ImageCache(str(tmp_path), max_workers=4)
+    urls = [server.url(f"/img/{i}") for i in range(3)]
+    results = []
+
+    def render():
+        results.append(cache.get_many(urls * 2, timeout=5))
+
+    threads = [threading.Thread(target=render) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    cache.close()
+
+    assert all(path is not None for paths in results for path in paths.values())
+    assert [server.requests[f"/img/{i}"] for i in range(3)] == [1, 1, 1]
+    assert cache.stats()['misses'] == 3
+    assert cache.src(urls[0]).startswith('data:image/jpeg;base64,')
+
+
+def test_failures_are_not_retried_before_retry_after(server, tmp_path):
+    now = [0.0]
+    cache = ImageCache(str(tmp_path), timeout=0.3, retry_after=60, clock=lambda: now[0])
+    missing, slow = server.url('/missing'), server.url('/slow')
+    for _ in range(3):
+        paths = cache.get_many([missing, slow], timeout=2)
+        assert paths == {missing: None, slow: None}
+    assert server.requests['/missing'] == 1 and server.requests['/slow'] == 1
+    assert cache.stats()['errors'] == 2
+    assert cache.src(missing) == missing
+
+    now[0] = 61.0
+    cache.get_many([missing], timeout=2)
+    cache.close()
+    assert server.requests['/missing'] == 2
+
+
+def test_eviction_and_rescan_after_restart(server, tmp_path):
+    sizes = [len(make_thumbnail(server.images[f"/img/{i}"])) for i in range(6)]
+    max_bytes = sizes[3] + sizes[4] + sizes[5]
+    cache = ImageCache(str(tmp_path), max_bytes=max_bytes, max_workers=1)
+    for i in range(6):
+        # One at a time, so the least recently used are the first ones
+        assert cache.get_many([server.url(f"/img/{i}")], timeout=5)[server.url(f"/img/{i}")] is not None
+    cache.close()
+    stats = cache.stats()
+    assert stats['bytes'] == max_bytes and stats['files'] == 3 and stats['evictions'] == 3
+    assert all(cache.path(server.url(f"/img/{i}")) is None for i in range(3))
+    assert len(list(tmp_path.glob('*.jpg'))) == 3
+
+    # A new process finds the thumbnails on disk and keeps their recency
+    time.sleep(0.01)
+    assert cache.path(server.url('/img/3')) is not None
+    restarted = ImageCache(str(tmp_path), max_bytes=max_bytes)
+    assert restarted.stats()['bytes'] == max_bytes
+    assert restarted.get_many([server.url('/img/3')])[server.url('/img/3')] is not None
+    assert restarted.stats()['hits'] == 1 and server.requests['/img/3'] == 1
+
+    restarted.get_many([server.url('/img/0')], timeout=5)
+    restarted.close()
+    assert restarted.path(server.url('/img/4')) is None
+    assert restarted.path(server.url('/img/3')) is not None
@@ -0,0 +1,83 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from quantile_sketch import KLLSketch
+
+K = 200
+
+
+@pytest.fixture(scope='module')
+def prices():
+    # Skewed like the catalogue prices, with ties from rounding to the penny
+    return np.round(np.random.default_rng(0).lognormal(3, 1.2, 200_000), 2)
+
+
+def rank_errors(values, edges, exact_edges):
+    """
+    Fraction of the values lying between each approximate edge and the exact one
+    """
+    values = np.sort(values)
+    ranks = np.searchsorted(values, edges, side='right') / len(values)
+    exact_ranks = np.searchsorted(values, exact_edges, side='right') / len(values)
+    return np.abs(ranks - exact_ranks)
+
+
+def test_exact_until_first_compaction():
+    values = np.random.default_rng(1).normal(size=150)
+    sketch = KLLSketch(K, seed=0).update(values)
+    assert not sketch.compacted
+    _, exact_edges = pd.qcut(values, 5, retbins=True)
+    np.testing.assert_allclose(sketch.qcut_edges(5), exact_edges)
+
+
+@pytest.mark.parametrize('q', [5, 10])
+def test_chunked_update_matches_qcut_edges(prices, q):
+    sketch = KLLSketch(K, seed=0)
+    for chunk in np.array_split(prices, 40):
+        sketch.update(pd.Series(chunk))
+    assert sketch.compacted and sketch.count == len(prices)
+    assert sketch.min == prices.min() and sketch.max == prices.max()
+
+    edges = sketch.qcut_edges(q)
+    _, exact_edges = pd.qcut(prices, q, retbins=True)
+    assert edges[0] == exact_edges[0] and edges[-1] == exact_edges[-1]
+    assert rank_errors(prices, edges[1:-1], exact_edges[1:-1]).max() < 2 / K
+
+
+def test_merge_across_parts_matches_qcut_edges(prices):
+    # One sketch per part, as built by separate processes, merged in a different order
+    parts = [KLLSketch(K, seed=seed).update(part) for seed, part in enumerate(np.array_split(prices, 8))]
+    merged = KLLSketch(K, seed=100)
+    for part in parts[::-1]:
+        merged.merge(part)
+    assert merged.count == len(prices)
+
+    _, exact_edges = pd.qcut(prices, 10, retbins=True)
+    assert rank_errors(prices, merged.qcut_edges(10)[1:-1], exact_edges[1:-1]).max() < 2 / K
+
+    with pytest.raises(ValueError):
+        merged.merge(KLLSketch(K + 1))
+
+
+def test_dict_round_trip(prices):
+    sketch = KLLSketch.from_values(prices, k=K, chunksize=25_000, seed=0)
+    restored = KLLSketch.from_dict(json.loads(json.dumps(sketch.to_dict())))
+    assert (restored.k, restored.count, restored.min, restored.max) == (sketch.k, sketch.count, sketch.min, sketch.max)
+    np.testing.assert_array_equal(restored.qcut_edges(5), sketch.qcut_edges(5))
+
+    # A restored sketch keeps accepting updates and merges
+    restored.merge(KLLSketch(K, seed=1).update(prices[:1000]))
+    assert restored.count == len(prices) + 1000
+
+    empty = KLLSketch.from_dict(json.loads(json.dumps(KLLSketch(K).to_dict())))
+    assert empty.count == 0 and np.isnan(empty.quantile(0.5))
+
+
+def test_nan_values_are_ignored():
+    values = np.array([np.nan, 3.0, 1.0, np.nan, 2.0])
+    sketch = KLLSketch(K).update(values)
+    assert sketch.count == 3
+    assert sketch.quantile(0.5) == pd.Series(values).quantile(0.5)
@@ -0,0 +1,25 @@
+from conftest import make_catalog
+from recommendation_service import frame_records, similar_batch
+from recommender_sys import AmazonRecommender
+
+
+def test_similar_batch_reads_and_fills_the_similar_cache():
+    engine = AmazonRecommender(similar_cache_size=256).fit(make_catalog(3000, seed=8), verbose=False)
+    ids = engine.product_data.index[:12].tolist()
+    items = [(product_id, 5, 7) for product_id in ids] + [(ids[0], 5, None), ('unknown', 5, 7)]
+
+    first = similar_batch(engine, items)
+    assert isinstance(first[-1], KeyError)
+    stats = engine.cache_stats()['similar']
+    assert (stats['hits'], stats['misses']) == (0, 12)
+
+    second = similar_batch(engine, items)
+    assert second[:12] == first[:12]
+    assert engine.cache_stats()['similar']['hits'] == 12
+
+    # Batched answers are those of the single call with the same seed
+    assert frame_records(engine.get_similar_products(ids[3], 5, random_state=7)) == first[3]
+    assert engine.cache_stats()['similar']['hits'] == 13
+
+    engine.similar_cache.invalidate()
+    assert similar_batch(engine, items[:3]) == first[:3]
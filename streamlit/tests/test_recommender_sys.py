@@ -0,0 +1,199 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from catalog_dtypes import compact_catalog
+from conftest import make_catalog
+from quantile_sketch import KLLSketch
+from recommender_sys import AmazonRecommender
+
+# A title prefix full of regex metacharacters: it must be matched as plain text
+PREFIX = 'Case (Black) [2-Pack] *Pro+? $9.99'
+
+
+def family_catalog():
+    """
+    Catalogue where a title family and products containing its prefix would win every draw
+
+    The family members share the first '|' segment of their titles; the
+    "contains" products embed that prefix in a longer title. Both are
+    popular and priced like the sources, so only the exclusion keeps them
+    out of the recommendations.
+    """
+    df = make_catalog(2000, seed=3)
+    n = 40
+    extra = pd.DataFrame({
+        'asin': [f"F{i:09d}" for i in range(2 * n)],
+        'title': (
+            [f"{PREFIX} | variant {i}" for i in range(n)] +
+            [f"Deluxe {PREFIX.lower()} holder {i}" for i in range(n)]
+        ),
+        'imgUrl': [f"https://images.example/f{i}.jpg" for i in range(2 * n)],
+        'productURL': [f"https://shop.example/f{i}" for i in range(2 * n)],
+        'stars': 5.0,
+        'reviews': 50000,
+        'price': 20.0,
+        'categoryName': 'Headphones',
+    })
+    return pd.concat([df, extra], ignore_index=True)
+
+
+@pytest.fixture(scope='module')
+def family_recommender():
+    return AmazonRecommender().fit(family_catalog(), verbose=False)
+
+
+def test_segment_picks_exclude_title_family(family_recommender):
+    recommender = family_recommender
+    titles_lower = recommender.product_data['title'].str.lower().to_numpy()
+    sources = np.flatnonzero(pd.Series(titles_lower).str.startswith(PREFIX.lower()).to_numpy())
+    assert len(sources) == 40
+
+    n_picks = 0
+    for position in sources[:10]:
+        source = recommender._similar_source(position)
+        assert source['title_prefix'] == PREFIX.lower()
+        for seed in range(20):
+            picks = recommender._segment_picks(source, seed, always_fallback=True)
+            picked = np.concatenate([
+                np.concatenate([positions, fallback]) for positions, _, fallback, _ in picks
+            ]).astype(np.int64)
+            n_picks += len(picked)
+            assert position not in picked
+            assert not np.any(recommender.family_codes[picked] == recommender.family_codes[position])
+            assert not any(PREFIX.lower() in titles_lower[pick] for pick in picked)
+    assert n_picks > 0
+
+
+def test_similar_products_exclude_title_family(family_recommender):
+    recommender = family_recommender
+    source_id = recommender.product_data.index[
+        recommender.product_data['title'].str.startswith(PREFIX)
+    ][0]
+    for seed in range(10):
+        recommendations = recommender.get_similar_products(source_id, random_state=seed)
+        assert not recommendations.empty
+        assert source_id not in recommendations.index
+        assert not recommendations['title'].str.lower().str.contains(PREFIX.lower(), regex=False).any()
+
+
+@pytest.mark.parametrize('feature_format', ['dense', 'sparse'])
+def test_partial_fit_matches_rebuilt_state(feature_format):
+    full = make_catalog(3000, seed=5)
+    recommender = AmazonRecommender(feature_format=feature_format).fit(full.iloc[:2500], verbose=False)
+    rng = np.random.default_rng(0)
+
+    updated = recommender.product_data.loc[rng.choice(recommender.product_data.index, 100, replace=False)].copy()
+    updated['stars'] = rng.choice([1.0, 3.0, 5.0], len(updated)).astype(np.float32)
+    updated['reviews'] = rng.integers(0, 30000, len(updated)).astype(np.int32)
+    recommender.upsert_products(pd.concat([updated, full.iloc[2500:2600]]), verbose=False)
+    assert not recommender.last_update['rebuilt']
+    recommender.remove_products(rng.choice(recommender.product_data.index, 50, replace=False), verbose=False)
+    assert not recommender.last_update['rebuilt']
+    assert len(recommender.product_data) == 2550
+
+    patched = recommender.leaderboard_order, recommender.leaderboard_scores, recommender.leaderboard_offsets
+    recommender._build_leaderboards()
+    np.testing.assert_array_equal(patched[0], recommender.leaderboard_order)
+    np.testing.assert_array_equal(patched[1], recommender.leaderboard_scores)
+    np.testing.assert_array_equal(patched[2], recommender.leaderboard_offsets)
+
+    numeric, onehot = recommender._encode_rows(recommender.product_data)
+    expected = recommender._assemble_rows(numeric, onehot, recommender._constant_feature_columns())
+    features = recommender.product_features
+    if feature_format == 'sparse':
+        expected, features = expected.toarray(), features.toarray()
+    np.testing.assert_allclose(np.asarray(features), expected, atol=1e-6)
+
+
+def test_outputs_return_csv_prices(catalog):
+    recommender = AmazonRecommender().fit(catalog, verbose=False)
+    source_id = recommender.product_data.index[0]
+    frames = [
+        recommender.get_similar_products(source_id, random_state=0),
+        recommender.get_similar_products_batch(recommender.product_data.index[:5], random_state=0),
+        recommender.get_category_recommendations(recommender.categories[0]),
+        recommender.get_personalized_recommendations(
+            {'categories': recommender.categories[:2], 'min_price': 0, 'max_price': 1000, 'min_rating': 0}
+        ),
+    ]
+    for frame in frames:
+        assert not frame.empty
+        assert frame['price'].dtype == np.float64 and frame['stars'].dtype == np.float64
+        product_ids = frame['product_id'] if 'product_id' in frame.columns else frame.index
+        np.testing.assert_array_equal(frame['price'].to_numpy(), catalog.loc[product_ids, 'price'].round(2).to_numpy())
+
+
+def test_decimal_ratings_pass_their_own_thresholds():
+    # 0.1-step ratings are not exact in float32 (4.2 becomes 4.19999980926 once widened)
+    catalog = make_catalog(3000, seed=4)
+    rng = np.random.default_rng(4)
+    catalog['stars'] = rng.choice([3.0, 4.2, 4.3], len(catalog))
+    recommender = AmazonRecommender().fit(catalog, verbose=False)
+
+    # Price bounds equal to catalogue prices must keep those products too
+    low, high = catalog['price'].quantile([0.2, 0.8], interpolation='nearest')
+    categories = list(recommender.categories[:5])
+    prefs = {'categories': categories, 'min_price': low, 'max_price': high, 'min_rating': 4.2}
+    expected = (
+        catalog['categoryName'].isin(categories) & catalog['price'].between(low, high) & (catalog['stars'] >= 4.2)
+    )
+    recommendations = recommender.get_personalized_recommendations(prefs, n=len(catalog))
+    assert len(recommendations) == expected.sum()
+
+    # Segments 2 and 3 keep products rated at least 4.2, 4.2 included
+    picked_stars = set()
+    for position in range(0, 300, 3):
+        source = recommender._similar_source(position)
+        for positions, _, fallback, _ in recommender._segment_picks(source, 0, always_fallback=True)[1:]:
+            picked = np.concatenate([positions, fallback]).astype(np.int64)
+            picked_stars.update(catalog['stars'].to_numpy()[picked].tolist())
+    assert 4.2 in picked_stars and 3.0 not in picked_stars
+
+
+def test_similar_cache_only_serves_seeded_calls(catalog):
+    recommender = AmazonRecommender(similar_cache_size=64).fit(catalog, verbose=False)
+    source_id = recommender.product_data.index[0]
+    unseeded = [tuple(recommender.get_similar_products(source_id).index) for _ in range(10)]
+    assert len(set(unseeded)) > 1
+    assert recommender.cache_stats()['similar']['misses'] == 0
+
+    seeded = recommender.get_similar_products(source_id, random_state=3)
+    pd.testing.assert_frame_equal(recommender.get_similar_products(source_id, random_state=3), seeded)
+    assert recommender.cache_stats()['similar']['hits'] == 1
+
+
+def test_load_rejects_misaligned_product_data(catalog, tmp_path):
+    recommender = AmazonRecommender(feature_format='sparse').fit(catalog, verbose=False)
+    recommender.save(str(tmp_path))
+    loaded = AmazonRecommender.load(str(tmp_path), product_data=recommender.product_data)
+    assert len(loaded.product_data) == len(catalog)
+
+    reordered = recommender.product_data.iloc[::-1]
+    refiltered = recommender.product_data.set_axis(recommender.product_data.index + len(catalog))
+    for product_data in (reordered, refiltered):
+        with pytest.raises(ValueError):
+            AmazonRecommender.load(str(tmp_path), product_data=product_data)
+
+
+@pytest.mark.parametrize('feature_format', ['dense', 'sparse'])
+def test_fit_from_csv_matches_fit(tmp_path, feature_format):
+    path = str(tmp_path / 'catalog.csv')
+    make_catalog(3000, seed=9).to_csv(path, index=False)
+    streamed = AmazonRecommender(feature_format=feature_format).fit_from_csv(path, chunksize=700, verbose=False)
+    assert streamed.product_data.columns.tolist() == AmazonRecommender._LIGHT_COLUMNS
+
+    # Same price sketch as the first pass, fed with the same chunks
+    price_sketch = KLLSketch(seed=0)
+    for chunk in pd.read_csv(path, chunksize=700):
+        price_sketch.update(compact_catalog(chunk)['price'])
+    fitted = AmazonRecommender(feature_format=feature_format).fit(
+        pd.read_csv(path)[AmazonRecommender._LIGHT_COLUMNS], verbose=False, price_sketch=price_sketch
+    )
+    assert streamed.feature_columns == fitted.feature_columns
+    assert streamed.top_categories == fitted.top_categories
+    np.testing.assert_array_equal(streamed.price_bins, fitted.price_bins)
+    expected, features = fitted.product_features, streamed.product_features
+    if feature_format == 'sparse':
+        expected, features = expected.toarray(), features.toarray()
+    np.testing.assert_array_equal(np.asarray(features), np.asarray(expected))
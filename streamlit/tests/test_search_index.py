@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from conftest import make_catalog
+from search_index import SearchIndex
+
+
+@pytest.fixture(scope='module')
+def indexed():
+    df = make_catalog(5000, seed=2)
+    df.loc[:4, 'title'] = ['USB cable (2m) + plug', 'usb  cable', 'Cable USB', 'Red usb cable ', 'Pro USB CABLE']
+    return df, SearchIndex(df)
+
+
+@pytest.mark.parametrize('query', [
+    'usb', 'USB cable', 'usb cable ', 'cable usb', 'sb cab', 'usb  cable', '(2m) +', 'headphones 4', 'zzz',
+])
+def test_matches_are_titles_containing_the_query(indexed, query):
+    df, index = indexed
+    expected = np.flatnonzero(df['title'].str.contains(query, case=False, regex=False).to_numpy())
+    result = index.search(query)
+    assert result.n_matches == len(expected)
+    np.testing.assert_array_equal(np.sort(result.positions), expected)
+
+
+def test_top_k_is_a_prefix_of_the_full_ranking(indexed):
+    _, index = indexed
+    full = index.search('cable')
+    assert full.n_matches > 100
+    assert np.all(np.diff(full.scores) <= 0)
+    top = index.search('cable', k=50)
+    assert top.n_matches == full.n_matches
+    np.testing.assert_array_equal(top.positions, full.positions[:50])
+    np.testing.assert_array_equal(top.scores, full.scores[:50])
+
+
+def test_empty_query(indexed):
+    _, index = indexed
+    result = index.search('   ')
+    assert result.n_matches == 0 and len(result.positions) == 0
@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_catalog
+from recommender_sys import AmazonRecommender
+from sharded_recommender import SHARD_STRATEGIES, ShardedRecommender
+
+
+@pytest.fixture(scope='module')
+def recommender():
+    return AmazonRecommender().fit(make_catalog(4000, seed=1), verbose=False)
+
+
+@pytest.mark.parametrize('shard_by', SHARD_STRATEGIES)
+def test_sharded_results_match_unsharded(recommender, shard_by):
+    ids = recommender.product_data.index[np.random.default_rng(0).choice(len(recommender.product_data), 60, replace=False)]
+    with ShardedRecommender(recommender, n_shards=3, shard_by=shard_by) as sharded:
+        assert sharded.n_shards > 1
+        for product_id in ids[:20]:
+            pd.testing.assert_frame_equal(
+                sharded.get_similar_products(product_id, 5, random_state=7),
+                recommender.get_similar_products(product_id, 5, random_state=7)
+            )
+        batch = recommender.get_similar_products_batch(ids, 5, random_state=11)
+        assert batch.index.get_level_values('source_id').nunique() > 50
+        pd.testing.assert_frame_equal(sharded.get_similar_products_batch(ids, 5, random_state=11), batch)
+        for category in recommender.categories:
+            for n in (1, 5, 50):
+                pd.testing.assert_frame_equal(
+                    sharded.get_category_recommendations(category, n),
+                    recommender.get_category_recommendations(category, n)
+                )
+        assert sharded.get_category_recommendations('Unknown category').empty